@@ -0,0 +1,35 @@
+# backend/benchmarks/bench_empath.py
+import sys
+import timeit
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+from core import config
+from core.nlp_service import EmpathMatcher, get_empath
+
+SAMPLE_TEXTS = [
+    "Hey there, I'm Kagami. What's on your mind today, or how's your day been so far?",
+    "honestly not much, just got back from practice and my friends are being weird lol",
+    "I think we should probably go to the concert together, it would be so much fun!",
+]
+CATEGORY_SETS = {
+    "configured": config.EMPATH_CATEGORIES,
+    "lexicon": ["positive_emotion", "friends", "music"],
+}
+
+def main(number: int = 2000):
+    print("--- Empath scoring: Empath.analyze vs. compiled EmpathMatcher ---")
+    lexicon = get_empath()
+    for label, categories in CATEGORY_SETS.items():
+        matcher = EmpathMatcher(lexicon, categories)
+        for text in SAMPLE_TEXTS:
+            assert matcher.analyze(text, normalize=True) == lexicon.analyze(text, categories=categories, normalize=True)
+        empath_sec = timeit.timeit(lambda: [lexicon.analyze(t, categories=categories, normalize=True) for t in SAMPLE_TEXTS], number=number)
+        matcher_sec = timeit.timeit(lambda: [matcher.analyze(t, normalize=True) for t in SAMPLE_TEXTS], number=number)
+        calls = number * len(SAMPLE_TEXTS)
+        print(f"[{label}] {categories}")
+        print(f"  Empath.analyze : {empath_sec / calls * 1e6:8.2f} µs/call")
+        print(f"  EmpathMatcher  : {matcher_sec / calls * 1e6:8.2f} µs/call  ({empath_sec / matcher_sec:.1f}x faster)")
+
+if __name__ == "__main__":
+    main()
@@ -1,26 +1,54 @@
 # backend/chatbot_logic.py
 import os
-from openai import AsyncOpenAI
+from openai import AsyncOpenAI, APIConnectionError, APITimeoutError, RateLimitError, InternalServerError
 from core.models import StyleProfile
 from core.prompt_service import generate_dynamic_prompt
+from core.upstream_policy import UpstreamPolicy, CircuitBreaker, RetryBudget
 from core import config
 from core.config import settings
 
+_client: AsyncOpenAI | None = None
+
+def get_openai_client() -> AsyncOpenAI:
+    """One shared client; the SDK's own retries are off because llm_policy decides on retries."""
+    global _client
+    if _client is None:
+        _client = AsyncOpenAI(api_key=settings.OPENAI_API_KEY, max_retries=0, timeout=config.LLM_TURN_DEADLINE_SEC)
+    return _client
+
+def is_retryable_openai_error(error: BaseException) -> bool:
+    return isinstance(error, (APIConnectionError, APITimeoutError, RateLimitError, InternalServerError))
+
+llm_policy = UpstreamPolicy(
+    "openai_chat",
+    deadline_sec=config.LLM_TURN_DEADLINE_SEC,
+    max_attempts=config.LLM_MAX_ATTEMPTS,
+    hedge=config.LLM_HEDGE_ENABLED,
+    hedge_quantile=config.LLM_HEDGE_QUANTILE,
+    hedge_min_samples=config.LLM_HEDGE_MIN_SAMPLES,
+    hedge_default_delay_sec=config.LLM_HEDGE_DEFAULT_DELAY_SEC,
+    hedge_min_delay_sec=config.LLM_HEDGE_MIN_DELAY_SEC,
+    retry_base_delay_sec=config.LLM_RETRY_BASE_DELAY_SEC,
+    is_retryable=is_retryable_openai_error,
+    breaker=CircuitBreaker(config.LLM_BREAKER_FAILURE_THRESHOLD, config.LLM_BREAKER_RESET_SEC),
+    budget=RetryBudget(config.LLM_RETRY_BUDGET_RATIO, config.LLM_RETRY_BUDGET_MAX),
+)
+
 async def get_openai_response(
     user_prompt: str,
     chat_history: list[dict],
     is_adaptive: bool,
-    style_profile: StyleProfile,
-) -> tuple[str, str, dict | None]:
+    style_profile: StyleProfile | None,
+) -> tuple[str, str, dict | None, dict | None]:
     """
     Generates a response from OpenAI using production settings.
     It delegates all prompt creation logic to the prompt_service.
+    style_profile may be None when the prompt does not use it (see prompt_needs_style_profile).
+    The fourth value describes the upstream attempts (see UpstreamPolicy.call).
     """
     if os.getenv("KAGAMI_MOCK") == "1":
         print("--- MOCK MODE ENABLED: Returning canned response. ---")
-        return ("This is a mock response from Kagami.", "mock_system_prompt", None)
-    client = AsyncOpenAI(api_key=settings.OPENAI_API_KEY)
-
+        return ("This is a mock response from Kagami.", "mock_system_prompt", None, None)
 
     # 1. Generate the entire system prompt from the prompt service.
     system_instruction = generate_dynamic_prompt(is_adaptive, style_profile)
@@ -32,17 +60,18 @@ async def get_openai_response(
 
     usage = None
     try:
-        # 3. Call the OpenAI API with production settings.
-        response = await client.chat.completions.create(
+        # 3. Call the OpenAI API with production settings, under the deadline/hedging/retry policy.
+        response, attempt_info = await llm_policy.call(lambda: get_openai_client().chat.completions.create(
             model=config.OPENAI_MODEL_NAME,
             messages=messages,
             temperature=config.TEMPERATURE,
             max_tokens=config.MAX_TOKENS
-        )
+        ))
         response_text = response.choices[0].message.content or "[Blocked or Empty Response]"
         usage = response.usage
     except Exception as e:
         print(f"ERROR: OpenAI API call failed: {e}")
         response_text = "Sorry, an error occurred on my end."
+        attempt_info = {"outcome": getattr(e, "reason", "error"), "error": str(e)}
 
-    return response_text, system_instruction, usage
\ No newline at end of file
+    return response_text, system_instruction, usage, attempt_info
@@ -0,0 +1,71 @@
+# backend/core/admission.py
+import asyncio
+from contextlib import asynccontextmanager
+from typing import Dict
+
+
+class OverloadedError(Exception):
+    """Raised when a limiter can neither run nor queue a request; answered with 503."""
+    def __init__(self, limiter: str, reason: str, retry_after_sec: int):
+        super().__init__(f"{limiter} is overloaded ({reason}).")
+        self.limiter = limiter
+        self.reason = reason
+        self.retry_after_sec = retry_after_sec
+
+
+class AdmissionLimiter:
+    """
+    Caps concurrent work of one kind (LLM calls, NLP inference, avatar generation).
+    Up to `limit` requests run at once and up to `max_queue` more wait for a slot,
+    each for at most `queue_timeout_sec`; anything beyond that is rejected right
+    away with OverloadedError instead of piling up until clients time out.
+    """
+    def __init__(self, name: str, limit: int, max_queue: int, queue_timeout_sec: float, retry_after_sec: int):
+        self.name = name
+        self.limit = limit
+        self.max_queue = max_queue
+        self.queue_timeout_sec = queue_timeout_sec
+        self.retry_after_sec = retry_after_sec
+        self._semaphore = asyncio.Semaphore(limit)
+        self.in_flight = 0
+        self.waiting = 0
+        self.stats = {"admitted": 0, "rejected_queue_full": 0, "rejected_timeout": 0, "max_waiting": 0}
+
+    async def _acquire(self, required: bool):
+        if self.in_flight < self.limit and not self.waiting:
+            await self._semaphore.acquire()
+            return
+        if not required and self.waiting >= self.max_queue:
+            self.stats["rejected_queue_full"] += 1
+            raise OverloadedError(self.name, "queue full", self.retry_after_sec)
+        self.waiting += 1
+        self.stats["max_waiting"] = max(self.stats["max_waiting"], self.waiting)
+        try:
+            if required:
+                await self._semaphore.acquire()
+            else:
+                await asyncio.wait_for(self._semaphore.acquire(), timeout=self.queue_timeout_sec)
+        except asyncio.TimeoutError:
+            self.stats["rejected_timeout"] += 1
+            raise OverloadedError(self.name, "queue timeout", self.retry_after_sec)
+        finally:
+            self.waiting -= 1
+
+    @asynccontextmanager
+    async def slot(self, required: bool = False):
+        """
+        Holds one slot for the duration of the block. `required=True` is for work
+        that finishes an already admitted request: it waits for a slot without the
+        queue bound or timeout, so a half-done turn is never rejected.
+        """
+        await self._acquire(required)
+        self.in_flight += 1
+        self.stats["admitted"] += 1
+        try:
+            yield
+        finally:
+            self.in_flight -= 1
+            self._semaphore.release()
+
+    def snapshot(self) -> Dict[str, int]:
+        return {"limit": self.limit, "max_queue": self.max_queue, "in_flight": self.in_flight, "waiting": self.waiting, **self.stats}
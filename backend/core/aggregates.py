@@ -0,0 +1,233 @@
+# backend/core/aggregates.py
+"""
+Live per-condition study statistics, updated as turns happen instead of being
+recomputed from the JSONL logs. Every figure is a running count, a Welford
+mean/variance or a fixed-size quantile sketch, so updates are O(1) and the
+whole state is a small JSON document that can be snapshotted and restored.
+"""
+import copy
+import json
+import math
+import os
+from pathlib import Path
+from typing import Any, Dict, Iterable, Optional
+
+LATENCY_QUANTILES = (0.5, 0.9, 0.95, 0.99)
+
+
+class RunningStats:
+    """Count, mean, variance, min and max of a stream (Welford's algorithm)."""
+    def __init__(self):
+        self.count, self.mean, self.m2 = 0, 0.0, 0.0
+        self.min: Optional[float] = None
+        self.max: Optional[float] = None
+
+    def add(self, value: float):
+        self.count += 1
+        delta = value - self.mean
+        self.mean += delta / self.count
+        self.m2 += delta * (value - self.mean)
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = value if self.max is None else max(self.max, value)
+
+    @property
+    def variance(self) -> float:
+        return self.m2 / (self.count - 1) if self.count > 1 else 0.0
+
+    def summary(self) -> Dict[str, Any]:
+        return {"count": self.count, "mean": self.mean if self.count else None, "variance": self.variance,
+                "stdev": math.sqrt(self.variance), "min": self.min, "max": self.max}
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {"count": self.count, "mean": self.mean, "m2": self.m2, "min": self.min, "max": self.max}
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "RunningStats":
+        stats = cls()
+        stats.count, stats.mean, stats.m2, stats.min, stats.max = data["count"], data["mean"], data["m2"], data["min"], data["max"]
+        return stats
+
+
+class QuantileSketch:
+    """
+    Log-bucketed histogram of positive values (the DDSketch idea): any quantile
+    is returned within `relative_accuracy` of the true value, and memory grows
+    with the log of the value range rather than with the number of samples.
+    """
+    def __init__(self, relative_accuracy: float = 0.01):
+        self.relative_accuracy = relative_accuracy
+        self.gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self._log_gamma = math.log(self.gamma)
+        self.buckets: Dict[int, int] = {}
+        self.zero_count = 0
+        self.count = 0
+
+    def add(self, value: float):
+        self.count += 1
+        if value <= 1e-9:
+            self.zero_count += 1
+            return
+        index = math.ceil(math.log(value) / self._log_gamma)
+        self.buckets[index] = self.buckets.get(index, 0) + 1
+
+    def quantile(self, q: float) -> Optional[float]:
+        if not self.count: return None
+        rank = q * (self.count - 1)
+        seen = self.zero_count
+        if rank < seen: return 0.0
+        for index in sorted(self.buckets):
+            seen += self.buckets[index]
+            if rank < seen:
+                return 2 * self.gamma ** index / (self.gamma + 1)
+        return 2 * self.gamma ** max(self.buckets) / (self.gamma + 1)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {"relative_accuracy": self.relative_accuracy, "zero_count": self.zero_count, "count": self.count,
+                "buckets": {str(k): v for k, v in self.buckets.items()}}
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "QuantileSketch":
+        sketch = cls(data["relative_accuracy"])
+        sketch.zero_count, sketch.count = data["zero_count"], data["count"]
+        sketch.buckets = {int(k): v for k, v in data["buckets"].items()}
+        return sketch
+
+
+class ConditionAggregates:
+    """Running figures for one experimental condition."""
+    STATS = ("lsm_smoothed", "lsm_raw", "lsm_smoothed_final", "response_latency_sec", "turns_per_session")
+    SKETCHES = ("response_latency_sec", "llm_latency_sec")
+
+    def __init__(self):
+        self.counts: Dict[str, int] = {
+            "sessions_started": 0, "sessions_ended": 0, "turns": 0, "guardrail_fired": 0, "avatars_generated": 0,
+            "prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0,
+        }
+        self.end_reasons: Dict[str, int] = {}
+        self.llm_winners: Dict[str, int] = {}
+        # A gauge of live sessions, rebuilt from the restored sessions at startup rather than snapshotted.
+        self.active_sessions = 0
+        self.stats = {name: RunningStats() for name in self.STATS}
+        self.sketches = {name: QuantileSketch() for name in self.SKETCHES}
+
+    def summary(self) -> Dict[str, Any]:
+        turns = self.counts["turns"]
+        return {
+            **self.counts,
+            "sessions_active": self.active_sessions,
+            "guardrail_rate": self.counts["guardrail_fired"] / turns if turns else None,
+            "end_reasons": dict(self.end_reasons),
+            "llm_winners": dict(self.llm_winners),
+            **{name: stats.summary() for name, stats in self.stats.items()},
+            **{f"{name}_quantiles": {f"p{round(q * 100)}": sketch.quantile(q) for q in LATENCY_QUANTILES}
+               for name, sketch in self.sketches.items()},
+        }
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {"counts": self.counts, "end_reasons": self.end_reasons, "llm_winners": self.llm_winners,
+                "stats": {k: v.to_dict() for k, v in self.stats.items()},
+                "sketches": {k: v.to_dict() for k, v in self.sketches.items()}}
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "ConditionAggregates":
+        aggregates = cls()
+        aggregates.counts.update(data["counts"])
+        aggregates.end_reasons.update(data["end_reasons"])
+        aggregates.llm_winners.update(data["llm_winners"])
+        aggregates.stats.update({k: RunningStats.from_dict(v) for k, v in data["stats"].items()})
+        aggregates.sketches.update({k: QuantileSketch.from_dict(v) for k, v in data["sketches"].items()})
+        return aggregates
+
+
+class AggregatesEngine:
+    """
+    Per-condition aggregates fed by the request handlers. summary() is cached
+    and only rebuilt after an update, so reading it never touches the logs.
+    """
+    SNAPSHOT_VERSION = 1
+
+    def __init__(self, conditions: Iterable[str]):
+        self.conditions: Dict[str, ConditionAggregates] = {name: ConditionAggregates() for name in conditions}
+        self._summary: Optional[Dict[str, Any]] = None
+        self.dirty_since_snapshot = False
+
+    def _condition(self, name: Optional[str]) -> ConditionAggregates:
+        self._summary = None
+        self.dirty_since_snapshot = True
+        return self.conditions.setdefault(name or "unknown", ConditionAggregates())
+
+    def record_session_start(self, condition: str):
+        aggregates = self._condition(condition)
+        aggregates.counts["sessions_started"] += 1
+        aggregates.active_sessions += 1
+
+    def set_active_sessions(self, counts: Dict[str, int]):
+        """Sets the live-session gauges, e.g. from the sessions restored at startup."""
+        for name in set(self.conditions) | set(counts):
+            self.conditions.setdefault(name, ConditionAggregates()).active_sessions = counts.get(name, 0)
+        self._summary = None
+
+    def record_turn(self, condition: str, lsm_raw: float, lsm_smoothed: float, guardrail_fired: bool,
+                    response_latency_sec: float, usage: Optional[Dict[str, int]] = None, llm_attempt: Optional[Dict[str, Any]] = None):
+        aggregates = self._condition(condition)
+        aggregates.counts["turns"] += 1
+        aggregates.counts["guardrail_fired"] += int(guardrail_fired)
+        aggregates.stats["lsm_raw"].add(lsm_raw)
+        aggregates.stats["lsm_smoothed"].add(lsm_smoothed)
+        aggregates.stats["response_latency_sec"].add(response_latency_sec)
+        aggregates.sketches["response_latency_sec"].add(response_latency_sec)
+        for key in ("prompt_tokens", "completion_tokens", "total_tokens"):
+            aggregates.counts[key] += (usage or {}).get(key) or 0
+        if llm_attempt:
+            outcome = llm_attempt.get("winner") or llm_attempt.get("outcome", "unknown")
+            aggregates.llm_winners[outcome] = aggregates.llm_winners.get(outcome, 0) + 1
+            if "total_latency_sec" in llm_attempt:
+                aggregates.sketches["llm_latency_sec"].add(llm_attempt["total_latency_sec"])
+
+    def record_avatar_generated(self, condition: str):
+        self._condition(condition).counts["avatars_generated"] += 1
+
+    def record_session_end(self, condition: str, end_reason: str, turns: int, lsm_smoothed_final: float):
+        aggregates = self._condition(condition)
+        aggregates.counts["sessions_ended"] += 1
+        aggregates.active_sessions = max(0, aggregates.active_sessions - 1)
+        aggregates.end_reasons[end_reason] = aggregates.end_reasons.get(end_reason, 0) + 1
+        aggregates.stats["turns_per_session"].add(turns)
+        aggregates.stats["lsm_smoothed_final"].add(lsm_smoothed_final)
+
+    def summary(self) -> Dict[str, Any]:
+        if self._summary is None:
+            self._summary = {name: aggregates.summary() for name, aggregates in self.conditions.items()}
+        return self._summary
+
+    def snapshot_document(self) -> Dict[str, Any]:
+        """
+        A deep copy of the raw aggregates, taken on the thread that updates them;
+        updates made after this call mark the engine dirty again.
+        """
+        self.dirty_since_snapshot = False
+        return {"version": self.SNAPSHOT_VERSION,
+                "conditions": copy.deepcopy({k: v.to_dict() for k, v in self.conditions.items()})}
+
+    @staticmethod
+    def write_snapshot(document: Dict[str, Any], path: Path):
+        """Writes a snapshot_document() atomically (temp file + rename); safe to run in another thread."""
+        path = Path(path)
+        tmp_path = path.with_name(path.name + ".tmp")
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(document, f)
+        os.replace(tmp_path, path)
+
+    def save(self, path: Path):
+        self.write_snapshot(self.snapshot_document(), path)
+
+    def load(self, path: Path) -> bool:
+        """Restores a snapshot written by save(); returns False if there is none."""
+        path = Path(path)
+        if not path.exists(): return False
+        with open(path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        if data.get("version") != self.SNAPSHOT_VERSION: return False
+        self.conditions.update({k: ConditionAggregates.from_dict(v) for k, v in data["conditions"].items()})
+        self._summary = None
+        return True
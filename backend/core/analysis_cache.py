@@ -0,0 +1,117 @@
+# backend/core/analysis_cache.py
+import hashlib
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Dict, Iterable, Optional
+
+CHUNK_SIZE = 500
+
+
+class AnalysisCache:
+    """
+    Persistent SQLite tier under NLPService's in-memory caches, so analysis
+    survives restarts and is shared with offline re-analysis.
+
+    Values (turn stats, StyleProfiles, formality probabilities, style embeddings)
+    are stored per kind and keyed by the SHA-256 of the text. The file records
+    the analysis fingerprint it was filled under; opening it with a different
+    fingerprint (other models, ANALYSIS_VERSION or feature config) clears it.
+    Beyond `max_entries` rows the least recently used ones are evicted.
+    Errors are reported and treated as misses, so the cache can never break analysis.
+    """
+    def __init__(self, path: Path, fingerprint: str, max_entries: int = 200_000, evict_every: int = 1000):
+        self.path = Path(path)
+        self.fingerprint = fingerprint
+        self.max_entries = max_entries
+        self.evict_every = evict_every
+        self.stats = {"hits": 0, "misses": 0, "writes": 0, "evicted": 0, "errors": 0}
+        self._writes_since_evict = 0
+        self._lock = threading.Lock()
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        # Autocommit mode: every statement is its own transaction; WAL lets several processes share the file.
+        self._conn = sqlite3.connect(self.path, timeout=30, check_same_thread=False, isolation_level=None)
+        with self._lock:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS entries (kind TEXT, text_hash TEXT, value BLOB, last_used REAL, "
+                "PRIMARY KEY (kind, text_hash)) WITHOUT ROWID")
+            self._conn.execute("CREATE INDEX IF NOT EXISTS entries_last_used ON entries (last_used)")
+            row = self._conn.execute("SELECT value FROM meta WHERE key = 'fingerprint'").fetchone()
+            if row is None or row[0] != fingerprint:
+                if row is not None:
+                    print(f"INFO (AnalysisCache): Fingerprint changed ({row[0]} -> {fingerprint}); clearing {self.path}.")
+                self._conn.execute("DELETE FROM entries")
+                self._conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('fingerprint', ?)", (fingerprint,))
+
+    @staticmethod
+    def text_key(text: str) -> str:
+        return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+    def get_many(self, kind: str, texts: Iterable[str]) -> Dict[str, bytes]:
+        """Stored values for the texts that are cached; missing texts are left out."""
+        keys = {self.text_key(text): text for text in texts}
+        found: Dict[str, bytes] = {}
+        try:
+            with self._lock:
+                hashes = list(keys)
+                for start in range(0, len(hashes), CHUNK_SIZE):
+                    chunk = hashes[start:start + CHUNK_SIZE]
+                    placeholders = ",".join("?" * len(chunk))
+                    rows = self._conn.execute(
+                        f"SELECT text_hash, value FROM entries WHERE kind = ? AND text_hash IN ({placeholders})", (kind, *chunk)).fetchall()
+                    for text_hash, value in rows:
+                        found[keys[text_hash]] = value
+                    if rows:
+                        self._conn.execute(
+                            f"UPDATE entries SET last_used = ? WHERE kind = ? AND text_hash IN ({','.join('?' * len(rows))})",
+                            (time.time(), kind, *(text_hash for text_hash, _ in rows)))
+        except sqlite3.Error as e:
+            self.stats["errors"] += 1
+            print(f"ERROR (AnalysisCache): Lookup failed: {e}")
+        self.stats["hits"] += len(found)
+        self.stats["misses"] += len(keys) - len(found)
+        return found
+
+    def get(self, kind: str, text: str) -> Optional[bytes]:
+        return self.get_many(kind, [text]).get(text)
+
+    def put_many(self, kind: str, values: Dict[str, bytes]):
+        if not values: return
+        now = time.time()
+        try:
+            with self._lock:
+                self._conn.executemany(
+                    "INSERT OR REPLACE INTO entries (kind, text_hash, value, last_used) VALUES (?, ?, ?, ?)",
+                    [(kind, self.text_key(text), value, now) for text, value in values.items()])
+                self.stats["writes"] += len(values)
+                self._writes_since_evict += len(values)
+                if self._writes_since_evict >= self.evict_every:
+                    self._evict()
+        except sqlite3.Error as e:
+            self.stats["errors"] += 1
+            print(f"ERROR (AnalysisCache): Write failed: {e}")
+
+    def put(self, kind: str, text: str, value: bytes):
+        self.put_many(kind, {text: value})
+
+    def _evict(self):
+        self._writes_since_evict = 0
+        count = self._conn.execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+        if count <= self.max_entries: return
+        # Evict down to 90% of the cap so eviction does not run on every write.
+        excess = count - int(self.max_entries * 0.9)
+        self._conn.execute(
+            "DELETE FROM entries WHERE (kind, text_hash) IN (SELECT kind, text_hash FROM entries ORDER BY last_used LIMIT ?)", (excess,))
+        self.stats["evicted"] += excess
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
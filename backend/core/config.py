@@ -9,6 +9,14 @@ class Settings(BaseSettings):
 
     FRONTEND_URL: str = "http://localhost:3000"
     BACKEND_URL: str = "http://localhost:8000"
+    # When set, session uploads are copied into this directory instead of Google Drive.
+    UPLOAD_LOCAL_DIR: str = ""
+    # Persistent on-disk tier of the NLP analysis caches (see core/analysis_cache.py).
+    ANALYSIS_CACHE_ENABLED: bool = True
+    # Soft RSS limit in MB; above it caches are shrunk and idle sessions evicted (0 = no limit).
+    MEMORY_SOFT_LIMIT_MB: int = 0
+    # Enables the tracemalloc snapshot/diff endpoints under /api/debug/memory.
+    MEMORY_PROFILING_ENABLED: bool = False
 
     model_config = SettingsConfigDict(env_file=".env", env_file_encoding='utf-8')
 
@@ -19,12 +27,80 @@ settings = Settings()
 DEFAULT_BOT_NAME: str = "Kagami"
 LOG_DIR: str = "experiment_logs"
 SESSION_STATE_DIR: str = "session_state"
+# Under the persistent static-files base (see main.py), so it survives deploys.
+PERSISTENT_STATE_SUBDIR: str = "state"
+SESSION_IDLE_TIMEOUT_SEC: int = 2 * 60 * 60
+SESSION_REAPER_INTERVAL_SEC: int = 5 * 60
+
+# --- Upload Queue Settings ---
+# Under the persistent state directory, with a copy of every queued file, so pending uploads survive deploys.
+UPLOAD_QUEUE_DIR: str = "upload_queue"
+UPLOAD_WORKERS: int = 2
+UPLOAD_BATCH_SIZE: int = 5
+UPLOAD_MAX_ATTEMPTS: int = 8
+UPLOAD_BACKOFF_BASE_SEC: float = 5.0
+UPLOAD_BACKOFF_MAX_SEC: float = 600.0
+
+# --- Admission Control Settings ---
+# (concurrent requests, waiting requests) per kind of work; see core/admission.py.
+LLM_CONCURRENCY_LIMIT: int = 16
+LLM_QUEUE_LIMIT: int = 32
+# NLP work runs on a single thread, so one slot: anything more would just wait unseen in the executor queue.
+NLP_CONCURRENCY_LIMIT: int = 1
+NLP_QUEUE_LIMIT: int = 8
+AVATAR_CONCURRENCY_LIMIT: int = 2
+AVATAR_QUEUE_LIMIT: int = 4
+ADMISSION_QUEUE_TIMEOUT_SEC: float = 10.0
+ADMISSION_RETRY_AFTER_SEC: int = 5
+
+# --- Idempotency Settings ---
+IDEMPOTENCY_RESULTS_PER_SESSION: int = 20
+
+# --- Live Condition Aggregates ---
+AGGREGATES_SNAPSHOT_FILE: str = "aggregates_snapshot.json"
+AGGREGATES_SNAPSHOT_INTERVAL_SEC: int = 60
+
+# --- Memory Budget ---
+MEMORY_CHECK_INTERVAL_SEC: int = 30
+# Under memory pressure, sessions idle this long are dropped from memory (their state stays on disk and is
+# reloaded on their next request); they still end on SESSION_IDLE_TIMEOUT_SEC.
+MEMORY_PRESSURE_EVICT_IDLE_SEC: int = 15 * 60
+# Under memory pressure, style embedding stores of sessions idle this long are written to disk.
+MEMORY_PRESSURE_SPILL_IDLE_SEC: int = 5 * 60
+NLP_CACHE_KEEP_FRACTION: float = 0.5
+TRACEMALLOC_FRAMES: int = 10
 
 # --- OpenAI Model Settings ---
 TEMPERATURE: float = 0.7
 MAX_TOKENS: int = 512
 OPENAI_MODEL_NAME: str = "gpt-4.1-nano"
 
+# --- Upstream LLM Call Policy (see core/upstream_policy.py) ---
+LLM_TURN_DEADLINE_SEC: float = 20.0
+LLM_MAX_ATTEMPTS: int = 3
+LLM_HEDGE_ENABLED: bool = True
+LLM_HEDGE_QUANTILE: float = 0.95
+LLM_HEDGE_MIN_SAMPLES: int = 20
+LLM_HEDGE_DEFAULT_DELAY_SEC: float = 4.0
+LLM_HEDGE_MIN_DELAY_SEC: float = 1.0
+LLM_RETRY_BASE_DELAY_SEC: float = 0.25
+LLM_RETRY_BUDGET_RATIO: float = 0.2
+LLM_RETRY_BUDGET_MAX: float = 10.0
+LLM_BREAKER_FAILURE_THRESHOLD: int = 5
+LLM_BREAKER_RESET_SEC: float = 30.0
+
+# --- NLP Model Settings ---
+SPACY_MODEL_NAME: str = "en_core_web_sm"
+FORMALITY_MODEL_NAME: str = "s-nlp/mdistilbert-base-formality-ranker"
+STYLE_EMBEDDING_MODEL_NAME: str = "StyleDistance/styledistance"
+# Logged with style_similarity_cosine. 1: cosine to the embedding of the joined recent user messages;
+# 2: cosine to the mean of the last 3 per-message user embeddings (see docs/log_schema.json).
+STYLE_SIMILARITY_VERSION: int = 2
+# Bump when analyze_text/compute_lsm change in ways the config below does not capture.
+ANALYSIS_VERSION: int = 3
+ANALYSIS_CACHE_FILE: str = "analysis_cache.sqlite3"
+ANALYSIS_CACHE_MAX_ENTRIES: int = 200_000
+
 # --- LSM & Style Adaptation Settings ---
 LSM_SMOOTHING_ALPHA: float = 0.25
 MIN_LSM_TOKENS_FOR_SMOOTHING: int = 15
@@ -48,6 +124,10 @@ FUNCTION_WORDS: Set[str] = {
     "since","if","unless","until","when","as","that","whether", "no","not","never","none","n't"
 }
 
+# Note: these are LIWC category names; Empath 0.89's lexicon has no categories by these
+# names, so the empath_* scores are currently always 0.0.
+EMPATH_CATEGORIES: list = ["social", "cognitive_processes", "affect"]
+
 LSM_CATEGORIES_SPACY: dict = {
     "pronouns": {"type": "pos", "tags": {"PRON"}},
     "articles": {"type": "pos", "tags": {"DET"}},
@@ -0,0 +1,74 @@
+# backend/core/embedding_store.py
+import numpy as np
+from pathlib import Path
+from typing import List, Optional
+
+
+class StyleEmbeddingStore:
+    """
+    Keeps one StyleDistance embedding per message of a session in a growable
+    float32 array, so each message is encoded once and similarity or windowed
+    averages can be computed from the stored vectors.
+    """
+    def __init__(self):
+        self._vectors: Optional[np.ndarray] = None
+        self._size = 0
+        self.roles: List[str] = []
+        self.turn_numbers: List[int] = []
+
+    def __len__(self) -> int:
+        return self._size
+
+    @property
+    def vectors(self) -> np.ndarray:
+        if self._vectors is None:
+            return np.empty((0, 0), dtype=np.float32)
+        return self._vectors[:self._size]
+
+    def add(self, role: str, turn_number: int, vector) -> int:
+        vector = np.asarray(vector, dtype=np.float32).reshape(-1)
+        if self._vectors is None:
+            self._vectors = np.empty((16, vector.shape[0]), dtype=np.float32)
+        elif self._size == len(self._vectors):
+            self._vectors = np.concatenate([self._vectors, np.empty_like(self._vectors)])
+        self._vectors[self._size] = vector
+        self.roles.append(role)
+        self.turn_numbers.append(turn_number)
+        self._size += 1
+        return self._size - 1
+
+    def latest(self, role: str) -> Optional[np.ndarray]:
+        for i in reversed(range(self._size)):
+            if self.roles[i] == role:
+                return self._vectors[i]
+        return None
+
+    def user_window_mean(self, before_turn: int, max_lookback: int = 3) -> Optional[np.ndarray]:
+        """Mean embedding of the last `max_lookback` user messages sent before `before_turn`."""
+        indices = [i for i in reversed(range(self._size)) if self.roles[i] == "user" and self.turn_numbers[i] < before_turn][:max_lookback]
+        if not indices:
+            return None
+        return self._vectors[indices].mean(axis=0)
+
+    def save(self, path: Path) -> Path:
+        np.savez_compressed(
+            path,
+            vectors=self.vectors,
+            roles=np.array(self.roles),
+            turn_numbers=np.array(self.turn_numbers, dtype=np.int32),
+        )
+        return Path(path)
+
+    @classmethod
+    def load(cls, path: Path) -> "StyleEmbeddingStore":
+        """Reads a store written by save()."""
+        store = cls()
+        with np.load(path) as data:
+            for vector, role, turn_number in zip(data["vectors"], data["roles"], data["turn_numbers"]):
+                store.add(str(role), int(turn_number), vector)
+        return store
+
+    @staticmethod
+    def cosine(a: np.ndarray, b: np.ndarray) -> float:
+        denom = float(np.linalg.norm(a) * np.linalg.norm(b))
+        return float(np.dot(a, b) / denom) if denom else 0.0
@@ -0,0 +1,83 @@
+# backend/core/idempotency.py
+import asyncio
+import hashlib
+import json
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+
+
+class IdempotencyKeyReusedError(Exception):
+    """Raised when an Idempotency-Key comes back with a different request body."""
+    def __init__(self, key: str):
+        super().__init__(f"Idempotency-Key {key} was already used for a different request.")
+        self.key = key
+
+
+class IdempotencyCache:
+    """
+    Remembers the results of requests sent with an Idempotency-Key, per session.
+    A replay of a finished request gets the stored result; a duplicate that
+    arrives while the first one is still running waits for it instead of starting
+    another LLM or image call. Failed requests are not stored, so the client can
+    retry them with the same key. Each session keeps its last `max_per_session` results.
+    Results are stored with a hash of the request body; reusing a key for a different
+    body raises IdempotencyKeyReusedError instead of replaying the other request's result.
+    """
+    def __init__(self, max_per_session: int = 20):
+        self.max_per_session = max_per_session
+        self._results: Dict[str, "OrderedDict[str, Tuple[Optional[str], Any]]"] = {}
+        self._in_flight: Dict[Tuple[str, str], Tuple[Optional[str], asyncio.Future]] = {}
+        self.stats = {"executed": 0, "replayed": 0, "joined": 0}
+
+    @staticmethod
+    def hash_request(body: Any) -> str:
+        return hashlib.sha256(json.dumps(body, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+
+    async def run(self, session_id: str, key: Optional[str], fn: Callable[[], Awaitable[Any]], request_hash: Optional[str] = None) -> Any:
+        if not key:
+            return await fn()
+        results = self._results.get(session_id)
+        if results is not None and key in results:
+            stored_hash, result = results[key]
+            if stored_hash != request_hash: raise IdempotencyKeyReusedError(key)
+            self.stats["replayed"] += 1
+            print(f"INFO (idempotency): Replaying stored result for key {key} in session {session_id}.")
+            return result
+        if (session_id, key) in self._in_flight:
+            in_flight_hash, future = self._in_flight[(session_id, key)]
+            if in_flight_hash != request_hash: raise IdempotencyKeyReusedError(key)
+            self.stats["joined"] += 1
+            try:
+                return await asyncio.shield(future)
+            except asyncio.CancelledError:
+                # The first request was cancelled (e.g. its client disconnected), not this one: run it here.
+                if not future.cancelled(): raise
+                return await self.run(session_id, key, fn, request_hash)
+
+        future = asyncio.get_running_loop().create_future()
+        self._in_flight[(session_id, key)] = (request_hash, future)
+        try:
+            result = await fn()
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            future.exception()  # Mark as retrieved when no duplicate is waiting.
+            raise
+        else:
+            results = self._results.setdefault(session_id, OrderedDict())
+            results[key] = (request_hash, result)
+            while len(results) > self.max_per_session:
+                results.popitem(last=False)
+            future.set_result(result)
+            self.stats["executed"] += 1
+            return result
+        finally:
+            del self._in_flight[(session_id, key)]
+
+    def forget_session(self, session_id: str):
+        self._results.pop(session_id, None)
+
+    def __len__(self) -> int:
+        return sum(len(results) for results in self._results.values())
@@ -0,0 +1,175 @@
+# backend/core/log_archive.py
+"""
+Compact, gzip-compressed session log archives.
+
+An archive is a gzip'd JSONL file. Its first line is a header with the fields
+every event of the session repeats (participant, session and condition), which
+are then left out of the event lines. Each distinct system prompt is stored once
+as a {"_prompt": <hash>, "text": ...} line and events refer to it by hash.
+read_session_archive() restores the original events, in order and with their
+original key order, so restore_session_log() reproduces the JSONL file.
+"""
+import gzip
+import hashlib
+import json
+import os
+from pathlib import Path
+from typing import Any, Dict, Iterator, List
+
+ARCHIVE_FORMAT = "kagami-session-archive"
+ARCHIVE_VERSION = 1
+ARCHIVE_SUFFIX = ".jsonl.gz"
+COMMON_FIELDS = ("participant_id", "session_id", "avatar", "lsm", "avatarType")
+ID_FIELDS = ("participant_id", "session_id")
+PROMPT_FIELD = "system_instruction_used"
+
+
+def archive_path_for(log_path: Path) -> Path:
+    log_path = Path(log_path)
+    return log_path.with_name(log_path.name.removesuffix(".jsonl") + ARCHIVE_SUFFIX)
+
+
+def log_stem(log_path: Path) -> str:
+    """participant_<pid>_<sid> for both raw logs and archives."""
+    name = Path(log_path).name
+    return name.removesuffix(ARCHIVE_SUFFIX).removesuffix(".jsonl")
+
+
+def list_session_logs(log_dir: Path, pattern: str = "participant_*") -> List[Path]:
+    """
+    Raw and archived session logs, one per session. A raw log next to an archive
+    is a fragment written after the session was compacted; the archive is listed
+    and the fragment reported, since compact_session_log() merges it into the archive.
+    """
+    logs = {}
+    for path in sorted(Path(log_dir).glob(pattern + ".jsonl")) + sorted(Path(log_dir).glob(pattern + ARCHIVE_SUFFIX)):
+        stem = log_stem(path)
+        if stem in logs:
+            print(f"WARNING (log_archive): {logs[stem].name} is a fragment of archived {path.name}; "
+                  f"run compact_session_log on it to merge. Listing the archive only.")
+        logs[stem] = path
+    return [logs[stem] for stem in sorted(logs)]
+
+
+def _prompt_hash(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()[:16]
+
+
+def _default_order(record_keys: List[str], common_keys: List[str]) -> List[str]:
+    # log_event writes: timestamp, ids, turn_number, condition fields, event fields.
+    head = [k for k in ("timestamp_utc",) if k in record_keys]
+    ids = [k for k in ID_FIELDS if k in common_keys]
+    turn = [k for k in ("turn_number",) if k in record_keys]
+    condition = [k for k in common_keys if k not in ids]
+    return head + ids + turn + condition + [k for k in record_keys if k not in head and k not in turn]
+
+
+def _expand(record: Dict[str, Any], common: Dict[str, Any], prompts: Dict[str, str]) -> Dict[str, Any]:
+    fields = {}
+    for key, value in record.items():
+        if key == "_prompt_ref":
+            fields[PROMPT_FIELD] = prompts[value]
+        elif key not in ("_missing", "_order"):
+            fields[key] = value
+    restored = [k for k in common if k not in record.get("_missing", ()) and k not in fields]
+    fields.update({k: common[k] for k in restored})
+    order = record.get("_order") or _default_order([k for k in fields if k not in restored], restored)
+    return {k: fields[k] for k in order}
+
+
+def compact_events(events: List[Any]) -> Iterator[Dict[str, Any]]:
+    """Yields the archive lines (header first) for a session's parsed events."""
+    first = next((e for e in events if isinstance(e, dict)), {})
+    common = {k: first[k] for k in COMMON_FIELDS if k in first}
+    yield {"format": ARCHIVE_FORMAT, "version": ARCHIVE_VERSION, "common": common}
+
+    prompts: Dict[str, str] = {}
+    for event in events:
+        if not isinstance(event, dict):
+            yield {"_raw": event}
+            continue
+        record, missing = {}, [k for k in common if k not in event]
+        for key, value in event.items():
+            if key in common and value == common[key] and type(value) is type(common[key]):
+                continue
+            if key == PROMPT_FIELD and isinstance(value, str):
+                prompt_ref = _prompt_hash(value)
+                if prompt_ref not in prompts:
+                    prompts[prompt_ref] = value
+                    yield {"_prompt": prompt_ref, "text": value}
+                record["_prompt_ref"] = prompt_ref
+            else:
+                record[key] = value
+        if missing:
+            record["_missing"] = missing
+        if list(_expand(record, common, prompts)) != list(event):
+            record["_order"] = list(event)
+        yield record
+
+
+def read_session_archive(archive_path: Path) -> Iterator[Any]:
+    """Yields the original events of an archive; unparseable log lines come back as strings."""
+    with gzip.open(archive_path, "rt", encoding="utf-8") as f:
+        header = json.loads(f.readline())
+        if header.get("format") != ARCHIVE_FORMAT:
+            raise ValueError(f"{archive_path} is not a session archive.")
+        common, prompts = header["common"], {}
+        for line in f:
+            record = json.loads(line)
+            if "_prompt" in record:
+                prompts[record["_prompt"]] = record["text"]
+            elif "_raw" in record:
+                yield record["_raw"]
+            else:
+                yield _expand(record, common, prompts)
+
+
+def read_log_lines(log_path: Path) -> Iterator[str]:
+    """Yields the JSONL lines of a raw session log or of an archive."""
+    if Path(log_path).name.endswith(ARCHIVE_SUFFIX):
+        for event in read_session_archive(log_path):
+            yield event if isinstance(event, str) else json.dumps(event)
+    else:
+        with open(log_path, "r", encoding="utf-8") as f:
+            for line in f:
+                if line.strip(): yield line.rstrip("\n")
+
+
+def restore_session_log(archive_path: Path, output_path: Path) -> Path:
+    with open(output_path, "w", encoding="utf-8") as f:
+        for line in read_log_lines(archive_path):
+            f.write(line + "\n")
+    return Path(output_path)
+
+
+def compact_session_log(log_path: Path, remove_original: bool = True) -> Path:
+    """
+    Writes the archive next to a raw session log, checks that it restores the
+    same events (values and key order), and then removes the raw file.
+    If an archive already exists, the raw log's events are appended to it.
+    Returns the archive path.
+    """
+    log_path = Path(log_path)
+    archive_path = archive_path_for(log_path)
+    lines = list(read_log_lines(archive_path)) if archive_path.exists() else []
+    lines += list(read_log_lines(log_path))
+    events = []
+    for line in lines:
+        try:
+            events.append(json.loads(line))
+        except json.JSONDecodeError:
+            events.append(line)
+
+    tmp_path = archive_path.with_name(archive_path.name + ".tmp")
+    with gzip.open(tmp_path, "wt", encoding="utf-8", compresslevel=9) as f:
+        for record in compact_events(events):
+            f.write(json.dumps(record) + "\n")
+
+    restored = list(read_session_archive(tmp_path))
+    if restored != events or [list(e) for e in restored if isinstance(e, dict)] != [list(e) for e in events if isinstance(e, dict)]:
+        os.remove(tmp_path)
+        raise ValueError(f"Archive of {log_path} does not round-trip; keeping the raw log.")
+    os.replace(tmp_path, archive_path)
+    if remove_original:
+        os.remove(log_path)
+    return archive_path
@@ -3,9 +3,10 @@ import os
 import json
 from datetime import datetime, timezone
 from pathlib import Path
+from typing import List
 from . import config
 
-def log_event(event_data: dict, session_info: dict):
+def _resolve_log_path(session_info: dict) -> Path:
     log_file_path = session_info.get("log_file_path")
     if not log_file_path:
         pid = session_info.get("participantId", "unknown")
@@ -14,7 +15,9 @@ def log_event(event_data: dict, session_info: dict):
         print(f"WARNING: Log file path missing. Using fallback: {log_file_path}")
 
     Path(log_file_path).parent.mkdir(exist_ok=True)
-    
+    return log_file_path
+
+def _format_event(event_data: dict, session_info: dict) -> str:
     full_event_data = {
         "timestamp_utc": datetime.now(timezone.utc).isoformat(),
         "participant_id": session_info.get("participantId"),
@@ -23,10 +26,18 @@ def log_event(event_data: dict, session_info: dict):
         **session_info.get("condition", {}), # Unpack condition details
         **event_data,
     }
-    
+    # Use model_dump for Pydantic models if they exist in the data
+    return json.dumps(full_event_data, default=lambda o: o.model_dump() if hasattr(o, 'model_dump') else str(o)) + '\n'
+
+def log_event(event_data: dict, session_info: dict):
+    log_events([event_data], session_info)
+
+def log_events(events: List[dict], session_info: dict):
+    """Appends several events of one session with a single open and write."""
+    if not events: return
+    log_file_path = _resolve_log_path(session_info)
     try:
         with open(log_file_path, 'a', encoding='utf-8') as f:
-            # Use model_dump for Pydantic models if they exist in the data
-            f.write(json.dumps(full_event_data, default=lambda o: o.model_dump() if hasattr(o, 'model_dump') else str(o)) + '\n')
+            f.write("".join(_format_event(event_data, session_info) for event_data in events))
     except Exception as e:
-        print(f"ERROR: Failed to write to log file {log_file_path}: {e}")
\ No newline at end of file
+        print(f"ERROR: Failed to write to log file {log_file_path}: {e}")
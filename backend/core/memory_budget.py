@@ -0,0 +1,164 @@
+# backend/core/memory_budget.py
+"""
+Memory accounting for a process that runs on a fixed-RAM host: estimated bytes
+per component (sessions, caches, model weights), opt-in tracemalloc snapshots,
+and a soft RSS budget that runs relief actions (shrinking caches, evicting idle
+sessions) before the process gets anywhere near the OOM killer.
+"""
+import asyncio
+import ctypes
+import gc
+import os
+import sys
+import tracemalloc
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+import psutil
+
+
+def estimate_bytes(obj: Any) -> int:
+    """
+    Approximate deep size of a Python object graph: containers, pydantic models and
+    plain objects are followed, numpy arrays count their buffer. Shared objects
+    are counted once. An estimate for finding what grows, not an exact figure.
+    """
+    seen = set()
+    total = 0
+    stack = [obj]
+    while stack:
+        current = stack.pop()
+        if id(current) in seen: continue
+        seen.add(id(current))
+        if isinstance(current, np.ndarray):
+            total += sys.getsizeof(current) + (current.nbytes if current.base is None else 0)
+            continue
+        total += sys.getsizeof(current)
+        if isinstance(current, (str, bytes, bytearray, int, float, bool, type(None))):
+            continue
+        if isinstance(current, dict):
+            stack.extend(current.keys())
+            stack.extend(current.values())
+        elif isinstance(current, (list, tuple, set, frozenset)):
+            stack.extend(current)
+        elif hasattr(current, "__dict__"):
+            stack.append(current.__dict__)
+    return total
+
+
+def model_weight_bytes(model) -> int:
+    """Bytes held by the parameters and buffers of a torch module (0 if not loaded)."""
+    if model is None: return 0
+    tensors = list(model.parameters()) + list(model.buffers())
+    return sum(t.numel() * t.element_size() for t in tensors)
+
+
+def trim_heap() -> int:
+    """
+    Runs a full garbage collection and asks glibc to return free heap pages to the
+    OS; without malloc_trim, memory freed by Python often stays in the RSS.
+    Returns the number of objects collected.
+    """
+    collected = gc.collect()
+    try:
+        ctypes.CDLL("libc.so.6").malloc_trim(0)
+    except (OSError, AttributeError):
+        pass  # Not glibc (e.g. macOS, musl): the collection alone has to do.
+    return collected
+
+
+def rss_bytes() -> int:
+    return psutil.Process(os.getpid()).memory_info().rss
+
+
+class AllocationProfiler:
+    """
+    Opt-in tracemalloc hooks. tracing slows every allocation down, so it only
+    starts on the first snapshot request; diff() compares the current heap with
+    the last snapshot, grouped by source line.
+    """
+    def __init__(self, frames: int = 10, top: int = 25):
+        self.frames = frames
+        self.top = top
+        self._baseline: Optional[tracemalloc.Snapshot] = None
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Starts tracing if needed and stores the current heap as the baseline for diff()."""
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(self.frames)
+        self._baseline = tracemalloc.take_snapshot()
+        return {"tracing": True, **self._summary(self._baseline.statistics("lineno"))}
+
+    def diff(self) -> Optional[Dict[str, Any]]:
+        """Allocation growth since the baseline snapshot, or None if there is none."""
+        if self._baseline is None or not tracemalloc.is_tracing(): return None
+        changes = tracemalloc.take_snapshot().compare_to(self._baseline, "lineno")
+        return {
+            "size_diff_bytes": sum(stat.size_diff for stat in changes),
+            "top": [{"location": str(stat.traceback), "size_diff_bytes": stat.size_diff, "size_bytes": stat.size,
+                     "count_diff": stat.count_diff} for stat in changes[:self.top]],
+        }
+
+    def stop(self):
+        self._baseline = None
+        if tracemalloc.is_tracing(): tracemalloc.stop()
+
+    def _summary(self, stats) -> Dict[str, Any]:
+        current, peak = tracemalloc.get_traced_memory()
+        return {"traced_bytes": current, "traced_peak_bytes": peak,
+                "top": [{"location": str(stat.traceback), "size_bytes": stat.size, "count": stat.count} for stat in stats[:self.top]]}
+
+
+class MemoryBudget:
+    """
+    Reports estimated bytes per registered component next to the process RSS,
+    and enforces a soft RSS budget: when RSS is above `soft_limit_bytes`, the
+    relief actions run in registration order (cheapest first) until RSS drops
+    below the limit. A limit of 0 disables enforcement.
+    """
+    def __init__(self, soft_limit_bytes: int = 0):
+        self.soft_limit_bytes = soft_limit_bytes
+        self._components: Dict[str, Tuple[Callable[[], int], Optional[Callable[[Callable[[], int]], Awaitable[int]]]]] = {}
+        self._reliefs: List[Tuple[str, Callable[[], Awaitable[int]]]] = []
+        self.stats = {"checks": 0, "over_budget": 0, "relief_runs": {}}
+
+    def component(self, name: str, estimate: Callable[[], int], runner: Optional[Callable[[Callable[[], int]], Awaitable[int]]] = None):
+        """`runner` runs the estimate on the thread that owns the component; without one it runs on the event loop."""
+        self._components[name] = (estimate, runner)
+
+    def relief(self, name: str, action: Callable[[], Awaitable[int]]):
+        """`action` frees memory and returns how many items (cache entries, sessions) it dropped."""
+        self._reliefs.append((name, action))
+
+    async def report(self) -> Dict[str, Any]:
+        components = {}
+        for name, (estimate, runner) in self._components.items():
+            try:
+                components[name] = await runner(estimate) if runner else estimate()
+            except Exception as e:
+                print(f"ERROR (MemoryBudget): Estimating '{name}' failed: {e}")
+                components[name] = None
+        rss = rss_bytes()
+        return {
+            "rss_bytes": rss, "soft_limit_bytes": self.soft_limit_bytes or None,
+            "over_budget": bool(self.soft_limit_bytes) and rss > self.soft_limit_bytes,
+            "estimated_total_bytes": sum(v for v in components.values() if v), "components": components,
+            **self.stats,
+        }
+
+    async def enforce(self) -> List[Dict[str, Any]]:
+        """Runs relief actions while RSS is over the soft limit; returns what was done."""
+        self.stats["checks"] += 1
+        if not self.soft_limit_bytes or rss_bytes() <= self.soft_limit_bytes: return []
+        self.stats["over_budget"] += 1
+        actions = []
+        for name, action in self._reliefs:
+            rss_before = rss_bytes()
+            if rss_before <= self.soft_limit_bytes: break
+            dropped = await action()
+            await asyncio.to_thread(trim_heap)
+            self.stats["relief_runs"][name] = self.stats["relief_runs"].get(name, 0) + 1
+            actions.append({"action": name, "dropped": dropped, "rss_before_bytes": rss_before, "rss_after_bytes": rss_bytes()})
+            print(f"WARNING (MemoryBudget): RSS {rss_before / 2**20:.0f} MB over soft limit "
+                  f"{self.soft_limit_bytes / 2**20:.0f} MB; '{name}' dropped {dropped}.")
+        return actions
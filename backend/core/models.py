@@ -33,4 +33,24 @@ class StyleProfile(BaseModel):
     empath_affect: float
     pronouns: PronounProfile
     lsm_score_prev: Optional[float] = None
-    error: Optional[str] = None
\ No newline at end of file
+    error: Optional[str] = None
+
+class StyleTurnStats(BaseModel):
+    """Additive per-message statistics; several of these merge into one windowed StyleProfile."""
+    text: str
+    word_count: int
+    word_char_count: int
+    function_word_count: int
+    # The sentencizer's rule over the message without surrounding whitespace (see NLPService._sentence_summary).
+    opens_sentence: bool
+    closes_before_word: bool
+    sentence_breaks: int
+    ends_sentence: bool
+    emoji_count: int
+    question_count: int
+    exclamation_count: int
+    empath_token_count: int
+    empath_counts: Dict[str, float]
+    mentions_short: bool
+    mentions_long: bool
+    pronouns: PronounProfile
@@ -1,18 +1,25 @@
 # core/nlp_service.py
 
 import asyncio
+import hashlib
+import importlib.metadata
+import json
 import re
 import textstat
 import emoji
 import torch
+import numpy as np
 import spacy
 import nltk
 import os
+from pathlib import Path
 from typing import Optional
+from huggingface_hub import try_to_load_from_cache
 from transformers import AutoTokenizer, AutoModelForSequenceClassification
-from sentence_transformers import SentenceTransformer, util
+from sentence_transformers import SentenceTransformer
 
-from .models import StyleProfile, PronounProfile
+from .models import StyleProfile, PronounProfile, StyleTurnStats
+from .analysis_cache import AnalysisCache
 from . import config
 
 NLTK_DATA_PATH = "/home/appuser/nltk_data"
@@ -23,6 +30,7 @@ if os.path.exists(NLTK_DATA_PATH):
 # Lazy-loaded singletons for VADER and Empath
 _SIA = None
 _EMPATH_LEXICON = None
+_EMPATH_MATCHER = None
 
 def get_sia():
     """Lazy-loads and returns the VADER SentimentIntensityAnalyzer."""
@@ -47,10 +55,98 @@ def get_empath():
     return _EMPATH_LEXICON
 
 
+def model_revision(name: str) -> str:
+    """
+    Installed version of the spaCy model package, or the commit of the locally
+    cached Hugging Face snapshot; "unknown" if neither can be found.
+    """
+    if name == config.SPACY_MODEL_NAME:
+        try:
+            return importlib.metadata.version(name)
+        except importlib.metadata.PackageNotFoundError:
+            return "unknown"
+    for filename in ("config.json", "modules.json"):
+        try:
+            path = try_to_load_from_cache(name, filename)
+        except Exception:
+            continue
+        if isinstance(path, str):
+            return Path(path).parent.name  # .../snapshots/<commit>/<filename>
+    return "unknown"
+
+
+def analysis_fingerprint() -> str:
+    """
+    Short hash of everything that determines analysis output: model names and
+    revisions, the analysis version and the feature configuration. Outputs
+    stored under one fingerprint are stale once it changes.
+    """
+    models = [config.SPACY_MODEL_NAME, config.FORMALITY_MODEL_NAME, config.STYLE_EMBEDDING_MODEL_NAME]
+    settings_used = {
+        "version": config.ANALYSIS_VERSION,
+        "models": [f"{name}@{model_revision(name)}" for name in models],
+        "lsm_categories": config.LSM_CATEGORIES_SPACY,
+        "min_lsm_tokens": config.MIN_LSM_TOKENS_FOR_LSM_CALC,
+        "empath_categories": config.EMPATH_CATEGORIES,
+        "function_words": sorted(config.FUNCTION_WORDS),
+        "patterns": [p.pattern for p in (config.INFORMAL_RE, config.HEDGING_RE, config.QUESTION_RE, config.VALID_TOKEN_TEXT_PATTERN)],
+    }
+    encoded = json.dumps(settings_used, sort_keys=True, default=lambda o: sorted(o) if isinstance(o, set) else str(o))
+    return hashlib.sha256(encoded.encode("utf-8")).hexdigest()[:12]
+
+
+class EmpathMatcher:
+    """
+    Empath's analyze() restricted to a fixed list of categories. The lexicon is
+    compiled once into a term -> category-bitmask dict, so scoring a message is
+    one dict lookup per token. Tokens come from str.split(), exactly as Empath's
+    default tokenizer, so counts are identical to Empath's.
+    """
+    def __init__(self, lexicon, categories: list[str]):
+        self.categories = list(categories)
+        self._term_masks: dict[str, int] = {}
+        for bit, category in enumerate(self.categories):
+            for term in lexicon.cats.get(category, ()):
+                self._term_masks[term] = self._term_masks.get(term, 0) | (1 << bit)
+        self._mask_indices = [
+            [bit for bit in range(len(self.categories)) if mask & (1 << bit)]
+            for mask in range(1 << len(self.categories))
+        ]
+
+    def count(self, tokens: list[str]) -> dict[str, float]:
+        counts = [0.0] * len(self.categories)
+        if self._term_masks:
+            term_masks, mask_indices = self._term_masks, self._mask_indices
+            for token in tokens:
+                mask = term_masks.get(token)
+                if mask:
+                    for bit in mask_indices[mask]:
+                        counts[bit] += 1.0
+        return dict(zip(self.categories, counts))
+
+    def analyze(self, text: str, normalize: bool = False) -> dict[str, float] | None:
+        tokens = text.split()
+        counts = self.count(tokens)
+        if normalize:
+            if not tokens: return None
+            counts = {category: count / len(tokens) for category, count in counts.items()}
+        return counts
+
+
+def get_empath_matcher():
+    """Lazy-builds and returns the EmpathMatcher for config.EMPATH_CATEGORIES."""
+    global _EMPATH_MATCHER
+    if _EMPATH_MATCHER is None:
+        _EMPATH_MATCHER = EmpathMatcher(get_empath(), config.EMPATH_CATEGORIES)
+    return _EMPATH_MATCHER
+
+
 class NLPService:
     def __init__(self):
         self._doc_cache = {}
         self.MAX_CACHE_SIZE = 100
+        self._turn_cache = {}
+        self.MAX_TURN_CACHE_SIZE = 1000
         self.is_warmed_up = False
         self._warmup_lock = asyncio.Lock()
         self.spacy_nlp = None
@@ -58,6 +154,23 @@ class NLPService:
         self.formality_tokenizer = None
         self.formality_device = None
         self.style_embedding_model = None
+        self.disk_cache: Optional[AnalysisCache] = None
+
+    def attach_disk_cache(self, path) -> AnalysisCache:
+        """Adds the persistent AnalysisCache tier under the in-memory caches."""
+        self.disk_cache = AnalysisCache(path, analysis_fingerprint(), max_entries=config.ANALYSIS_CACHE_MAX_ENTRIES)
+        print(f"INFO (NLPService): Persistent analysis cache at {path} ({len(self.disk_cache)} entries).")
+        return self.disk_cache
+
+    def shrink_caches(self, keep_fraction: float = 0.5) -> int:
+        """Drops the oldest in-memory profiles and turn stats, keeping `keep_fraction` of each cache. Returns the number dropped."""
+        dropped = 0
+        for cache in (self._doc_cache, self._turn_cache):
+            excess = len(cache) - int(len(cache) * keep_fraction)
+            for text in list(cache)[:excess]:
+                del cache[text]
+            dropped += excess
+        return dropped
 
     async def warm_up(self):
         async with self._warmup_lock:
@@ -65,49 +178,56 @@ class NLPService:
             print("INFO (NLPService): Starting model warm-up...")
             
             # 1. Load spaCy
-            print("INFO (NLPService): Loading spaCy model 'en_core_web_sm'...")
-            self.spacy_nlp = spacy.load("en_core_web_sm", disable=["parser", "ner"])
+            print(f"INFO (NLPService): Loading spaCy model '{config.SPACY_MODEL_NAME}'...")
+            self.spacy_nlp = spacy.load(config.SPACY_MODEL_NAME, disable=["parser", "ner"])
             self.spacy_nlp.add_pipe('sentencizer')
             print(f"INFO (NLPService): spaCy pipeline configured: {self.spacy_nlp.pipe_names}")
 
             # 2. Set up device and load formality model
             self.formality_device = "cpu"
             print(f"INFO (NLPService): Loading models onto device: {self.formality_device}")
-            formality_model_name = "s-nlp/mdistilbert-base-formality-ranker"
+            formality_model_name = config.FORMALITY_MODEL_NAME
             self.formality_tokenizer = AutoTokenizer.from_pretrained(formality_model_name)
             self.formality_model = AutoModelForSequenceClassification.from_pretrained(formality_model_name)
             self.formality_model.to(self.formality_device).eval()
             print(f"INFO (NLPService): Formality model '{formality_model_name}' loaded.")
 
             # 3. Load the specialist Style Embedding Model
-            style_model_name = "StyleDistance/styledistance"
+            style_model_name = config.STYLE_EMBEDDING_MODEL_NAME
             self.style_embedding_model = SentenceTransformer(style_model_name, device=self.formality_device)
             print(f"INFO (NLPService): Style Embedding model '{style_model_name}' loaded.")
+
+            # 4. Compile the Empath categories used by analyze_turn
+            get_empath_matcher()
+            print(f"INFO (NLPService): Empath matcher compiled for {config.EMPATH_CATEGORIES}.")
             
             self.is_warmed_up = True
             print(f"INFO (NLPService): Warm-up complete.")
 
-    def compute_style_similarity(self, text1: str, text2: str) -> float | None:
+    def encode_style(self, texts: list[str]) -> np.ndarray | None:
         """
-        Calculates style similarity using sentence-transformer embeddings.
-        A higher score (closer to 1.0) means better alignment.
+        Encodes texts with the style embedding model in one batch and returns a
+        float32 array with one row per text, or None if the model is unavailable.
         """
-        if not self.is_warmed_up or not text1 or not text2:
+        if not self.is_warmed_up or not texts:
             return None
         try:
-            embeddings = self.style_embedding_model.encode([text1, text2], convert_to_tensor=True)
-            cosine_scores = util.cos_sim(embeddings[0], embeddings[1])
-            return cosine_scores.item()
+            cached = self.disk_cache.get_many("embedding", texts) if self.disk_cache is not None else {}
+            missing = list(dict.fromkeys(text for text in texts if text not in cached))
+            if missing:
+                embeddings = np.asarray(self.style_embedding_model.encode(missing, convert_to_numpy=True), dtype=np.float32)
+                computed = {text: embedding.tobytes() for text, embedding in zip(missing, embeddings)}
+                if self.disk_cache is not None: self.disk_cache.put_many("embedding", computed)
+                cached.update(computed)
+            return np.stack([np.frombuffer(cached[text], dtype=np.float32) for text in texts])
         except Exception as e:
-            print(f"ERROR (compute_style_similarity): Failed to compute embedding similarity: {e}")
+            print(f"ERROR (encode_style): Failed to compute style embeddings: {e}")
             return None
 
-    def compute_lsm(self, text1: str, text2: str) -> float:
-        if not self.is_warmed_up or not text1 or not text2: return 0.5
-        doc1 = self.spacy_nlp(text1)
-        doc2 = self.spacy_nlp(text2)
-        tokens1 = [t for t in doc1 if not t.is_punct and not t.is_space and config.VALID_TOKEN_TEXT_PATTERN.match(t.text)]
-        tokens2 = [t for t in doc2 if not t.is_punct and not t.is_space and config.VALID_TOKEN_TEXT_PATTERN.match(t.text)]
+    def _lsm_tokens(self, doc) -> list:
+        return [t for t in doc if not t.is_punct and not t.is_space and config.VALID_TOKEN_TEXT_PATTERN.match(t.text)]
+
+    def _lsm_from_tokens(self, tokens1: list, tokens2: list) -> float:
         if len(tokens1) < config.MIN_LSM_TOKENS_FOR_LSM_CALC or len(tokens2) < config.MIN_LSM_TOKENS_FOR_LSM_CALC: return 0.5
         scores = []
         for _, rules in config.LSM_CATEGORIES_SPACY.items():
@@ -123,67 +243,266 @@ class NLPService:
             category_score = 1 - (abs(fu - fb) / (fu + fb + 0.0001))
             scores.append(category_score)
         return sum(scores) / len(scores) if scores else 0.5
-    
-    async def analyze_text(self, text: str) -> StyleProfile:
-        if text in self._doc_cache:
-            return self._doc_cache[text]
-        if not self.is_warmed_up: await self.warm_up()
-        if not text: text = " "
 
+    def compute_lsm(self, text1: str, text2: str) -> float:
+        if not self.is_warmed_up or not text1 or not text2: return 0.5
+        # Inside memory_zone so strings of one-off tokens don't accumulate in the shared vocab.
         with self.spacy_nlp.memory_zone():
-            doc = self.spacy_nlp(text)
-            tokens = [token.text.lower() for token in doc if token.text.strip()]
-            word_count = len(tokens)
-            sentence_count = len(list(doc.sents)) or 1
-        
-        informality_prob = None
+            return self._lsm_from_tokens(self._lsm_tokens(self.spacy_nlp(text1)), self._lsm_tokens(self.spacy_nlp(text2)))
+
+    def compute_lsm_batch(self, pairs: list[tuple[str, str]], batch_size: int = 64) -> list[float]:
+        """Batched compute_lsm for offline use; all texts go through one nlp.pipe call."""
+        if not self.is_warmed_up: return [0.5] * len(pairs)
+        texts = [text for pair in pairs for text in pair if text]
+        with self.spacy_nlp.memory_zone():
+            tokens_by_text = {text: self._lsm_tokens(doc) for text, doc in zip(texts, self.spacy_nlp.pipe(texts, batch_size=batch_size))}
+            return [self._lsm_from_tokens(tokens_by_text[t1], tokens_by_text[t2]) if t1 and t2 else 0.5 for t1, t2 in pairs]
+
+    def _sentence_summary(self, doc) -> tuple[bool, bool, int, bool]:
+        """
+        Runs the sentencizer's rule over the message's tokens without leading and
+        trailing whitespace, which is all a window needs to count its sentences:
+        whether a token that can start a sentence (a "word") occurs, whether a
+        sentence-final mark comes before the first one (or anywhere, if there is
+        none), how many sentences start after the first word, and whether the
+        message ends on a sentence-final mark.
+        """
+        punct_chars = self.spacy_nlp.get_pipe("sentencizer").punct_chars
+        tokens = list(doc)
+        while tokens and tokens[0].is_space: tokens.pop(0)
+        while tokens and tokens[-1].is_space: tokens.pop()
+        opens_sentence = closes_before_word = seen_period = False
+        breaks = 0
+        for token in tokens:
+            is_in_punct_chars = token.text in punct_chars
+            if not token.is_punct and not is_in_punct_chars:
+                if not opens_sentence:
+                    opens_sentence, closes_before_word = True, seen_period
+                elif seen_period:
+                    breaks += 1
+                seen_period = False
+            elif is_in_punct_chars:
+                seen_period = True
+        if not opens_sentence: closes_before_word = seen_period
+        return opens_sentence, closes_before_word, breaks, seen_period
+
+    @staticmethod
+    def _joined_sentence_count(turns: list[StyleTurnStats]) -> int:
+        """
+        Sentences the sentencizer finds in the space-joined window. The messages
+        keep their own tokens when joined; what changes is the whitespace between
+        them. The tokenizer turns a whitespace run into one token, minus the single
+        space it absorbs after a preceding token, and a whitespace token starts a
+        sentence after a sentence-final mark like any word does.
+        """
+        breaks, seen_period, has_tokens = 0, False, False
+        pending = ""
+
+        def whitespace_run(run: str):
+            nonlocal breaks, seen_period, has_tokens
+            if has_tokens and run.startswith(" "): run = run[1:]
+            if not run: return
+            breaks += seen_period
+            seen_period, has_tokens = False, True
+
+        for i, turn in enumerate(turns):
+            core = turn.text.strip()
+            if i: pending += " "
+            if not core:
+                pending += turn.text
+                continue
+            whitespace_run(pending + turn.text[:len(turn.text) - len(turn.text.lstrip())])
+            if turn.opens_sentence:
+                breaks += (seen_period or turn.closes_before_word) + turn.sentence_breaks
+                seen_period = turn.ends_sentence
+            else:
+                seen_period = seen_period or turn.closes_before_word
+            has_tokens = True
+            pending = turn.text[len(turn.text.rstrip()):]
+        whitespace_run(pending)
+        return breaks + 1
+
+    def _turn_stats_from_doc(self, text: str, doc) -> StyleTurnStats:
+        tokens = [token.text.lower() for token in doc if token.text.strip()]
+        opens_sentence, closes_before_word, sentence_breaks, ends_sentence = self._sentence_summary(doc)
+        empath_tokens = text.split()
+        lower_text = text.lower()
+
+        return StyleTurnStats(
+            text=text,
+            word_count=len(tokens),
+            word_char_count=sum(len(w) for w in tokens),
+            function_word_count=sum(1 for t in tokens if t in config.FUNCTION_WORDS),
+            opens_sentence=opens_sentence,
+            closes_before_word=closes_before_word,
+            sentence_breaks=sentence_breaks,
+            ends_sentence=ends_sentence,
+            emoji_count=emoji.emoji_count(text),
+            question_count=text.count("?"),
+            exclamation_count=text.count("!"),
+            empath_token_count=len(empath_tokens),
+            empath_counts=get_empath_matcher().count(empath_tokens),
+            mentions_short="short" in lower_text,
+            mentions_long="long" in lower_text,
+            pronouns=PronounProfile(
+                i=bool(re.search(r"\bi\b", lower_text)),
+                you=bool(re.search(r"\byou\b", lower_text)),
+                we=bool(re.search(r"\bwe\b", lower_text)),
+            ),
+        )
+
+    async def analyze_turn(self, text: str) -> StyleTurnStats:
+        """
+        Computes the additive statistics for a single message. Each message is
+        parsed once; windows over several messages reuse the cached result.
+        """
+        if text in self._turn_cache:
+            return self._turn_cache[text]
+        if not self.is_warmed_up: await self.warm_up()
+        return self.analyze_turn_sync(text)
+
+    def analyze_turn_sync(self, text: str) -> StyleTurnStats:
+        """analyze_turn for a warmed-up service, callable from a worker thread."""
+        if text in self._turn_cache:
+            return self._turn_cache[text]
+
+        stored = self.disk_cache.get("turn", text) if self.disk_cache is not None else None
+        if stored is not None:
+            turn_stats = StyleTurnStats.model_validate_json(stored)
+        else:
+            with self.spacy_nlp.memory_zone():
+                turn_stats = self._turn_stats_from_doc(text, self.spacy_nlp(text))
+            if self.disk_cache is not None: self.disk_cache.put("turn", text, turn_stats.model_dump_json().encode("utf-8"))
+
+        if len(self._turn_cache) > self.MAX_TURN_CACHE_SIZE:
+            self._turn_cache.pop(next(iter(self._turn_cache)))
+        self._turn_cache[text] = turn_stats
+
+        return turn_stats
+
+    def predict_informality(self, texts: list[str], batch_size: int = 32) -> list[float | None]:
+        """Probability of the informal class from the formality model, batched."""
+        cached = {text: float(value) for text, value in self.disk_cache.get_many("formality", texts).items()} if self.disk_cache is not None else {}
+        missing = list(dict.fromkeys(text for text in texts if text not in cached))
+        computed = {}
         try:
-            inputs = self.formality_tokenizer(text, return_tensors="pt", truncation=True, max_length=512).to(self.formality_device)
-            with torch.no_grad():
-                logits = self.formality_model(**inputs).logits
-                informality_prob = torch.softmax(logits, dim=-1)[0][1].item()
+            for start in range(0, len(missing), batch_size):
+                batch = missing[start:start + batch_size]
+                inputs = self.formality_tokenizer(batch, return_tensors="pt", truncation=True, max_length=512, padding=True).to(self.formality_device)
+                with torch.no_grad():
+                    logits = self.formality_model(**inputs).logits
+                    computed.update(zip(batch, torch.softmax(logits, dim=-1)[:, 1].tolist()))
         except Exception as e:
             print(f"ERROR (NLPService): Formality inference failed: {e}")
+        if self.disk_cache is not None: self.disk_cache.put_many("formality", {text: repr(prob).encode("utf-8") for text, prob in computed.items()})
+        cached.update(computed)
+        return [cached.get(text) for text in texts]
+
+    def _profile_from_turns(self, turns: list[StyleTurnStats], text: str, informality_prob: float | None) -> StyleProfile:
+        word_count = sum(turn.word_count for turn in turns)
+        sentence_count = self._joined_sentence_count(turns)
+        empath_tokens = sum(turn.empath_token_count for turn in turns)
+        empath_cats = {
+            cat: sum(turn.empath_counts.get(cat, 0.0) for turn in turns) / empath_tokens if empath_tokens else 0.0
+            for cat in config.EMPATH_CATEGORIES
+        }
 
         sentiment = get_sia().polarity_scores(text)
-        empath_cats = get_empath().analyze(text, categories=["social", "cognitive_processes", "affect"], normalize=True) or {}
         lower_text = text.lower()
-        
-        style_profile = StyleProfile(
+        mentions_short = any(turn.mentions_short for turn in turns)
+        mentions_long = any(turn.mentions_long for turn in turns)
+
+        return StyleProfile(
             word_count=word_count,
             informal_score_regex=len(config.INFORMAL_RE.findall(lower_text)) / max(1, word_count),
             informality_score_model=informality_prob,
             hedging_score=len(config.HEDGING_RE.findall(lower_text)) / max(1, word_count),
-            emoji=emoji.emoji_count(text) > 0,
+            emoji=any(turn.emoji_count > 0 for turn in turns),
             questioning=text.strip().endswith("?") or bool(config.QUESTION_RE.match(lower_text)),
-            exclamatory=text.count("!") > 0,
+            exclamatory=any(turn.exclamation_count > 0 for turn in turns),
             short=word_count <= 10,
-            question_count=text.count("?"),
-            exclamation_count=text.count("!"),
-            meta_request="shorter" if "short" in lower_text else "longer" if "long" in lower_text else None,
+            question_count=sum(turn.question_count for turn in turns),
+            exclamation_count=sum(turn.exclamation_count for turn in turns),
+            meta_request="shorter" if mentions_short else "longer" if mentions_long else None,
             sentiment_neg=sentiment["neg"],
             sentiment_neu=sentiment["neu"],
             sentiment_pos=sentiment["pos"],
             sentiment_compound=sentiment["compound"],
             avg_sentence_length=word_count / sentence_count,
-            avg_word_length=sum(len(w) for w in tokens) / max(1, word_count),
+            avg_word_length=sum(turn.word_char_count for turn in turns) / max(1, word_count),
             flesch_reading_ease=textstat.flesch_reading_ease(text),
             fk_grade=textstat.flesch_kincaid_grade(text),
-            function_word_ratio=sum(1 for t in tokens if t in config.FUNCTION_WORDS) / max(1, word_count),
+            function_word_ratio=sum(turn.function_word_count for turn in turns) / max(1, word_count),
             empath_social=empath_cats.get("social", 0.0),
             empath_cognitive=empath_cats.get("cognitive_processes", 0.0),
             empath_affect=empath_cats.get("affect", 0.0),
             pronouns=PronounProfile(
-                i=bool(re.search(r"\bi\b", lower_text)),
-                you=bool(re.search(r"\byou\b", lower_text)),
-                we=bool(re.search(r"\bwe\b", lower_text)),
+                i=any(turn.pronouns.i for turn in turns),
+                you=any(turn.pronouns.you for turn in turns),
+                we=any(turn.pronouns.we for turn in turns),
             ),
         )
 
+    async def analyze_window(self, turns: list[StyleTurnStats]) -> StyleProfile:
+        """
+        Builds the StyleProfile of the space-joined window from per-turn stats.
+        Counts and token totals are summed; the formality model, VADER, textstat
+        and the configured regexes (which can match across the joining space)
+        still run on the joined text, so the result equals analyze_text(joined).
+        """
+        if not self.is_warmed_up: await self.warm_up()
+        return self.analyze_window_sync(turns)
+
+    def analyze_window_sync(self, turns: list[StyleTurnStats]) -> StyleProfile:
+        """analyze_window for a warmed-up service, callable from a worker thread."""
+        text = " ".join(turn.text for turn in turns) or " "
+        if text in self._doc_cache:
+            return self._doc_cache[text]
+
+        stored = self.disk_cache.get("profile", text) if self.disk_cache is not None else None
+        if stored is not None:
+            style_profile = StyleProfile.model_validate_json(stored)
+        else:
+            informality_prob = self.predict_informality([text])[0]
+            style_profile = self._profile_from_turns(turns, text, informality_prob)
+            # A profile without the formality model's score is not final; keep it out of the disk tier.
+            if self.disk_cache is not None and informality_prob is not None:
+                self.disk_cache.put("profile", text, style_profile.model_dump_json().encode("utf-8"))
+
         if len(self._doc_cache) > self.MAX_CACHE_SIZE:
             self._doc_cache.pop(next(iter(self._doc_cache)))
         self._doc_cache[text] = style_profile
 
         return style_profile
 
+    async def analyze_text(self, text: str) -> StyleProfile:
+        # Windows are cached under their joined text, which is " " for an empty message.
+        if (text or " ") in self._doc_cache:
+            return self._doc_cache[text or " "]
+        return await self.analyze_window([await self.analyze_turn(text)])
+
+    def analyze_text_sync(self, text: str) -> StyleProfile:
+        # Windows are cached under their joined text, which is " " for an empty message.
+        if (text or " ") in self._doc_cache:
+            return self._doc_cache[text or " "]
+        return self.analyze_window_sync([self.analyze_turn_sync(text)])
+
+    def analyze_turns(self, texts: list[str], batch_size: int = 64) -> list[StyleTurnStats]:
+        """Batched analyze_turn for offline use; bypasses the in-memory caches but uses the disk tier."""
+        stats = {text: StyleTurnStats.model_validate_json(value) for text, value in self.disk_cache.get_many("turn", texts).items()} if self.disk_cache is not None else {}
+        missing = list(dict.fromkeys(text for text in texts if text not in stats))
+        computed = {}
+        if missing:
+            with self.spacy_nlp.memory_zone():
+                computed = {text: self._turn_stats_from_doc(text, doc) for text, doc in zip(missing, self.spacy_nlp.pipe(missing, batch_size=batch_size))}
+        if self.disk_cache is not None: self.disk_cache.put_many("turn", {text: turn.model_dump_json().encode("utf-8") for text, turn in computed.items()})
+        stats.update(computed)
+        return [stats[text] for text in texts]
+
+    def analyze_windows(self, windows: list[list[StyleTurnStats]]) -> list[StyleProfile]:
+        """Batched analyze_window for offline use; the formality model runs once per batch."""
+        texts = [" ".join(turn.text for turn in turns) or " " for turns in windows]
+        informality_probs = self.predict_informality(texts)
+        return [self._profile_from_turns(turns, text, prob) for turns, text, prob in zip(windows, texts, informality_probs)]
+
 nlp_service = NLPService()
\ No newline at end of file
@@ -3,7 +3,11 @@
 from .models import StyleProfile
 from . import config
 
-def generate_dynamic_prompt(is_adaptive: bool, style_profile: StyleProfile) -> str:
+def prompt_needs_style_profile(is_adaptive: bool) -> bool:
+    """Whether generate_dynamic_prompt reads the StyleProfile; the static prompt does not."""
+    return is_adaptive
+
+def generate_dynamic_prompt(is_adaptive: bool, style_profile: StyleProfile | None) -> str:
     """
     Generates the final system prompt by combining a shared base prompt
     with a condition-specific delta to ensure a controlled experimental manipulation.
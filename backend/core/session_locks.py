@@ -0,0 +1,33 @@
+# backend/core/session_locks.py
+import asyncio
+from contextlib import asynccontextmanager
+from typing import Any, Dict
+
+
+class KeyedLockRegistry:
+    """
+    One asyncio.Lock per key (a session id), so work on the same session runs one
+    request at a time while different sessions run concurrently. A key's lock is
+    dropped as soon as nobody holds or waits for it, so the registry only ever
+    contains sessions with requests in flight.
+    """
+    def __init__(self):
+        self._entries: Dict[str, Dict[str, Any]] = {}
+
+    @asynccontextmanager
+    async def hold(self, key: str):
+        entry = self._entries.setdefault(key, {"lock": asyncio.Lock(), "users": 0})
+        entry["users"] += 1
+        try:
+            async with entry["lock"]:
+                yield
+        finally:
+            entry["users"] -= 1
+            if entry["users"] == 0:
+                del self._entries[key]
+
+    def is_busy(self, key: str) -> bool:
+        return key in self._entries
+
+    def __len__(self) -> int:
+        return len(self._entries)
@@ -0,0 +1,205 @@
+# backend/core/upstream_policy.py
+import asyncio
+import random
+import time
+from collections import deque
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+
+class UpstreamUnavailableError(Exception):
+    """Raised when an upstream call fails fast (circuit open) or runs out of time or attempts."""
+    def __init__(self, reason: str, last_error: Optional[BaseException] = None):
+        super().__init__(f"Upstream unavailable: {reason}" + (f" ({last_error})" if last_error else ""))
+        self.reason = reason
+        self.last_error = last_error
+
+
+class LatencyTracker:
+    """Latencies of recent successful attempts; the hedge delay follows their percentile."""
+    def __init__(self, window: int = 200):
+        self._samples = deque(maxlen=window)
+
+    def record(self, latency_sec: float):
+        self._samples.append(latency_sec)
+
+    def percentile(self, q: float) -> Optional[float]:
+        if not self._samples: return None
+        ordered = sorted(self._samples)
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+    def __len__(self) -> int:
+        return len(self._samples)
+
+
+class CircuitBreaker:
+    """
+    Opens after `failure_threshold` consecutive failed calls and then rejects
+    calls for `reset_timeout_sec`. After that one trial call is let through
+    (half-open); its success closes the breaker, its failure opens it again, and
+    a trial that ends without an outcome (cancelled) re-opens it for another window.
+    """
+    def __init__(self, failure_threshold: int = 5, reset_timeout_sec: float = 30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout_sec = reset_timeout_sec
+        self.state = "closed"
+        self.consecutive_failures = 0
+        self.opened_at = 0.0
+        self.times_opened = 0
+
+    def allow(self) -> bool:
+        if self.state == "open" and time.monotonic() - self.opened_at >= self.reset_timeout_sec:
+            self.state = "half_open"
+            return True
+        return self.state == "closed"
+
+    def record_success(self):
+        self.state, self.consecutive_failures = "closed", 0
+
+    def record_failure(self):
+        self.consecutive_failures += 1
+        if self.state == "half_open" or self.consecutive_failures >= self.failure_threshold:
+            if self.state != "open": self.times_opened += 1
+            self.state, self.opened_at = "open", time.monotonic()
+
+    def record_abandoned(self):
+        """A call ended without telling whether the upstream is healthy; only a half-open trial cares."""
+        if self.state == "half_open":
+            self.state, self.opened_at = "open", time.monotonic()
+
+
+class RetryBudget:
+    """
+    Caps extra attempts (retries and hedges) to a share of the call volume: each
+    call deposits `ratio` tokens up to `max_tokens`, and each extra attempt costs
+    one token. During an outage retries therefore stop instead of multiplying load.
+    """
+    def __init__(self, ratio: float = 0.2, max_tokens: float = 10.0):
+        self.ratio = ratio
+        self.max_tokens = max_tokens
+        self.tokens = max_tokens
+
+    def deposit(self):
+        self.tokens = min(self.max_tokens, self.tokens + self.ratio)
+
+    def withdraw(self) -> bool:
+        if self.tokens < 1: return False
+        self.tokens -= 1
+        return True
+
+
+class UpstreamPolicy:
+    """
+    Runs one logical upstream request within a deadline. The primary attempt may
+    be hedged by a second identical attempt once it runs longer than the recent
+    p95 latency; failed attempts with a retryable error are retried after a
+    jittered exponential delay. Hedges and retries draw from the retry budget,
+    and the whole call is refused while the circuit breaker is open. The first
+    attempt to succeed wins and the others are cancelled.
+    """
+    def __init__(self, name: str, deadline_sec: float, max_attempts: int = 3,
+                 hedge: bool = True, hedge_quantile: float = 0.95, hedge_min_samples: int = 20,
+                 hedge_default_delay_sec: float = 4.0, hedge_min_delay_sec: float = 1.0,
+                 retry_base_delay_sec: float = 0.25, is_retryable: Callable[[BaseException], bool] = lambda e: True,
+                 breaker: Optional[CircuitBreaker] = None, budget: Optional[RetryBudget] = None):
+        self.name = name
+        self.deadline_sec = deadline_sec
+        self.max_attempts = max_attempts
+        self.hedge = hedge
+        self.hedge_quantile = hedge_quantile
+        self.hedge_min_samples = hedge_min_samples
+        self.hedge_default_delay_sec = hedge_default_delay_sec
+        self.hedge_min_delay_sec = hedge_min_delay_sec
+        self.retry_base_delay_sec = retry_base_delay_sec
+        self.is_retryable = is_retryable
+        self.breaker = breaker or CircuitBreaker()
+        self.budget = budget or RetryBudget()
+        self.latencies = LatencyTracker()
+        self.stats = {"calls": 0, "won_by_primary": 0, "won_by_hedge": 0, "won_by_retry": 0,
+                      "deadline_exceeded": 0, "circuit_open": 0, "failed": 0}
+
+    def hedge_delay(self) -> float:
+        if len(self.latencies) < self.hedge_min_samples:
+            return self.hedge_default_delay_sec
+        return max(self.hedge_min_delay_sec, self.latencies.percentile(self.hedge_quantile))
+
+    async def call(self, request: Callable[[], Awaitable[Any]]) -> Tuple[Any, Dict[str, Any]]:
+        """Returns (result, attempt info) or raises UpstreamUnavailableError."""
+        self.stats["calls"] += 1
+        if not self.breaker.allow():
+            self.stats["circuit_open"] += 1
+            raise UpstreamUnavailableError("circuit_open")
+        self.budget.deposit()
+
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        deadline = started + self.deadline_sec
+        hedge_at = started + self.hedge_delay() if self.hedge else None
+        attempts: List[Dict[str, Any]] = []
+        pending: Dict[asyncio.Task, Dict[str, Any]] = {}
+        last_error: Optional[BaseException] = None
+        outcome_recorded = False
+
+        def launch(kind: str, delay: float = 0.0):
+            meta = {"attempt": len(attempts) + 1, "kind": kind, "start": loop.time() + delay}
+            async def run():
+                if delay: await asyncio.sleep(delay)
+                return await request()
+            attempts.append(meta)
+            pending[asyncio.create_task(run())] = meta
+
+        launch("primary")
+        try:
+            while True:
+                now = loop.time()
+                if now >= deadline:
+                    self.stats["deadline_exceeded"] += 1
+                    self.breaker.record_failure()
+                    outcome_recorded = True
+                    raise UpstreamUnavailableError("deadline_exceeded", last_error)
+                if not pending:
+                    self.stats["failed"] += 1
+                    if last_error is None or self.is_retryable(last_error):
+                        self.breaker.record_failure()
+                    else:
+                        # The upstream answered (e.g. a 4xx for this request), so it is reachable.
+                        self.breaker.record_success()
+                    outcome_recorded = True
+                    raise UpstreamUnavailableError("attempts_exhausted", last_error)
+                wake_at = min(deadline, hedge_at) if hedge_at is not None else deadline
+                done, _ = await asyncio.wait(pending, timeout=max(0.0, wake_at - now), return_when=asyncio.FIRST_COMPLETED)
+
+                for task in done:
+                    meta = pending.pop(task)
+                    if task.exception() is None:
+                        latency = loop.time() - meta["start"]
+                        self.latencies.record(latency)
+                        self.breaker.record_success()
+                        outcome_recorded = True
+                        self.stats[f"won_by_{meta['kind']}"] += 1
+                        return task.result(), {
+                            "outcome": "ok", "winner": meta["kind"], "winning_attempt": meta["attempt"],
+                            "attempts": len(attempts), "attempt_latency_sec": latency, "total_latency_sec": loop.time() - started,
+                        }
+                    last_error = task.exception()
+                    print(f"WARNING ({self.name}): Attempt {meta['attempt']} ({meta['kind']}) failed: {last_error}")
+                    if self.is_retryable(last_error) and len(attempts) < self.max_attempts and self.budget.withdraw():
+                        retries = sum(1 for a in attempts if a["kind"] == "retry")
+                        delay = self.retry_base_delay_sec * 2 ** retries * random.uniform(0.5, 1.5)
+                        if loop.time() + delay < deadline: launch("retry", delay)
+
+                if hedge_at is not None and loop.time() >= hedge_at:
+                    hedge_at = None
+                    if pending and len(attempts) < self.max_attempts and self.budget.withdraw():
+                        launch("hedge")
+        finally:
+            # Cancelled (e.g. the caller gave up on the turn) or failed unexpectedly.
+            if not outcome_recorded: self.breaker.record_abandoned()
+            for task in pending:
+                task.cancel()
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            **self.stats, "circuit_state": self.breaker.state, "circuit_opened": self.breaker.times_opened,
+            "retry_budget_tokens": round(self.budget.tokens, 2), "hedge_delay_sec": self.hedge_delay(),
+            "latency_p50_sec": self.latencies.percentile(0.5), "latency_p95_sec": self.latencies.percentile(0.95),
+        }
@@ -11,7 +11,11 @@ def post_process_response(resp: str, is_adaptive: bool) -> str:
     processed_resp = re.sub(r'\n{3,}', '\n\n', processed_resp)
     return processed_resp
 
+def get_recent_user_turns(chat_history: List[Dict[str, str]], max_lookback: int = 3) -> List[str]:
+    """Gets the most recent user turns, newest first."""
+    recent_user_turns = [m["content"] for m in reversed(chat_history) if m["role"] == "user"]
+    return recent_user_turns[:max_lookback]
+
 def get_user_style_sample(chat_history: List[Dict[str, str]], max_lookback: int = 3) -> str:
     """Gets a concatenated string of recent user turns for LSM analysis."""
-    recent_user_turns = [m["content"] for m in reversed(chat_history) if m["role"] == "user"]
-    return " ".join(recent_user_turns[:max_lookback])
\ No newline at end of file
+    return " ".join(get_recent_user_turns(chat_history, max_lookback))
\ No newline at end of file
@@ -1,5 +1,15 @@
 # backend/drive_upload.py
 import os
+import json
+import time
+import uuid
+import random
+import shutil
+import asyncio
+import threading
+from pathlib import Path
+from typing import Dict, List, Optional
+from concurrent.futures import ThreadPoolExecutor
 from google.oauth2 import service_account
 from googleapiclient.discovery import build
 from googleapiclient.http import MediaFileUpload
@@ -8,49 +18,228 @@ LOCAL_SERVICE_ACCOUNT_PATH = 'service_account.json'
 RENDER_SECRET_PATH = '/etc/secrets/service_account.json'
 
 SERVICE_ACCOUNT_FILE = (
-    RENDER_SECRET_PATH 
-    if os.path.exists(RENDER_SECRET_PATH) 
+    RENDER_SECRET_PATH
+    if os.path.exists(RENDER_SECRET_PATH)
     else LOCAL_SERVICE_ACCOUNT_PATH
 )
 
 SCOPES = ['https://www.googleapis.com/auth/drive']
 
-def authenticate_drive():
-    """Authenticate with Google Drive using a service account."""
+def load_drive_credentials():
+    """Loads the service account credentials used for Google Drive."""
     if not os.path.exists(SERVICE_ACCOUNT_FILE):
         raise FileNotFoundError(
             f"Service account file not found. Checked: {RENDER_SECRET_PATH} and {LOCAL_SERVICE_ACCOUNT_PATH}"
         )
-    
+
     print(f"INFO (drive_upload): Authenticating with service account file at: {SERVICE_ACCOUNT_FILE}")
-    credentials = service_account.Credentials.from_service_account_file(
+    return service_account.Credentials.from_service_account_file(
         SERVICE_ACCOUNT_FILE, scopes=SCOPES)
-    return build('drive', 'v3', credentials=credentials)
-
-def upload_log_to_drive(log_filepath: str, session_id: str, drive_folder_id: str):
-    if not drive_folder_id:
-        print(f"ERROR (drive_upload): GOOGLE_DRIVE_FOLDER_ID was not provided for session {session_id}.")
-        return
-
-    if not os.path.exists(log_filepath):
-        print(f"ERROR (drive_upload): Log file not found at {log_filepath} for session {session_id}.")
-        return
-    
-    try:
-        drive = authenticate_drive()
-        filename = os.path.basename(log_filepath)
+
+def authenticate_drive():
+    """Authenticate with Google Drive using a service account."""
+    return build('drive', 'v3', credentials=load_drive_credentials())
+
+
+# --- Upload Backends ---
+class DriveBackend:
+    """
+    Uploads files into a Google Drive folder. Credentials are loaded once; the
+    Drive client is built once per upload thread, since googleapiclient clients
+    are not thread-safe.
+    """
+    def __init__(self, drive_folder_id: str):
+        self.drive_folder_id = drive_folder_id
+        self._credentials = None
+        self._credentials_lock = threading.Lock()
+        self._local = threading.local()
+
+    def _client(self):
+        client = getattr(self._local, "client", None)
+        if client is None:
+            with self._credentials_lock:
+                if self._credentials is None:
+                    self._credentials = load_drive_credentials()
+            client = self._local.client = build('drive', 'v3', credentials=self._credentials, cache_discovery=False)
+        return client
+
+    def upload(self, filepath: str, mimetype: str) -> str:
+        if not self.drive_folder_id:
+            raise ValueError("GOOGLE_DRIVE_FOLDER_ID was not provided.")
         file_metadata = {
-            'name': filename,
-            'mimeType': 'application/jsonl', 
-            'parents': [drive_folder_id]
+            'name': os.path.basename(filepath),
+            'mimeType': mimetype,
+            'parents': [self.drive_folder_id]
         }
-        media = MediaFileUpload(log_filepath, mimetype='application/jsonl', resumable=True)
-        uploaded = drive.files().create(body=file_metadata, media_body=media, fields='id').execute()
-        print(f"✅ (drive_upload): Successfully uploaded log {filename} (ID: {uploaded.get('id')}) for session {session_id}.")
-    except Exception as e:
-        print(f"--- ❌ CRITICAL ERROR IN drive_upload ---")
-        print(f"Session ID: {session_id}")
-        print(f"Log Filepath: {log_filepath}")
-        import traceback
-        traceback.print_exc()
-        print(f"-----------------------------------------")
\ No newline at end of file
+        media = MediaFileUpload(filepath, mimetype=mimetype, resumable=True)
+        uploaded = self._client().files().create(body=file_metadata, media_body=media, fields='id').execute()
+        return uploaded.get('id')
+
+
+class LocalDirectoryBackend:
+    """Copies files into a local directory; a stand-in for Drive in tests and local runs."""
+    def __init__(self, target_dir: str):
+        self.target_dir = Path(target_dir)
+        self.target_dir.mkdir(parents=True, exist_ok=True)
+
+    def upload(self, filepath: str, mimetype: str) -> str:
+        return str(shutil.copy2(filepath, self.target_dir / os.path.basename(filepath)))
+
+
+# --- Durable Upload Queue ---
+class UploadQueue:
+    """
+    Uploads files in the background without losing them across restarts.
+
+    Every job is a small JSON file in `queue_dir` until its upload succeeds, so
+    jobs pending at shutdown are picked up again by start(). The file itself is
+    copied into `queue_dir/files` when it is queued, so a queue on a persistent
+    disk does not depend on the original surviving a restart. A bounded number of
+    workers upload on a dedicated thread pool, take up to `batch_size` ready
+    jobs at a time, and retry failures with jittered exponential backoff. Jobs
+    that exhaust `max_attempts` are moved to `queue_dir/failed`.
+    """
+    def __init__(self, backend, queue_dir: str, workers: int = 2, batch_size: int = 5,
+                 max_attempts: int = 8, backoff_base_sec: float = 5.0, backoff_max_sec: float = 600.0):
+        self.backend = backend
+        self.queue_dir = Path(queue_dir)
+        self.failed_dir = self.queue_dir / "failed"
+        self.files_dir = self.queue_dir / "files"
+        self.workers = workers
+        self.batch_size = max(1, batch_size)
+        self.max_attempts = max_attempts
+        self.backoff_base_sec = backoff_base_sec
+        self.backoff_max_sec = backoff_max_sec
+        self.stats = {"uploaded": 0, "retried": 0, "failed": 0}
+        self._ready: Optional[asyncio.Queue] = None
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._tasks: List[asyncio.Task] = []
+        self._outstanding = 0
+        self._idle = asyncio.Event()
+        self._idle.set()
+        self.queue_dir.mkdir(parents=True, exist_ok=True)
+
+    def _job_path(self, job: Dict) -> Path:
+        return self.queue_dir / f"{job['id']}.json"
+
+    def _persist(self, job: Dict):
+        tmp_path = self._job_path(job).with_suffix(".tmp")
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(job, f)
+        os.replace(tmp_path, self._job_path(job))
+
+    def _track(self, delta: int):
+        self._outstanding += delta
+        if self._outstanding > 0: self._idle.clear()
+        else: self._idle.set()
+
+    def _schedule(self, job: Dict):
+        delay = job.get("next_attempt_at", 0) - time.time()
+        if delay > 0:
+            asyncio.get_running_loop().call_later(delay, self._ready.put_nowait, job)
+        else:
+            self._ready.put_nowait(job)
+
+    def _stage(self, job_id: str, filepath: str) -> Path:
+        """Copies the file under files/<job id>/, keeping its name (which is the name it is uploaded under)."""
+        staged_dir = self.files_dir / job_id
+        staged_dir.mkdir(parents=True, exist_ok=True)
+        staged_path = staged_dir / os.path.basename(filepath)
+        tmp_path = staged_path.with_name(staged_path.name + ".tmp")
+        shutil.copy2(filepath, tmp_path)
+        os.replace(tmp_path, staged_path)
+        return staged_path
+
+    def enqueue(self, filepath: str, session_id: str, mimetype: str = 'application/jsonl') -> Dict:
+        job_id = uuid.uuid4().hex
+        job = {"id": job_id, "filepath": str(self._stage(job_id, filepath)), "source_path": str(filepath),
+               "session_id": session_id, "mimetype": mimetype, "attempts": 0, "next_attempt_at": 0, "created_at": time.time()}
+        self._persist(job)
+        self._track(1)
+        if self._ready is not None:
+            self._schedule(job)
+        return job
+
+    @property
+    def pending_count(self) -> int:
+        return self._outstanding
+
+    async def start(self):
+        """Loads jobs left on disk and starts the workers."""
+        if self._ready is not None: return
+        self._ready = asyncio.Queue()
+        self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="upload")
+        known = self._outstanding
+        jobs = []
+        for job_file in self.queue_dir.glob("*.json"):
+            try:
+                with open(job_file, 'r', encoding='utf-8') as f: jobs.append(json.load(f))
+            except Exception as e:
+                print(f"ERROR (drive_upload): Could not read queued upload {job_file}: {e}")
+        for job in sorted(jobs, key=lambda j: j.get("created_at", 0)):
+            self._schedule(job)
+        # Copies staged by an enqueue that stopped before its job file was written.
+        known_ids = {job["id"] for job in jobs} | {p.stem for p in self.failed_dir.glob("*.json")}
+        for staged_dir in self.files_dir.glob("*"):
+            if staged_dir.name not in known_ids: shutil.rmtree(staged_dir, ignore_errors=True)
+        self._track(len(jobs) - known)
+        if jobs: print(f"INFO (drive_upload): Resuming {len(jobs)} pending uploads.")
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    async def stop(self):
+        for task in self._tasks: task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        if self._executor: self._executor.shutdown(wait=False)
+        self._ready, self._executor = None, None
+
+    async def join(self):
+        """Waits until every queued job has been uploaded or given up."""
+        await self._idle.wait()
+
+    def _upload_batch(self, batch: List[Dict]) -> List[Optional[str]]:
+        errors = []
+        for job in batch:
+            try:
+                if not os.path.exists(job["filepath"]):
+                    raise FileNotFoundError(f"File not found at {job['filepath']}")
+                file_id = self.backend.upload(job["filepath"], job["mimetype"])
+                print(f"✅ (drive_upload): Uploaded {os.path.basename(job['filepath'])} (ID: {file_id}) for session {job['session_id']}.")
+                errors.append(None)
+            except Exception as e:
+                errors.append(f"{type(e).__name__}: {e}")
+        return errors
+
+    def _finish(self, job: Dict, error: Optional[str]):
+        if error is None:
+            self._job_path(job).unlink(missing_ok=True)
+            shutil.rmtree(self.files_dir / job["id"], ignore_errors=True)
+            self.stats["uploaded"] += 1
+            self._track(-1)
+            return
+        job["attempts"] += 1
+        job["last_error"] = error
+        if job["attempts"] >= self.max_attempts or error.startswith("FileNotFoundError"):
+            self.failed_dir.mkdir(exist_ok=True)
+            self._persist(job)
+            os.replace(self._job_path(job), self.failed_dir / self._job_path(job).name)
+            self.stats["failed"] += 1
+            self._track(-1)
+            print(f"ERROR (drive_upload): Giving up on {job['filepath']} for session {job['session_id']} after {job['attempts']} attempts: {error}")
+            return
+        delay = min(self.backoff_max_sec, self.backoff_base_sec * 2 ** (job["attempts"] - 1)) * random.uniform(0.5, 1.5)
+        job["next_attempt_at"] = time.time() + delay
+        self._persist(job)
+        self.stats["retried"] += 1
+        print(f"WARNING (drive_upload): Upload of {job['filepath']} failed ({error}); retry {job['attempts']} in {delay:.0f}s.")
+        self._schedule(job)
+
+    async def _worker(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self._ready.get()]
+            while len(batch) < self.batch_size and not self._ready.empty():
+                batch.append(self._ready.get_nowait())
+            errors = await loop.run_in_executor(self._executor, self._upload_batch, batch)
+            for job, error in zip(batch, errors):
+                self._finish(job, error)
@@ -0,0 +1,250 @@
+# backend/export_logs.py
+"""
+Exports the JSONL experiment logs to Parquet for analysis.
+
+Every participant_* log (raw .jsonl or compacted .jsonl.gz archive) becomes
+one Parquet file under <out-dir>/events/.
+Columns follow docs/log_schema.json: nested objects such as the StyleProfile
+traits are flattened into typed columns (e.g. "user_linguistic_traits.word_count"),
+fields the schema does not describe are kept as JSON in "extra_json", and a
+derived "condition" column names the 3x2 condition (e.g. "premade_adaptive").
+
+<out-dir>/index.parquet holds one row per (log, participant, session, condition,
+event_type) with event counts and the source file's size and mtime, so re-runs
+only export new or changed logs and load_events() can skip irrelevant files.
+
+Usage:
+    poetry install --with analysis
+    poetry run python export_logs.py [--log-dir experiment_logs] [--out-dir analysis_export]
+"""
+import argparse
+import json
+import os
+import time
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+
+from core import config
+from core.log_archive import list_session_logs, log_stem, read_log_lines
+
+SCHEMA_PATH = Path(__file__).resolve().parent.parent / "docs" / "log_schema.json"
+DEFAULT_OUT_DIR = "analysis_export"
+INDEX_FILENAME = "index.parquet"
+REANALYSIS_MARKER = ".reanalysis_"
+
+ARROW_TYPES = {
+    "string": pa.string(),
+    "integer": pa.int64(),
+    "number": pa.float64(),
+    "boolean": pa.bool_(),
+    "object": pa.string(),
+}
+INDEX_SCHEMA = pa.schema([
+    ("source_file", pa.string()),
+    ("source_size", pa.int64()),
+    ("source_mtime_ns", pa.int64()),
+    ("parquet_file", pa.string()),
+    ("participant_id", pa.string()),
+    ("session_id", pa.string()),
+    ("condition", pa.string()),
+    ("event_type", pa.string()),
+    ("n_events", pa.int64()),
+])
+
+
+def _json_type(prop: Dict[str, Any]) -> str:
+    types = prop.get("type", "string")
+    if isinstance(types, list):
+        types = next((t for t in types if t != "null"), "string")
+    return types
+
+
+def flatten_schema(schema: Dict[str, Any]) -> Dict[str, str]:
+    """Maps every flattened column name (dot-separated path) to its JSON type."""
+    definitions = schema.get("definitions", {})
+
+    def walk(properties: Dict[str, Any], prefix: str) -> Dict[str, str]:
+        columns = {}
+        for name, prop in properties.items():
+            if "$ref" in prop:
+                prop = definitions[prop["$ref"].split("/")[-1]]
+            if _json_type(prop) == "object" and "properties" in prop:
+                columns.update(walk(prop["properties"], f"{prefix}{name}."))
+            elif prop.get("format") == "date-time":
+                columns[f"{prefix}{name}"] = "date-time"
+            else:
+                columns[f"{prefix}{name}"] = _json_type(prop)
+        return columns
+
+    return walk(schema["properties"], "")
+
+
+def arrow_schema_for(columns: Dict[str, str]) -> pa.Schema:
+    fields = [pa.field(name, pa.timestamp("us", tz="UTC") if json_type == "date-time" else ARROW_TYPES.get(json_type, pa.string()))
+              for name, json_type in columns.items()]
+    return pa.schema(fields + [pa.field("condition", pa.string()), pa.field("extra_json", pa.string())])
+
+
+def condition_label(event: Dict[str, Any]) -> Optional[str]:
+    """Rebuilds the start_session condition name from the logged condition flags."""
+    avatar_type, lsm = event.get("avatarType"), event.get("lsm")
+    if avatar_type is None or lsm is None:
+        return None
+    return f"{avatar_type}_{'adaptive' if lsm else 'static'}"
+
+
+def _coerce(value: Any, json_type: str) -> Any:
+    if value is None:
+        return None
+    try:
+        if json_type == "date-time":
+            return datetime.fromisoformat(value)
+        if json_type == "integer":
+            return int(value) if not isinstance(value, bool) else None
+        if json_type == "number":
+            return float(value) if not isinstance(value, bool) else None
+        if json_type == "boolean":
+            return value if isinstance(value, bool) else None
+        if json_type == "object":
+            return json.dumps(value, ensure_ascii=False)
+        return value if isinstance(value, str) else json.dumps(value, ensure_ascii=False)
+    except (TypeError, ValueError):
+        return None
+
+
+def _flatten_event(event: Dict[str, Any], columns: Dict[str, str]) -> Dict[str, Any]:
+    row, extra = {}, {}
+
+    def walk(obj: Dict[str, Any], prefix: str):
+        for key, value in obj.items():
+            name = f"{prefix}{key}"
+            if name in columns:
+                row[name] = _coerce(value, columns[name])
+            elif isinstance(value, dict) and any(c.startswith(f"{name}.") for c in columns):
+                walk(value, f"{name}.")
+            else:
+                extra[name] = value
+
+    walk(event, "")
+    row["condition"] = condition_label(event)
+    row["extra_json"] = json.dumps(extra, ensure_ascii=False, default=str) if extra else None
+    return row
+
+
+def read_log_table(log_path: Path, columns: Dict[str, str], schema: pa.Schema) -> pa.Table:
+    """Streams one session log (raw or archived) into a typed Arrow table."""
+    data: Dict[str, List[Any]] = {name: [] for name in schema.names}
+    for line in read_log_lines(log_path):
+        try:
+            event = json.loads(line)
+        except json.JSONDecodeError:
+            continue
+        row = _flatten_event(event, columns)
+        for name in schema.names:
+            data[name].append(row.get(name))
+    return pa.table(data, schema=schema)
+
+
+def _index_rows(table: pa.Table, source: Path, stat: os.stat_result, parquet_file: str) -> List[Dict[str, Any]]:
+    keys = ["participant_id", "session_id", "condition", "event_type"]
+    if table.num_rows == 0:
+        return []
+    grouped = table.select(keys).group_by(keys, use_threads=False).aggregate([("event_type", "count")])
+    return [
+        {"source_file": source.name, "source_size": stat.st_size, "source_mtime_ns": stat.st_mtime_ns,
+         "parquet_file": parquet_file, **{k: row[k] for k in keys}, "n_events": row["event_type_count"]}
+        for row in grouped.to_pylist()
+    ]
+
+
+def load_index(out_dir: Path) -> pa.Table:
+    index_path = Path(out_dir) / INDEX_FILENAME
+    return pq.read_table(index_path) if index_path.exists() else INDEX_SCHEMA.empty_table()
+
+
+def export_logs(log_dir: Path, out_dir: Path, schema_path: Path = SCHEMA_PATH) -> Dict[str, int]:
+    """Exports new or changed logs, drops outputs of deleted logs and rewrites the index."""
+    log_dir, out_dir = Path(log_dir), Path(out_dir)
+    events_dir = out_dir / "events"
+    events_dir.mkdir(parents=True, exist_ok=True)
+    columns = flatten_schema(json.loads(Path(schema_path).read_text(encoding='utf-8')))
+    schema = arrow_schema_for(columns)
+
+    # Keyed by log stem, so a raw log that was compacted into an archive replaces its own output.
+    previous: Dict[str, List[Dict[str, Any]]] = {}
+    for row in load_index(out_dir).to_pylist():
+        previous.setdefault(log_stem(row["source_file"]), []).append(row)
+
+    index_rows, summary = [], {"exported": 0, "unchanged": 0, "removed": 0, "events": 0}
+    sources = [p for p in list_session_logs(log_dir) if REANALYSIS_MARKER not in p.name]
+    for source in sources:
+        stat = source.stat()
+        parquet_file = f"events/{log_stem(source)}.parquet"
+        known = previous.pop(log_stem(source), [])
+        # Logs with no events have no index rows and are simply re-read each run.
+        if known and known[0]["source_file"] == source.name and known[0]["source_size"] == stat.st_size and known[0]["source_mtime_ns"] == stat.st_mtime_ns \
+                and (out_dir / parquet_file).exists():
+            index_rows.extend(known)
+            summary["unchanged"] += 1
+            continue
+        table = read_log_table(source, columns, schema)
+        tmp_path = out_dir / f"{parquet_file}.tmp"
+        pq.write_table(table, tmp_path)
+        os.replace(tmp_path, out_dir / parquet_file)
+        index_rows.extend(_index_rows(table, source, stat, parquet_file))
+        summary["exported"] += 1
+        summary["events"] += table.num_rows
+
+    for stale_rows in previous.values():
+        (out_dir / stale_rows[0]["parquet_file"]).unlink(missing_ok=True)
+        summary["removed"] += 1
+
+    tmp_index = out_dir / f"{INDEX_FILENAME}.tmp"
+    pq.write_table(pa.Table.from_pylist(index_rows, schema=INDEX_SCHEMA), tmp_index)
+    os.replace(tmp_index, out_dir / INDEX_FILENAME)
+    return summary
+
+
+def load_events(out_dir: Path, columns: Optional[List[str]] = None, **filters: str) -> pa.Table:
+    """
+    Loads exported events, e.g. load_events(out, condition="premade_adaptive",
+    event_type="bot_response"). Filters on participant_id, session_id, condition
+    and event_type first select files via the index, then the matching rows.
+    """
+    out_dir = Path(out_dir)
+    index = load_index(out_dir)
+    mask = None
+    for key, value in filters.items():
+        condition = pc.equal(index[key], value)
+        mask = condition if mask is None else pc.and_(mask, condition)
+    if mask is not None:
+        index = index.filter(mask)
+    files = list(dict.fromkeys(index["parquet_file"].to_pylist()))
+    if not files:
+        return pa.table({})
+    read_columns = None if columns is None else list(dict.fromkeys(columns + list(filters)))
+    table = pa.concat_tables([pq.read_table(out_dir / f, columns=read_columns) for f in files], promote_options="default")
+    for key, value in filters.items():
+        table = table.filter(pc.equal(table[key], value))
+    return table if columns is None else table.select(columns)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export experiment logs to Parquet with an index.")
+    parser.add_argument("--log-dir", default=config.LOG_DIR, help="Directory holding participant_* logs.")
+    parser.add_argument("--out-dir", default=DEFAULT_OUT_DIR, help="Directory for the Parquet files and index.")
+    args = parser.parse_args()
+
+    start_time = time.time()
+    summary = export_logs(Path(args.log_dir), Path(args.out_dir))
+    print(f"INFO (export_logs): {summary['exported']} logs exported ({summary['events']} events), "
+          f"{summary['unchanged']} unchanged, {summary['removed']} removed in {time.time() - start_time:.1f}s.")
+
+
+if __name__ == "__main__":
+    main()
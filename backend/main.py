@@ -12,28 +12,40 @@ import time
 import httpx
 import base64
 import json
+import sys
 from pathlib import Path  
 from typing import Dict, List, Any, Optional
 from datetime import datetime, timezone
 import requests
 import psutil
-from fastapi import FastAPI, HTTPException, BackgroundTasks
+from fastapi import FastAPI, HTTPException, Request, Header
+from fastapi.responses import JSONResponse
 from fastapi.staticfiles import StaticFiles
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
 from core.config import settings 
 from contextlib import asynccontextmanager
+from concurrent.futures import ThreadPoolExecutor
+from collections import Counter, OrderedDict
 
 
 # --- Local Core Service & Logic Imports ---
 from core import config
 from core.nlp_service import nlp_service
 from core.config import settings
-from core.logging_service import log_event
+from core.logging_service import log_event, log_events
 from core.models import StyleProfile
-from core.utils import post_process_response, get_user_style_sample
-from chatbot_logic import get_openai_response
-from drive_upload import upload_log_to_drive
+from core.embedding_store import StyleEmbeddingStore
+from core.log_archive import compact_session_log
+from core.admission import AdmissionLimiter, OverloadedError
+from core.session_locks import KeyedLockRegistry
+from core.idempotency import IdempotencyCache, IdempotencyKeyReusedError
+from core.aggregates import AggregatesEngine
+from core.memory_budget import MemoryBudget, AllocationProfiler, estimate_bytes, model_weight_bytes
+from core.utils import post_process_response, get_recent_user_turns
+from core.prompt_service import prompt_needs_style_profile
+from chatbot_logic import get_openai_response, llm_policy
+from drive_upload import UploadQueue, DriveBackend, LocalDirectoryBackend
 
 
 # --- Environment-Aware Path Configuration ---
@@ -49,8 +61,54 @@ else:
 STATIC_FILES_BASE_PATH.mkdir(parents=True, exist_ok=True)
 
 GENERATED_AVATAR_DIR = STATIC_FILES_BASE_PATH / "generated"
+GENERATED_AVATAR_DIR.mkdir(exist_ok=True)
+# Service state that has to survive deploys (analysis cache, condition aggregates, upload queue). It shares the
+# persistent disk with the avatars, which is why only the avatar directory is served under /static.
+PERSISTENT_STATE_DIR = STATIC_FILES_BASE_PATH / config.PERSISTENT_STATE_SUBDIR
+PERSISTENT_STATE_DIR.mkdir(exist_ok=True)
 REPO_STATIC_DIR = Path(__file__).parent / "static"
 
+upload_queue = UploadQueue(
+    LocalDirectoryBackend(settings.UPLOAD_LOCAL_DIR) if settings.UPLOAD_LOCAL_DIR else DriveBackend(settings.GOOGLE_DRIVE_FOLDER_ID),
+    PERSISTENT_STATE_DIR / config.UPLOAD_QUEUE_DIR,
+    workers=config.UPLOAD_WORKERS,
+    batch_size=config.UPLOAD_BATCH_SIZE,
+    max_attempts=config.UPLOAD_MAX_ATTEMPTS,
+    backoff_base_sec=config.UPLOAD_BACKOFF_BASE_SEC,
+    backoff_max_sec=config.UPLOAD_BACKOFF_MAX_SEC,
+)
+
+
+
+# Requests for one session run one at a time; different sessions run concurrently.
+session_locks = KeyedLockRegistry()
+# Results of message/avatar requests by Idempotency-Key, so client retries are not re-run.
+idempotency_cache = IdempotencyCache(max_per_session=config.IDEMPOTENCY_RESULTS_PER_SESSION)
+
+CONDITION_DETAILS = {
+    "generated_adaptive": {"avatar": True, "lsm": True, "avatarType": "generated"},
+    "generated_static":   {"avatar": True, "lsm": False, "avatarType": "generated"},
+    "premade_adaptive":   {"avatar": True, "lsm": True, "avatarType": "premade"},
+    "premade_static":     {"avatar": True, "lsm": False, "avatarType": "premade"},
+    "none_adaptive":      {"avatar": False, "lsm": True, "avatarType": "none"},
+    "none_static":        {"avatar": False, "lsm": False, "avatarType": "none"},
+}
+
+# Per-condition study figures, updated by the handlers and snapshotted to disk.
+aggregates = AggregatesEngine(CONDITION_DETAILS)
+AGGREGATES_SNAPSHOT_PATH = PERSISTENT_STATE_DIR / config.AGGREGATES_SNAPSHOT_FILE
+
+memory_budget = MemoryBudget(soft_limit_bytes=settings.MEMORY_SOFT_LIMIT_MB * 2**20)
+allocation_profiler = AllocationProfiler(frames=config.TRACEMALLOC_FRAMES)
+
+admission = {
+    name: AdmissionLimiter(name, limit, max_queue, config.ADMISSION_QUEUE_TIMEOUT_SEC, config.ADMISSION_RETRY_AFTER_SEC)
+    for name, limit, max_queue in (
+        ("llm", config.LLM_CONCURRENCY_LIMIT, config.LLM_QUEUE_LIMIT),
+        ("nlp", config.NLP_CONCURRENCY_LIMIT, config.NLP_QUEUE_LIMIT),
+        ("avatar", config.AVATAR_CONCURRENCY_LIMIT, config.AVATAR_QUEUE_LIMIT),
+    )
+}
 
 
 # --- Lifespan ---
@@ -61,6 +119,8 @@ async def lifespan(app: FastAPI):
     Handles application startup and shutdown events.
     """
     print("INFO (main.py): Application startup.")
+    if settings.ANALYSIS_CACHE_ENABLED and nlp_service.disk_cache is None:
+        nlp_service.attach_disk_cache(PERSISTENT_STATE_DIR / config.ANALYSIS_CACHE_FILE)
     if os.getenv("KAGAMI_SKIP_WARMUP") != "1":
         print("INFO (main.py): Triggering background NLP model warm-up...")
         asyncio.create_task(nlp_service.warm_up())
@@ -68,16 +128,31 @@ async def lifespan(app: FastAPI):
         print("INFO (main.py): KAGAMI_SKIP_WARMUP is set. Skipping model warm-up.")
     
     load_all_session_states()
+    await upload_queue.start()
+    load_aggregates_snapshot()
+    aggregates.set_active_sessions(Counter(s.get("condition_name_from_frontend") or "unknown" for s in _sessions.values()))
+    reaper_task = asyncio.create_task(reap_idle_sessions())
+    snapshot_task = asyncio.create_task(snapshot_aggregates_periodically())
+    memory_task = asyncio.create_task(watch_memory_budget()) if memory_budget.soft_limit_bytes else None
     print("INFO (main.py): Server is live.")
     
     yield
+    reaper_task.cancel()
+    snapshot_task.cancel()
+    if memory_task: memory_task.cancel()
+    allocation_profiler.stop()
+    save_aggregates_snapshot()
+    await upload_queue.stop()
+    global _nlp_executor
+    if _nlp_executor: _nlp_executor.shutdown(wait=False)
+    _nlp_executor = None
     print("INFO (main.py): Application shutdown.")
 
 
 # --- FastAPI Setup ---
 app = FastAPI(lifespan=lifespan)
 
-app.mount("/static", StaticFiles(directory=STATIC_FILES_BASE_PATH), name="persistent_static")
+app.mount("/static/generated", StaticFiles(directory=GENERATED_AVATAR_DIR), name="persistent_static")
 
 # CORS Setup
 origins = [
@@ -96,14 +171,26 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["Retry-After"],
 )
 
+@app.exception_handler(OverloadedError)
+async def overloaded_handler(request: Request, exc: OverloadedError):
+    print(f"WARNING: Rejected {request.url.path}: {exc}")
+    return JSONResponse(status_code=503, content={"detail": str(exc)}, headers={"Retry-After": str(exc.retry_after_sec)})
+
+@app.exception_handler(IdempotencyKeyReusedError)
+async def idempotency_key_reused_handler(request: Request, exc: IdempotencyKeyReusedError):
+    return JSONResponse(status_code=422, content={"detail": str(exc)})
+
 
 
 # --- App State & Startup ---
 _sessions: Dict[str, Dict[str, Any]] = {}
+# Sessions dropped from memory under memory pressure: session id -> last activity. Their state file is current.
+_evicted_sessions: Dict[str, float] = {}
+_style_embeddings: Dict[str, StyleEmbeddingStore] = {}
 os.makedirs(config.LOG_DIR, exist_ok=True)
-os.makedirs(GENERATED_AVATAR_DIR, exist_ok=True)
 
 
 # --- Pydantic Models (API Contracts) ---
@@ -127,6 +214,16 @@ class FrontendEventRequest(BaseModel):
     participantId: Optional[str] = None
     eventType: str
     eventData: Dict[str, Any] = {}
+class FrontendEventItem(BaseModel):
+    seq: int
+    eventType: str
+    eventData: Dict[str, Any] = {}
+    clientTimestamp: Optional[str] = None
+class FrontendEventBatchRequest(BaseModel):
+    sessionId: Optional[str] = None
+    participantId: Optional[str] = None
+    clientId: str
+    events: List[FrontendEventItem]
 class SetAvatarDetailsRequest(BaseModel):
     sessionId: str
     avatarUrl: str
@@ -150,7 +247,7 @@ def get_session_state_file_path(session_id: str) -> Path:
     session_dir = Path(__file__).parent / config.SESSION_STATE_DIR
     session_dir.mkdir(exist_ok=True)
     return session_dir / f"{session_id}.json"
-def save_session_state(session_id: str):
+def save_session_state(session_id: str) -> bool:
     if session_data := _sessions.get(session_id):
         try:
             serializable_data = session_data.copy()
@@ -158,20 +255,237 @@ def save_session_state(session_id: str):
                 serializable_data["log_file_path"] = str(serializable_data["log_file_path"])
             with open(get_session_state_file_path(session_id), 'w', encoding='utf-8') as f:
                 json.dump(serializable_data, f, ensure_ascii=False, indent=2)
+            return True
         except Exception as e:
             print(f"ERROR: Failed to save session {session_id} state to disk: {e}")
+    return False
+def read_session_state_file(filepath: Path) -> Dict[str, Any]:
+    with open(filepath, 'r', encoding='utf-8') as f: session_data = json.load(f)
+    if isinstance(session_data.get("log_file_path"), str):
+        session_data["log_file_path"] = Path(session_data["log_file_path"])
+    session_data.setdefault("last_activity", filepath.stat().st_mtime)
+    return session_data
 def load_all_session_states():
     session_state_dir_path = Path(__file__).parent / config.SESSION_STATE_DIR
     if not session_state_dir_path.exists(): return
     for filepath in session_state_dir_path.glob('*.json'):
         try:
-            with open(filepath, 'r', encoding='utf-8') as f: session_data = json.load(f)
+            session_data = read_session_state_file(filepath)
             if session_id := session_data.get("sessionId"):
-                if isinstance(session_data.get("log_file_path"), str):
-                    session_data["log_file_path"] = Path(session_data["log_file_path"])
                 _sessions[session_id] = session_data
         except Exception as e: print(f"ERROR: Failed to load session from {filepath}: {e}")
     print(f"INFO: Loaded {len(_sessions)} active sessions.")
+def get_session(session_id: str) -> Optional[Dict[str, Any]]:
+    """The live session, reloading it from its state file if it was evicted under memory pressure."""
+    if (session := _sessions.get(session_id)) is not None or session_id not in _evicted_sessions:
+        return session
+    try:
+        session = _sessions[session_id] = read_session_state_file(get_session_state_file_path(session_id))
+    except Exception as e:
+        print(f"ERROR: Failed to reload evicted session {session_id}: {e}")
+        return None
+    del _evicted_sessions[session_id]
+    return session
+def record_style_embeddings(session_id: str, session: Dict[str, Any], user_message: str, bot_response: str) -> Optional[float]:
+    """
+    Encodes this turn's user message and reply once, keeps them in the session's
+    embedding store and returns the cosine between the reply and the mean of the
+    recent user-message embeddings (the current message on the first turn).
+    """
+    turn = session["turn_number"]
+    store = _style_embeddings.get(session_id)
+    backlog = []
+    if store is None and style_embeddings_path(session).exists():
+        # Spilled to disk under memory pressure (or before a restart).
+        store = _style_embeddings[session_id] = StyleEmbeddingStore.load(style_embeddings_path(session))
+    elif store is None:
+        # Sessions resumed from disk have no stored vectors yet; encode their history once (not the turn-0 greeting).
+        store = _style_embeddings[session_id] = StyleEmbeddingStore()
+        backlog = [m for m in session["history"] if m.get("content") and 0 < m.get("turn_number", 0) < turn]
+    vectors = nlp_service.encode_style([m["content"] for m in backlog] + [user_message, bot_response])
+    if vectors is None:
+        if not len(store): _style_embeddings.pop(session_id, None)
+        return None
+    for message, vector in zip(backlog, vectors):
+        store.add(message["role"], message.get("turn_number", 0), vector)
+    store.add("user", turn, vectors[-2])
+    store.add("assistant", turn, vectors[-1])
+    window = store.user_window_mean(before_turn=turn)
+    return store.cosine(vectors[-2] if window is None else window, vectors[-1])
+def style_embeddings_path(session: Dict[str, Any]) -> Path:
+    log_path = Path(session["log_file_path"])
+    return log_path.with_name(f"{log_path.stem}_style_embeddings.npz")
+def spill_style_embeddings(session_id: str, session: Dict[str, Any]) -> int:
+    """Saves a session's embedding store and drops it from memory; runs on the NLP thread, the caller holds the session lock."""
+    store = _style_embeddings.get(session_id)
+    if store is None: return 0
+    store.save(style_embeddings_path(session))
+    _style_embeddings.pop(session_id, None)
+    return 1
+def export_style_embeddings(session_id: str, session: Dict[str, Any]) -> Optional[Path]:
+    store = _style_embeddings.pop(session_id, None)
+    if store is None and style_embeddings_path(session).exists():
+        store = StyleEmbeddingStore.load(style_embeddings_path(session))
+    if not store or not len(store): return None
+    try:
+        embeddings_path = store.save(style_embeddings_path(session))
+    except Exception as e:
+        print(f"ERROR: Failed to export style embeddings for session {session_id}: {e}")
+        return None
+    log_event({"event_type": "style_embeddings_exported", "embeddings_file": str(embeddings_path),
+               "embedding_count": len(store), "embedding_dim": store.vectors.shape[1]}, session_info=session)
+    return embeddings_path
+async def finalize_session(session_id: str, session: Dict[str, Any], end_reason: str) -> List[tuple[str, str]]:
+    """
+    Ends a session: logs session_end, drops its in-memory and on-disk state and
+    compacts its log into a gzip archive. Returns the (path, mimetype) pairs to upload.
+    The caller holds the session lock.
+    """
+    embeddings_path = export_style_embeddings(session_id, session)
+    log_event({"event_type": "session_end", "end_reason": end_reason}, session_info=session)
+    aggregates.record_session_end(session.get("condition_name_from_frontend"), end_reason,
+                                  session.get("turn_number", 0), session.get("smoothed_lsm_score", 0.5))
+
+    # Dropped before compaction: from here on, late events for this session go to its fallback log
+    # instead of being appended to (and lost from) the log that is being compacted.
+    _sessions.pop(session_id, None)
+    _evicted_sessions.pop(session_id, None)
+    idempotency_cache.forget_session(session_id)
+    # Event batches the client replays after the session ended are still deduplicated.
+    for seq_key, seq in session.get("frontend_event_seqs", {}).items():
+        remember_frontend_event_seq(seq_key, seq)
+    filepath = get_session_state_file_path(session_id)
+    if filepath.exists():
+        try:
+            os.remove(filepath)
+        except Exception as e:
+            print(f"ERROR: Failed to delete session state file {filepath}: {e}")
+
+    log_path = Path(session["log_file_path"])
+    try:
+        uploads = [(str(await asyncio.to_thread(compact_session_log, log_path)), "application/gzip")]
+    except Exception as e:
+        print(f"ERROR: Failed to compact log {log_path} for session {session_id}: {e}")
+        uploads = [(str(log_path), "application/jsonl")]
+    if embeddings_path:
+        uploads.append((str(embeddings_path), "application/octet-stream"))
+    return uploads
+def write_aggregates_snapshot(document: Dict[str, Any]):
+    try:
+        AggregatesEngine.write_snapshot(document, AGGREGATES_SNAPSHOT_PATH)
+    except Exception as e:
+        print(f"ERROR: Failed to save aggregates snapshot {AGGREGATES_SNAPSHOT_PATH}: {e}")
+def save_aggregates_snapshot():
+    if aggregates.dirty_since_snapshot:
+        write_aggregates_snapshot(aggregates.snapshot_document())
+def load_aggregates_snapshot():
+    try:
+        if aggregates.load(AGGREGATES_SNAPSHOT_PATH):
+            print(f"INFO (main.py): Restored condition aggregates from {AGGREGATES_SNAPSHOT_PATH}.")
+    except Exception as e:
+        print(f"ERROR: Failed to load aggregates snapshot {AGGREGATES_SNAPSHOT_PATH}: {e}")
+async def snapshot_aggregates_periodically():
+    """Writes the condition aggregates to disk every config.AGGREGATES_SNAPSHOT_INTERVAL_SEC if they changed."""
+    while True:
+        await asyncio.sleep(config.AGGREGATES_SNAPSHOT_INTERVAL_SEC)
+        if not aggregates.dirty_since_snapshot: continue
+        # The copy is taken on the loop, where the handlers update the aggregates; only the write is offloaded.
+        await asyncio.to_thread(write_aggregates_snapshot, aggregates.snapshot_document())
+async def reap_sessions_idle_for(idle_sec: float, end_reason: str) -> int:
+    """Finalizes sessions (evicted ones included) idle longer than `idle_sec`, oldest first; returns how many were finalized."""
+    now = time.time()
+    reaped = 0
+    last_activity = {**_evicted_sessions, **{sid: s.get("last_activity", now) for sid, s in _sessions.items()}}
+    for sid, last_active in sorted(last_activity.items(), key=lambda item: item[1]):
+        if now - last_active < idle_sec or session_locks.is_busy(sid):
+            continue
+        try:
+            async with session_locks.hold(sid):
+                session = get_session(sid)
+                if session is None or now - session.get("last_activity", now) < idle_sec: continue
+                print(f"INFO: Reaping idle session {sid} ({end_reason}).")
+                uploads = await finalize_session(sid, session, end_reason)
+            reaped += 1
+            if "demo_user" not in session.get("participantId", ""):
+                for path, mimetype in uploads:
+                    upload_queue.enqueue(path, sid, mimetype)
+        except Exception as e:
+            print(f"ERROR: Failed to reap idle session {sid}: {e}")
+    return reaped
+async def reap_idle_sessions():
+    """Finalizes sessions that have been idle longer than config.SESSION_IDLE_TIMEOUT_SEC."""
+    while True:
+        await asyncio.sleep(config.SESSION_REAPER_INTERVAL_SEC)
+        await reap_sessions_idle_for(config.SESSION_IDLE_TIMEOUT_SEC, "idle_timeout")
+async def on_nlp_thread(fn, *args):
+    # The NLP caches, the style embedding stores and spaCy's vocab are only touched from the NLP thread.
+    return await asyncio.get_running_loop().run_in_executor(get_nlp_executor(), fn, *args)
+async def spill_style_embeddings_under_pressure() -> int:
+    """Spills the embedding stores of sessions idle longer than config.MEMORY_PRESSURE_SPILL_IDLE_SEC."""
+    now = time.time()
+    spilled = 0
+    for sid in list(_style_embeddings):
+        session = _sessions.get(sid)
+        if session is None or now - session.get("last_activity", now) < config.MEMORY_PRESSURE_SPILL_IDLE_SEC or session_locks.is_busy(sid):
+            continue
+        # Under the session lock, so a turn or finalize_session cannot touch the store while it is written.
+        async with session_locks.hold(sid):
+            if _sessions.get(sid) is not session: continue
+            try:
+                spilled += await on_nlp_thread(spill_style_embeddings, sid, session)
+            except Exception as e:
+                print(f"ERROR: Failed to spill style embeddings for session {sid}: {e}")
+    return spilled
+async def shrink_nlp_caches() -> int:
+    return await on_nlp_thread(nlp_service.shrink_caches, config.NLP_CACHE_KEEP_FRACTION)
+async def evict_idle_sessions_under_pressure() -> int:
+    """
+    Drops sessions idle longer than config.MEMORY_PRESSURE_EVICT_IDLE_SEC from memory once their
+    state is on disk. They are not ended: get_session reloads them on their next request.
+    """
+    now = time.time()
+    evicted = 0
+    for sid, session in sorted(_sessions.items(), key=lambda item: item[1].get("last_activity", now)):
+        if now - session.get("last_activity", now) < config.MEMORY_PRESSURE_EVICT_IDLE_SEC or session_locks.is_busy(sid):
+            continue
+        async with session_locks.hold(sid):
+            if _sessions.get(sid) is not session or not save_session_state(sid): continue
+            try:
+                await on_nlp_thread(spill_style_embeddings, sid, session)
+            except Exception as e:
+                print(f"ERROR: Failed to spill style embeddings for session {sid}: {e}")
+                continue
+            del _sessions[sid]
+            _evicted_sessions[sid] = session.get("last_activity", now)
+        evicted += 1
+    return evicted
+async def watch_memory_budget():
+    """Checks RSS against settings.MEMORY_SOFT_LIMIT_MB every config.MEMORY_CHECK_INTERVAL_SEC."""
+    while True:
+        await asyncio.sleep(config.MEMORY_CHECK_INTERVAL_SEC)
+        try:
+            await memory_budget.enforce()
+        except Exception as e:
+            print(f"ERROR: Memory budget enforcement failed: {e}")
+
+def spacy_vocab_bytes() -> int:
+    if nlp_service.spacy_nlp is None: return 0
+    return sum(sys.getsizeof(s) for s in nlp_service.spacy_nlp.vocab.strings)
+memory_budget.component("sessions", lambda: estimate_bytes(_sessions))
+memory_budget.component("style_embeddings", lambda: estimate_bytes(_style_embeddings), runner=on_nlp_thread)
+memory_budget.component("nlp_doc_cache", lambda: estimate_bytes(nlp_service._doc_cache), runner=on_nlp_thread)
+memory_budget.component("nlp_turn_cache", lambda: estimate_bytes(nlp_service._turn_cache), runner=on_nlp_thread)
+memory_budget.component("idempotency_cache", lambda: estimate_bytes(idempotency_cache))
+memory_budget.component("frontend_event_seqs", lambda: estimate_bytes(_frontend_event_seqs))
+memory_budget.component("condition_aggregates", lambda: estimate_bytes(aggregates.conditions))
+memory_budget.component("formality_model_weights", lambda: model_weight_bytes(nlp_service.formality_model))
+memory_budget.component("style_embedding_model_weights", lambda: model_weight_bytes(nlp_service.style_embedding_model))
+memory_budget.component("spacy_vocab_strings", spacy_vocab_bytes, runner=on_nlp_thread)
+# Cheapest first. Spilling idle embedding stores loses nothing; the NLP caches are small and
+# capped, so shrinking them is best-effort; evicting idle sessions moves their histories to disk.
+memory_budget.relief("spill_idle_style_embeddings", spill_style_embeddings_under_pressure)
+memory_budget.relief("shrink_nlp_caches", shrink_nlp_caches)
+memory_budget.relief("evict_idle_sessions", evict_idle_sessions_under_pressure)
 def generate_natural_greeting():
     return "Hey there, I'm Kagami. What's on your mind today, or how's your day been so far?"
 
@@ -179,48 +493,97 @@ def generate_natural_greeting():
 @app.get("/")
 async def read_root(): return {"message": "Kagami Chat — backend humming smoothly."}
 
+@app.get("/api/metrics/admission")
+async def admission_metrics():
+    """Current in-flight and waiting requests plus admission/rejection counts per limiter."""
+    return {name: limiter.snapshot() for name, limiter in admission.items()}
+
+@app.get("/api/metrics/upstream")
+async def upstream_metrics():
+    """Outcome counts, circuit breaker state, retry budget and recent latency of the OpenAI chat policy."""
+    return llm_policy.snapshot()
+
+@app.get("/api/metrics/conditions")
+async def condition_metrics():
+    """Live per-condition study figures (sessions, turns, LSM, guardrail rate, tokens, latency quantiles)."""
+    return aggregates.summary()
+
+@app.get("/api/metrics/memory")
+async def memory_metrics():
+    """Process RSS, the soft limit and estimated bytes held by sessions, caches and model weights."""
+    return await memory_budget.report()
+
+def require_memory_profiling():
+    if not settings.MEMORY_PROFILING_ENABLED:
+        raise HTTPException(status_code=404, detail="Memory profiling is disabled (set MEMORY_PROFILING_ENABLED).")
+
+@app.post("/api/debug/memory/snapshot")
+async def memory_snapshot():
+    """Starts tracemalloc if needed and records the baseline for /api/debug/memory/diff."""
+    require_memory_profiling()
+    return await asyncio.to_thread(allocation_profiler.snapshot)
+
+@app.get("/api/debug/memory/diff")
+async def memory_diff():
+    """Allocation growth by source line since the last snapshot."""
+    require_memory_profiling()
+    diff = await asyncio.to_thread(allocation_profiler.diff)
+    if diff is None:
+        raise HTTPException(status_code=409, detail="No baseline; POST /api/debug/memory/snapshot first.")
+    return diff
+
+@app.post("/api/debug/memory/stop")
+async def memory_stop():
+    """Stops tracemalloc and drops the baseline."""
+    require_memory_profiling()
+    allocation_profiler.stop()
+    return {"tracing": False}
+
+@app.get("/api/metrics/pipeline")
+async def pipeline_metrics():
+    """Per condition: turns, summed user-analysis/LLM time and how much of it overlapped."""
+    metrics = {}
+    for condition, totals in _pipeline_overlap.items():
+        # Share of the shorter stage that was hidden behind the other one (1.0 = fully overlapped).
+        overlappable = min(totals["user_analysis_sec"], totals["llm_sec"])
+        metrics[condition] = {**totals, "overlap_ratio": totals["overlap_sec"] / overlappable if overlappable else 0.0}
+    return metrics
+
 @app.post("/api/session/end")
-async def end_session(req: SessionEndRequest, tasks: BackgroundTasks):
+async def end_session(req: SessionEndRequest):
     sid = req.sessionId
-    session = _sessions.get(sid)
-    if not session:
-        print(f"INFO: Session end called for non-existent/already-ended session: {sid}")
-        return {"message": "Session already ended or not found."}
+    # Waits for an in-flight turn of this session, so its bot_response is logged before session_end.
+    async with session_locks.hold(sid):
+        session = get_session(sid)
+        if not session:
+            print(f"INFO: Session end called for non-existent/already-ended session: {sid}")
+            return {"message": "Session already ended or not found."}
+
+        uploads = await finalize_session(sid, session, "client_request")
 
-    log_event({"event_type": "session_end"}, session_info=session)
-    
     try:
-        log_path = str(session["log_file_path"])
         if "demo_user" not in session.get("participantId", ""):
-            tasks.add_task(
-                upload_log_to_drive,
-                log_path,
-                sid,
-                settings.GOOGLE_DRIVE_FOLDER_ID
-            )
+            for path, mimetype in uploads:
+                upload_queue.enqueue(path, sid, mimetype)
     except Exception as e:
-        log_event({"event_type": "error", "error_source": "log_upload_task_creation_failed", "error_message": str(e)}, session_info=session)
         print(f"[drive-upload-task] failed to queue for {sid}: {e}")
 
-    filepath = get_session_state_file_path(sid)
-    if filepath.exists():
-        try:
-            os.remove(filepath)
-        except Exception as e:
-            print(f"ERROR: Failed to delete session state file {filepath}: {e}")
-    
-    _sessions.pop(sid, None)
-
     return {"message": "Session ended successfully and log processing queued."}
 
 
 # --- Avatar Generation Endpoint ---
 @app.post("/api/avatar/generate", response_model=AvatarResponse)
-async def generate_avatar(req: AvatarRequest):
+async def generate_avatar(req: AvatarRequest, idempotency_key: Optional[str] = Header(default=None)):
+    async def execute():
+        async with session_locks.hold(req.sessionId):
+            return await run_avatar_generation(req)
+    return await idempotency_cache.run(req.sessionId, idempotency_key, execute, IdempotencyCache.hash_request(req.model_dump()))
+async def run_avatar_generation(req: AvatarRequest) -> AvatarResponse:
     sid = req.sessionId
-    session = _sessions.get(sid)
+    session = get_session(sid)
     if not session:
         raise HTTPException(status_code=404, detail="Session not found")
+    session["last_activity"] = time.time()
     try:
         if len(session["generated_avatars"]) >= 5:
             raise HTTPException(status_code=400, detail="Maximum avatar generations reached")
@@ -260,7 +623,8 @@ async def generate_avatar(req: AvatarRequest):
                     "quality": "medium",
                     "n": 1,
                 }
-                response = requests.post("https://api.openai.com/v1/images/edits", headers=headers, files=files, data=data, timeout=120)
+                async with admission["avatar"].slot():
+                    response = await asyncio.to_thread(requests.post, "https://api.openai.com/v1/images/edits", headers=headers, files=files, data=data, timeout=120)
                 response.raise_for_status()
 
         except requests.exceptions.RequestException as api_error:
@@ -285,10 +649,11 @@ async def generate_avatar(req: AvatarRequest):
         avatar_entry = {"url": url, "prompt": user_prompt}
         session["generated_avatars"].append(avatar_entry)
         log_event({"event_type": "avatar_generated", "avatar_prompt": user_prompt, "avatar_url_generated": url}, session_info=session)
+        aggregates.record_avatar_generated(session["condition_name_from_frontend"])
         
         return AvatarResponse(url=url, prompt=user_prompt)
 
-    except HTTPException:
+    except (HTTPException, OverloadedError):
         raise
     except Exception as e:
         traceback.print_exc()
@@ -302,15 +667,7 @@ async def start_session(req: SessionStartRequest):
         pid = req.participantId
         sid = str(uuid.uuid4())
         condition_name_from_frontend = req.conditionName.lower()
-        condition_details = {
-            "generated_adaptive": {"avatar": True, "lsm": True, "avatarType": "generated"},
-            "generated_static":   {"avatar": True, "lsm": False, "avatarType": "generated"},
-            "premade_adaptive":   {"avatar": True, "lsm": True, "avatarType": "premade"},
-            "premade_static":     {"avatar": True, "lsm": False, "avatarType": "premade"},
-            "none_adaptive":      {"avatar": False, "lsm": True, "avatarType": "none"},
-            "none_static":        {"avatar": False, "lsm": False, "avatarType": "none"},
-        }
-        backend_condition_obj = condition_details.get(condition_name_from_frontend)
+        backend_condition_obj = CONDITION_DETAILS.get(condition_name_from_frontend)
         if not backend_condition_obj:
             raise HTTPException(status_code=400, detail=f"Invalid conditionName provided: '{condition_name_from_frontend}'")
         log_file_path = Path(config.LOG_DIR) / f"participant_{pid}_{sid}.jsonl"
@@ -318,7 +675,7 @@ async def start_session(req: SessionStartRequest):
             "participantId": pid, "sessionId": sid, "condition": backend_condition_obj,
             "condition_name_from_frontend": condition_name_from_frontend, "log_file_path": log_file_path,
             "turn_number": 0, "smoothed_lsm_score": 0.5, "history": [], "avatar_url": None,
-            "avatar_prompt": None, "generated_avatars": [],
+            "avatar_prompt": None, "generated_avatars": [], "last_activity": time.time(),
         }
         session = _sessions[sid]
         initial_greeting = generate_natural_greeting()
@@ -328,6 +685,7 @@ async def start_session(req: SessionStartRequest):
             "backend_confirmed_condition_obj": backend_condition_obj, "initial_greeting": initial_greeting,
         }, session_info=session)
         save_session_state(sid)
+        aggregates.record_session_start(condition_name_from_frontend)
         return SessionStartResponse(sessionId=sid, condition=backend_condition_obj, initialHistory=session["history"])
     except Exception as e:
         print(f"Critical error during session start: {e}")
@@ -336,46 +694,116 @@ async def start_session(req: SessionStartRequest):
     
 @app.post("/api/session/set_avatar_details") 
 async def set_avatar_details(req: SetAvatarDetailsRequest):
-    session = _sessions.get(req.sessionId)
-    if not session:
-        raise HTTPException(status_code=404, detail="Session not found")
-    session["avatar_url"] = req.avatarUrl
-    if req.avatarPrompt is not None: 
-        session["avatar_prompt"] = req.avatarPrompt
-    log_event_data = {"event_type": "avatar_details_set", "avatar_url_set": req.avatarUrl}
-    if req.avatarPrompt is not None:
-        log_event_data["avatar_prompt_set"] = req.avatarPrompt 
-    log_event(log_event_data, session_info=session)
-    save_session_state(req.sessionId)
+    async with session_locks.hold(req.sessionId):
+        session = get_session(req.sessionId)
+        if not session:
+            raise HTTPException(status_code=404, detail="Session not found")
+        session["avatar_url"] = req.avatarUrl
+        session["last_activity"] = time.time()
+        if req.avatarPrompt is not None: 
+            session["avatar_prompt"] = req.avatarPrompt
+        log_event_data = {"event_type": "avatar_details_set", "avatar_url_set": req.avatarUrl}
+        if req.avatarPrompt is not None:
+            log_event_data["avatar_prompt_set"] = req.avatarPrompt 
+        log_event(log_event_data, session_info=session)
+        save_session_state(req.sessionId)
     return {"message": "Avatar details updated successfully."}
 
 
 # --- Message Handling ---
+# All online NLP runs on this one thread: it keeps inference off the event loop, and
+# spaCy and the NLPService caches are not safe to use from several threads at once.
+_nlp_executor: Optional[ThreadPoolExecutor] = None
+def get_nlp_executor() -> ThreadPoolExecutor:
+    global _nlp_executor
+    if _nlp_executor is None:
+        _nlp_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="nlp")
+    return _nlp_executor
+_pipeline_overlap: Dict[str, Dict[str, float]] = {}
+async def timed(awaitable) -> tuple[Any, tuple[float, float]]:
+    """Awaits and returns (result, (start, end)) in time.perf_counter() seconds."""
+    start = time.perf_counter()
+    result = await awaitable
+    return result, (start, time.perf_counter())
+async def run_nlp(fn, *args) -> tuple[Any, tuple[float, float]]:
+    if not nlp_service.is_warmed_up: await nlp_service.warm_up()
+    return await timed(asyncio.get_running_loop().run_in_executor(get_nlp_executor(), fn, *args))
+def analyze_user_style(user_style_turns: List[str]) -> StyleProfile:
+    return nlp_service.analyze_window_sync([nlp_service.analyze_turn_sync(t) for t in user_style_turns])
+def analyze_bot_turn(session_id: str, session: Dict[str, Any], user_message: str, user_style_text_sample: str, bot_response: str):
+    bot_traits = nlp_service.analyze_text_sync(bot_response)
+    raw_lsm = nlp_service.compute_lsm(user_style_text_sample, bot_response)
+    style_similarity = record_style_embeddings(session_id, session, user_message, bot_response)
+    return bot_traits, raw_lsm, style_similarity
+def record_pipeline_overlap(session: Dict[str, Any], analysis_timing: tuple[float, float], llm_timing: tuple[float, float]) -> Dict[str, float]:
+    """
+    Returns this turn's user-style analysis and LLM durations and how long they
+    ran concurrently, and adds them to the per-condition totals.
+    """
+    overlap = max(0.0, min(analysis_timing[1], llm_timing[1]) - max(analysis_timing[0], llm_timing[0]))
+    timing = {"user_analysis_sec": analysis_timing[1] - analysis_timing[0], "llm_sec": llm_timing[1] - llm_timing[0], "overlap_sec": overlap}
+    totals = _pipeline_overlap.setdefault(session.get("condition_name_from_frontend", "unknown"),
+                                          {"turns": 0, "user_analysis_sec": 0.0, "llm_sec": 0.0, "overlap_sec": 0.0})
+    totals["turns"] += 1
+    for key, value in timing.items():
+        totals[key] += value
+    return timing
 @app.post("/api/session/message", response_model=MessageResponse)
-async def handle_message(req: MessageRequest):
+async def handle_message(req: MessageRequest, idempotency_key: Optional[str] = Header(default=None)):
+    async def execute():
+        async with session_locks.hold(req.sessionId):
+            return await run_turn(req)
+    return await idempotency_cache.run(req.sessionId, idempotency_key, execute, IdempotencyCache.hash_request(req.model_dump()))
+async def run_turn(req: MessageRequest) -> MessageResponse:
     try:
         start_time = time.time()
         log_memory_usage()
-        session = _sessions.get(req.sessionId)
+        session = get_session(req.sessionId)
         if not session:
             raise HTTPException(status_code=404, detail="Session not found")
         
-        session["turn_number"] += 1
-        user_style_text_sample = get_user_style_sample(session["history"]) or req.message
-        user_traits: StyleProfile = await nlp_service.analyze_text(user_style_text_sample)
-        user_traits.lsm_score_prev = session.get("smoothed_lsm_score", 0.5)
-        session["history"].append({"role": "user", "content": req.message, "turn_number": session["turn_number"]})
-        
-        log_event({"event_type": "user_message", "content": req.message, "user_linguistic_traits": user_traits.model_dump()}, session_info=session)
-        
-        bot_raw, system_instruction_used, usage_data = await get_openai_response(
-            user_prompt=req.message, chat_history=session["history"],
-            is_adaptive=session["condition"].get("lsm", False), style_profile=user_traits)
+        session["last_activity"] = time.time()
+        is_adaptive = session["condition"].get("lsm", False)
+        # Admission happens before the turn touches the session, so a 503 can be retried as is.
+        user_style_turns = get_recent_user_turns(session["history"]) or [req.message]
+        user_style_text_sample = " ".join(user_style_turns)
+
+        def begin_turn():
+            session["turn_number"] += 1
+            session["history"].append({"role": "user", "content": req.message, "turn_number": session["turn_number"]})
+
+        if prompt_needs_style_profile(is_adaptive):
+            async with admission["nlp"].slot():
+                user_traits, analysis_timing = await run_nlp(analyze_user_style, user_style_turns)
+            user_traits.lsm_score_prev = session.get("smoothed_lsm_score", 0.5)
+            async with admission["llm"].slot():
+                begin_turn()
+                log_event({"event_type": "user_message", "content": req.message, "user_linguistic_traits": user_traits.model_dump()}, session_info=session)
+                (bot_raw, system_instruction_used, usage_data, llm_attempt), llm_timing = await timed(get_openai_response(
+                    user_prompt=req.message, chat_history=session["history"],
+                    is_adaptive=is_adaptive, style_profile=user_traits))
+        else:
+            # The static prompt ignores the StyleProfile, so the LLM call runs while the user's style is analyzed.
+            async with admission["llm"].slot():
+                async with admission["nlp"].slot():
+                    begin_turn()
+                    llm_task = asyncio.create_task(timed(get_openai_response(
+                        user_prompt=req.message, chat_history=session["history"],
+                        is_adaptive=is_adaptive, style_profile=None)))
+                    try:
+                        user_traits, analysis_timing = await run_nlp(analyze_user_style, user_style_turns)
+                    except BaseException:
+                        llm_task.cancel()
+                        raise
+                user_traits.lsm_score_prev = session.get("smoothed_lsm_score", 0.5)
+                log_event({"event_type": "user_message", "content": req.message, "user_linguistic_traits": user_traits.model_dump()}, session_info=session)
+                (bot_raw, system_instruction_used, usage_data, llm_attempt), llm_timing = await llm_task
+        pipeline_timing = record_pipeline_overlap(session, analysis_timing, llm_timing)
         
-        bot_response = post_process_response(bot_raw, session["condition"].get("lsm", False))
-        bot_traits = await nlp_service.analyze_text(bot_response)
-        raw_lsm = nlp_service.compute_lsm(user_style_text_sample, bot_response)
-        style_similarity = nlp_service.compute_style_similarity(user_style_text_sample, bot_response)
+        bot_response = post_process_response(bot_raw, is_adaptive)
+        async with admission["nlp"].slot(required=True):
+            bot_traits, raw_lsm, style_similarity = (await run_nlp(
+                analyze_bot_turn, req.sessionId, session, req.message, user_style_text_sample, bot_response))[0]
         
         update_smoothed = (user_traits.word_count >= config.MIN_LSM_TOKENS_FOR_SMOOTHING and bot_traits.word_count >= config.MIN_LSM_TOKENS_FOR_SMOOTHING)
         prev_score = session.get("smoothed_lsm_score", 0.5)
@@ -385,18 +813,24 @@ async def handle_message(req: MessageRequest):
         duration = time.time() - start_time
         session["history"].append({"role": "assistant", "content": bot_response, "turn_number": session["turn_number"]})
         
+        guardrail_fired = "[GUARDRAIL_FIRED=TRUE]" in system_instruction_used
+        usage = usage_data.model_dump() if usage_data else None
         log_event({
             "event_type": "bot_response", "content": bot_response, "lsm_score_raw": raw_lsm,
-            "style_similarity_cosine": style_similarity, "lsm_score_smoothed": new_score,
+            "style_similarity_cosine": style_similarity, "style_similarity_version": config.STYLE_SIMILARITY_VERSION, "lsm_score_smoothed": new_score,
             "bot_linguistic_traits": bot_traits.model_dump(), "style_profile_used_for_prompt": user_traits.model_dump(),
-            "system_instruction_used": system_instruction_used.replace("\n\n[GUARDRAIL_FIRED=TRUE]", ""),"guardrail_fired": "[GUARDRAIL_FIRED=TRUE]" in system_instruction_used,
-            "response_latency_sec": duration, "openai_usage": usage_data.model_dump() if usage_data else None
+            "system_instruction_used": system_instruction_used.replace("\n\n[GUARDRAIL_FIRED=TRUE]", ""),"guardrail_fired": guardrail_fired,
+            "response_latency_sec": duration, "openai_usage": usage,
+            "pipeline_timing": pipeline_timing, "llm_attempt": llm_attempt
         }, session_info=session)
+        aggregates.record_turn(session["condition_name_from_frontend"], raw_lsm, new_score, guardrail_fired, duration, usage, llm_attempt)
         
         save_session_state(req.sessionId)
         
         return MessageResponse(response=bot_response, styleProfile=user_traits.model_dump(), lsmScore=raw_lsm, smoothedLsmAfterTurn=new_score)
 
+    except (HTTPException, OverloadedError):
+        raise
     except Exception as e:
         print("--- ❌ CRITICAL ERROR IN HANDLE_MESSAGE ---")
         traceback.print_exc()
@@ -404,29 +838,75 @@ async def handle_message(req: MessageRequest):
         raise HTTPException(status_code=500, detail=f"An unexpected internal error occurred: {e}")
 
 # --- Frontend Event Logging ---
+MAX_FRONTEND_EVENT_CLIENTS = 10000
+# Highest sequence written per client for events without a live session, including ended sessions.
+_frontend_event_seqs: "OrderedDict[str, int]" = OrderedDict()
+def remember_frontend_event_seq(seq_key: str, seq: int):
+    _frontend_event_seqs[seq_key] = max(seq, _frontend_event_seqs.get(seq_key, -1))
+    _frontend_event_seqs.move_to_end(seq_key)
+    while len(_frontend_event_seqs) > MAX_FRONTEND_EVENT_CLIENTS: _frontend_event_seqs.popitem(last=False)
+def _write_frontend_events(sid: Optional[str], participant_id: Optional[str], events: List[Dict[str, Any]]):
+    """Writes a session's frontend events in one append, falling back to per-participant or general logs."""
+    session = get_session(sid) if sid else None
+    if session: log_events(events, session_info=session)
+    elif participant_id:
+        pid_zfill = str(participant_id).zfill(2)
+        fallback_log_filename = f"participant_{pid_zfill}_{sid or 'no_sid'}_fallback.jsonl"
+        event_data = next((e["event_data"] for e in events if e["event_data"].get("backend_condition") or e["event_data"].get("initial_condition_raw")), {})
+        fallback_session_info = {
+            "participantId": pid_zfill, "sessionId": sid, 
+            "condition": event_data.get("backend_condition") or event_data.get("initial_condition_raw") or {"lsm": None, "avatar": None},
+            "log_file_path": os.path.join(config.LOG_DIR, fallback_log_filename)
+         }
+        log_events(events, session_info=fallback_session_info)
+    else:
+         general_log_path = os.path.join(config.LOG_DIR, "general_frontend_events.jsonl")
+         timestamp = datetime.now(timezone.utc).isoformat()
+         with open(general_log_path, 'a', encoding='utf-8') as f:
+             f.write("".join(json.dumps({"timestamp_utc": timestamp, **e}) + '\n' for e in events))
+def _log_frontend_error(e: Exception):
+    system_error_log_path = os.path.join(config.LOG_DIR, "system_errors.jsonl")
+    error_entry = {"timestamp_utc": datetime.now(timezone.utc).isoformat(), "error_source": "log_frontend_event_exception", "error_message": str(e)}
+    with open(system_error_log_path, 'a', encoding='utf-8') as f: f.write(json.dumps(error_entry) + '\n')
+
 @app.post("/api/log/frontend_event")
 async def log_frontend_event(req: FrontendEventRequest):
     try:
-        sid = req.sessionId
-        session = _sessions.get(sid) if sid else None
-        log_data = {"event_type": req.eventType, "event_data": req.eventData}
-        if session: log_event(log_data, session_info=session)
-        elif req.participantId:
-            pid_zfill = str(req.participantId).zfill(2)
-            fallback_log_filename = f"participant_{pid_zfill}_{sid or 'no_sid'}_fallback.jsonl"
-            fallback_session_info = {
-                "participantId": pid_zfill, "sessionId": sid, 
-                "condition": req.eventData.get("backend_condition") or req.eventData.get("initial_condition_raw") or {"lsm": None, "avatar": None},
-                "log_file_path": os.path.join(config.LOG_DIR, fallback_log_filename)
-             }
-            log_event(log_data, session_info=fallback_session_info)
-        else:
-             general_log_path = os.path.join(config.LOG_DIR, "general_frontend_events.jsonl")
-             general_log_entry = {"timestamp_utc": datetime.now(timezone.utc).isoformat(), "event_type": req.eventType, "event_data": req.eventData}
-             with open(general_log_path, 'a', encoding='utf-8') as f: f.write(json.dumps(general_log_entry) + '\n')
+        # No await between the session lookup and the write, so this cannot interleave with finalize_session
+        # dropping the session before it compacts the log; no session lock, so events never wait behind a turn.
+        _write_frontend_events(req.sessionId, req.participantId, [{"event_type": req.eventType, "event_data": req.eventData}])
         return {"message": "Frontend event log request received."}
     except Exception as e:
-        system_error_log_path = os.path.join(config.LOG_DIR, "system_errors.jsonl")
-        error_entry = {"timestamp_utc": datetime.now(timezone.utc).isoformat(), "error_source": "log_frontend_event_exception", "error_message": str(e)}
-        with open(system_error_log_path, 'a', encoding='utf-8') as f: f.write(json.dumps(error_entry) + '\n')
+        _log_frontend_error(e)
+        raise HTTPException(status_code=500, detail=f"Internal server error processing log request: {str(e)}")
+
+@app.post("/api/log/frontend_events")
+async def log_frontend_events(req: FrontendEventBatchRequest):
+    """
+    Bulk version of /api/log/frontend_event for the client-side event buffer.
+    Sequence numbers increase per clientId; events at or below the highest
+    sequence already written for this session and client are replays and skipped.
+    """
+    try:
+        sid = req.sessionId
+        # Runs without awaiting, like log_frontend_event: the seq check and the write are atomic on the loop.
+        session = get_session(sid) if sid else None
+        seq_key = f"{sid or req.participantId or ''}:{req.clientId}"
+        seqs = session.setdefault("frontend_event_seqs", {}) if session else _frontend_event_seqs
+        last_seq = seqs.get(seq_key, -1)
+        events = []
+        for item in sorted(req.events, key=lambda e: e.seq):
+            if item.seq <= last_seq: continue
+            events.append({"event_type": item.eventType, "event_data": item.eventData,
+                           "client_timestamp": item.clientTimestamp, "client_seq": item.seq})
+            last_seq = item.seq
+        _write_frontend_events(sid, req.participantId, events)
+        if events:
+            if session:
+                seqs[seq_key] = last_seq
+                save_session_state(sid)
+            else: remember_frontend_event_seq(seq_key, last_seq)
+        return {"message": "Frontend events received.", "written": len(events), "duplicates": len(req.events) - len(events)}
+    except Exception as e:
+        _log_frontend_error(e)
         raise HTTPException(status_code=500, detail=f"Internal server error processing log request: {str(e)}")
\ No newline at end of file
@@ -0,0 +1,158 @@
+# backend/reanalyze_logs.py
+"""
+Recomputes user_linguistic_traits, bot_linguistic_traits, lsm_score_raw and
+style_similarity_cosine for every logged turn with the current NLPService and
+config, e.g. after changing a feature or config.LSM_CATEGORIES_SPACY.
+
+Each session log (raw .jsonl or compacted .jsonl.gz archive) is handled by a
+worker process that warms the models once and analyzes the whole session in
+batches (nlp.pipe, batched formality and style embedding inference), reusing
+texts already analyzed under the current fingerprint from the persistent
+analysis cache (--no-cache to bypass it). Results are written next to the original log as
+participant_<pid>_<sid>.reanalysis_<fingerprint>.jsonl; logs that already have
+an output for the current fingerprint are skipped, so an interrupted run can
+simply be restarted.
+
+Usage:
+    poetry run python reanalyze_logs.py [--log-dir experiment_logs] [--workers 4] [--force]
+"""
+import argparse
+import asyncio
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+os.environ["TOKENIZERS_PARALLELISM"] = "false"
+
+from core import config
+from core.embedding_store import StyleEmbeddingStore
+from core.log_archive import list_session_logs, log_stem, read_log_lines
+from core.nlp_service import nlp_service, analysis_fingerprint
+from core.utils import get_recent_user_turns
+
+OUTPUT_MARKER = ".reanalysis_"
+
+
+def output_path_for(log_path: Path, fingerprint: str) -> Path:
+    return log_path.with_name(f"{log_stem(log_path)}{OUTPUT_MARKER}{fingerprint}.jsonl")
+
+
+def find_log_files(log_dir: Path) -> List[Path]:
+    return [p for p in list_session_logs(log_dir) if OUTPUT_MARKER not in p.name]
+
+
+def read_turns(log_path: Path) -> List[Dict]:
+    """Streams a session log (raw or archived) and pairs each user_message with its bot_response."""
+    turns: Dict[int, Dict] = {}
+    for line in read_log_lines(log_path):
+        try:
+            event = json.loads(line)
+        except json.JSONDecodeError:
+            continue
+        turn_number = event.get("turn_number") or 0
+        if event.get("event_type") == "user_message":
+            turn = turns.setdefault(turn_number, {"turn_number": turn_number})
+            turn["user"] = event.get("content") or ""
+            turn["lsm_score_prev"] = (event.get("user_linguistic_traits") or {}).get("lsm_score_prev")
+        elif event.get("event_type") == "bot_response":
+            turns.setdefault(turn_number, {"turn_number": turn_number})["bot"] = event.get("content") or ""
+    return [turns[t] for t in sorted(turns) if "user" in turns[t] and "bot" in turns[t]]
+
+
+def reanalyze_session(log_path: str, fingerprint: str) -> Tuple[str, int]:
+    """Re-analyzes one session log in batches and writes its versioned output."""
+    log_path = Path(log_path)
+    turns = read_turns(log_path)
+
+    # Rebuild the user-style windows exactly as handle_message does.
+    history, windows = [], []
+    for turn in turns:
+        windows.append(get_recent_user_turns(history) or [turn["user"]])
+        history.append({"role": "user", "content": turn["user"]})
+
+    texts = list(dict.fromkeys([turn["user"] for turn in turns] + [turn["bot"] for turn in turns]))
+    stats = dict(zip(texts, nlp_service.analyze_turns(texts)))
+    user_traits = nlp_service.analyze_windows([[stats[text] for text in window] for window in windows])
+    bot_traits = nlp_service.analyze_windows([[stats[turn["bot"]]] for turn in turns])
+    lsm_scores = nlp_service.compute_lsm_batch([(" ".join(window), turn["bot"]) for window, turn in zip(windows, turns)])
+
+    similarities = [None] * len(turns)
+    vectors = nlp_service.encode_style([text for turn in turns for text in (turn["user"], turn["bot"])]) if turns else None
+    if vectors is not None:
+        store = StyleEmbeddingStore()
+        for i, turn in enumerate(turns):
+            user_vector, bot_vector = vectors[2 * i], vectors[2 * i + 1]
+            store.add("user", turn["turn_number"], user_vector)
+            store.add("assistant", turn["turn_number"], bot_vector)
+            window = store.user_window_mean(before_turn=turn["turn_number"])
+            similarities[i] = store.cosine(user_vector if window is None else window, bot_vector)
+
+    output_path = output_path_for(log_path, fingerprint)
+    partial_path = output_path.with_suffix(".partial")
+    with open(partial_path, 'w', encoding='utf-8') as f:
+        for i, turn in enumerate(turns):
+            user_traits[i].lsm_score_prev = turn.get("lsm_score_prev")
+            f.write(json.dumps({
+                "analysis_fingerprint": fingerprint,
+                "turn_number": turn["turn_number"],
+                "user_linguistic_traits": user_traits[i].model_dump(),
+                "bot_linguistic_traits": bot_traits[i].model_dump(),
+                "lsm_score_raw": lsm_scores[i],
+                "style_similarity_cosine": similarities[i],
+                "style_similarity_version": config.STYLE_SIMILARITY_VERSION,
+            }) + '\n')
+    os.replace(partial_path, output_path)
+    return str(output_path), len(turns)
+
+
+# Where a local server keeps its analysis cache (main.PERSISTENT_STATE_DIR in development).
+DEFAULT_CACHE_PATH = Path(__file__).parent / "local_static_data" / config.PERSISTENT_STATE_SUBDIR / config.ANALYSIS_CACHE_FILE
+
+
+def _init_worker(torch_threads: int, cache_path: Optional[str]):
+    import torch
+    torch.set_num_threads(torch_threads)
+    if cache_path:
+        nlp_service.attach_disk_cache(Path(cache_path))
+    asyncio.run(nlp_service.warm_up())
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Re-analyze experiment logs with the current NLP features.")
+    parser.add_argument("--log-dir", default=config.LOG_DIR, help="Directory holding participant_* logs (raw .jsonl or .jsonl.gz archives).")
+    parser.add_argument("--workers", type=int, default=max(1, (os.cpu_count() or 2) // 2), help="Worker processes.")
+    parser.add_argument("--force", action="store_true", help="Recompute logs that already have an output for this fingerprint.")
+    parser.add_argument("--no-cache", action="store_true", help="Do not read or fill the persistent analysis cache.")
+    parser.add_argument("--cache-path", default=str(DEFAULT_CACHE_PATH), help="Persistent analysis cache file (e.g. a copy of the server's).")
+    args = parser.parse_args()
+
+    fingerprint = analysis_fingerprint()
+    log_files = find_log_files(Path(args.log_dir))
+    pending = [p for p in log_files if args.force or not output_path_for(p, fingerprint).exists()]
+    print(f"INFO (reanalyze_logs): Analysis fingerprint {fingerprint}. {len(pending)} of {len(log_files)} logs to process with {args.workers} workers.")
+    if not pending: return
+
+    torch_threads = max(1, (os.cpu_count() or 1) // args.workers)
+    start_time = time.time()
+    total_turns, failed = 0, 0
+    with ProcessPoolExecutor(max_workers=args.workers, initializer=_init_worker, initargs=(torch_threads, None if args.no_cache else args.cache_path)) as pool:
+        futures = {pool.submit(reanalyze_session, str(p), fingerprint): p for p in pending}
+        for done, future in enumerate(as_completed(futures), start=1):
+            try:
+                output_path, turn_count = future.result()
+                total_turns += turn_count
+                print(f"[{done}/{len(pending)}] {futures[future].name}: {turn_count} turns -> {Path(output_path).name}")
+            except Exception as e:
+                failed += 1
+                print(f"ERROR (reanalyze_logs): Failed to re-analyze {futures[future]}: {e}")
+
+    duration = time.time() - start_time
+    print(f"INFO (reanalyze_logs): {total_turns} turns from {len(pending) - failed} logs in {duration:.1f}s "
+          f"({total_turns / duration if duration else 0.0:.2f} turns/sec). {failed} failed.")
+
+
+if __name__ == "__main__":
+    main()
@@ -4,7 +4,19 @@ import pytest
 from fastapi.testclient import TestClient
 os.environ["KAGAMI_MOCK"] = "1"
 os.environ["KAGAMI_SKIP_WARMUP"] = "1"
+os.environ["ANALYSIS_CACHE_ENABLED"] = "0"
+import main
 from main import app
+from core import config
+
+@pytest.fixture(scope="session", autouse=True)
+def isolated_data_dirs(tmp_path_factory):
+    """Keeps the logs, session state and aggregates snapshot written by the tests out of the working tree."""
+    with pytest.MonkeyPatch.context() as mp:
+        mp.setattr(config, "LOG_DIR", str(tmp_path_factory.mktemp("experiment_logs")))
+        mp.setattr(config, "SESSION_STATE_DIR", str(tmp_path_factory.mktemp("session_state")))
+        mp.setattr(main, "AGGREGATES_SNAPSHOT_PATH", tmp_path_factory.mktemp("state") / config.AGGREGATES_SNAPSHOT_FILE)
+        yield
 
 @pytest.fixture(scope="module")
 def client():
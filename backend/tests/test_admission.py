@@ -0,0 +1,52 @@
+# backend/tests/test_admission.py
+import asyncio
+import pytest
+from core.admission import AdmissionLimiter, OverloadedError
+
+def test_limiter_queues_then_rejects():
+    limiter = AdmissionLimiter("llm", limit=1, max_queue=1, queue_timeout_sec=0.05, retry_after_sec=3)
+
+    async def hold_required():
+        async with limiter.slot(required=True): pass
+
+    async def run():
+        release = asyncio.Event()
+
+        async def hold():
+            async with limiter.slot():
+                await release.wait()
+
+        holder = asyncio.create_task(hold())
+        await asyncio.sleep(0)
+        queued = asyncio.create_task(hold())
+        await asyncio.sleep(0)
+        assert (limiter.in_flight, limiter.waiting) == (1, 1)
+
+        with pytest.raises(OverloadedError) as full:
+            async with limiter.slot(): pass
+        assert full.value.retry_after_sec == 3
+
+        # The queued request gives up once its wait exceeds the timeout.
+        with pytest.raises(OverloadedError):
+            await queued
+        # Required work still waits for the slot instead of being rejected.
+        required = asyncio.create_task(hold_required())
+        await asyncio.sleep(0.1)
+        release.set()
+        await asyncio.gather(holder, required)
+
+    asyncio.run(run())
+    assert limiter.stats == {"admitted": 2, "rejected_queue_full": 1, "rejected_timeout": 1, "max_waiting": 1}
+    assert (limiter.in_flight, limiter.waiting) == (0, 0)
+
+def test_overloaded_request_gets_503(client, monkeypatch):
+    from main import admission
+    limiter = admission["nlp"]
+    monkeypatch.setattr(limiter, "limit", 0)
+    monkeypatch.setattr(limiter, "max_queue", 0)
+    start_response = client.post("/api/session/start", json={"participantId": "test-user-003", "conditionName": "none_static"})
+    response = client.post("/api/session/message", json={"sessionId": start_response.json()["sessionId"], "message": "Hi"})
+
+    assert response.status_code == 503
+    assert response.headers["Retry-After"] == str(limiter.retry_after_sec)
+    assert client.get("/api/metrics/admission").json()["nlp"]["rejected_queue_full"] >= 1
@@ -0,0 +1,53 @@
+# backend/tests/test_aggregates.py
+import random
+import statistics
+from core.aggregates import AggregatesEngine, QuantileSketch, RunningStats
+
+def test_running_stats_and_sketch_track_the_exact_figures():
+    values = [random.lognormvariate(0, 1) for _ in range(5000)]
+    stats, sketch = RunningStats(), QuantileSketch(relative_accuracy=0.01)
+    for value in values:
+        stats.add(value)
+        sketch.add(value)
+    assert abs(stats.mean - statistics.mean(values)) < 1e-9
+    assert abs(stats.variance - statistics.variance(values)) < 1e-6
+    ordered = sorted(values)
+    for q in (0.5, 0.9, 0.99):
+        exact = ordered[int(q * (len(ordered) - 1))]
+        assert abs(sketch.quantile(q) - exact) <= 0.011 * exact
+
+def test_snapshot_round_trip(tmp_path):
+    engine = AggregatesEngine(["none_static", "none_adaptive"])
+    engine.record_session_start("none_static")
+    engine.record_turn("none_static", 0.4, 0.45, True, 1.5, {"prompt_tokens": 10, "completion_tokens": 5, "total_tokens": 15},
+                       {"outcome": "ok", "winner": "primary", "total_latency_sec": 1.2})
+    engine.record_turn("none_static", 0.6, 0.5, False, 2.5)
+    engine.record_session_end("none_static", "user_ended", 2, 0.5)
+
+    summary = engine.summary()["none_static"]
+    assert (summary["turns"], summary["guardrail_rate"], summary["total_tokens"], summary["sessions_active"]) == (2, 0.5, 15, 0)
+    assert summary["lsm_smoothed"]["mean"] == 0.475
+    assert engine.summary()["none_adaptive"]["turns"] == 0
+
+    engine.save(tmp_path / "aggregates.json")
+    restored = AggregatesEngine(["none_static", "none_adaptive"])
+    assert restored.load(tmp_path / "aggregates.json")
+    assert restored.summary() == engine.summary()
+
+def test_snapshot_document_is_a_copy_and_active_sessions_come_from_live_sessions(tmp_path):
+    engine = AggregatesEngine(["none_static"])
+    engine.record_session_start("none_static")
+    document = engine.snapshot_document()
+    assert not engine.dirty_since_snapshot
+    engine.record_turn("none_static", 0.4, 0.45, False, 1.0)
+    assert engine.dirty_since_snapshot
+    assert document["conditions"]["none_static"]["counts"]["turns"] == 0
+
+    AggregatesEngine.write_snapshot(document, tmp_path / "aggregates.json")
+    restored = AggregatesEngine(["none_static"])
+    assert restored.load(tmp_path / "aggregates.json")
+    assert restored.summary()["none_static"]["sessions_active"] == 0
+    restored.set_active_sessions({"none_static": 1})
+    restored.record_session_end("none_static", "timeout", 1, 0.5)
+    restored.record_session_end("none_static", "timeout", 1, 0.5)
+    assert restored.summary()["none_static"]["sessions_active"] == 0
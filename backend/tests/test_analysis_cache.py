@@ -0,0 +1,39 @@
+# backend/tests/test_analysis_cache.py
+import spacy
+from core.analysis_cache import AnalysisCache
+from core import nlp_service as nlp_module
+from core.nlp_service import NLPService, analysis_fingerprint
+
+def test_fingerprint_change_clears_and_cap_evicts_least_recent(tmp_path):
+    path = tmp_path / "cache.sqlite3"
+    cache = AnalysisCache(path, "fp1", max_entries=10, evict_every=1)
+    for i in range(10):
+        cache.put("turn", f"text {i}", b"v")
+    assert cache.get("turn", "text 0") == b"v"  # Now the most recently used entry.
+    cache.put("turn", "text 10", b"v")
+    assert len(cache) == 9
+    assert cache.get("turn", "text 0") == b"v" and cache.get("turn", "text 1") is None
+    cache.close()
+
+    assert len(AnalysisCache(path, "fp1")) == 9
+    assert len(AnalysisCache(path, "fp2")) == 0
+
+def test_turn_stats_survive_a_restart(tmp_path):
+    def service_with_cache():
+        service = NLPService()
+        service.spacy_nlp = spacy.blank("en")
+        service.spacy_nlp.add_pipe("sentencizer")
+        service.is_warmed_up = True
+        service.attach_disk_cache(tmp_path / "cache.sqlite3")
+        return service
+
+    first = service_with_cache().analyze_turn_sync("Honestly I think we should go.")
+    restarted = service_with_cache()
+    restarted.spacy_nlp = None  # A cache hit must not need the parser.
+    assert restarted.analyze_turn_sync("Honestly I think we should go.") == first
+    assert restarted.analyze_turns(["Honestly I think we should go."]) == [first]
+
+def test_model_update_changes_the_fingerprint(monkeypatch):
+    before = analysis_fingerprint()
+    monkeypatch.setattr(nlp_module, "model_revision", lambda name: "new-snapshot")
+    assert analysis_fingerprint() != before
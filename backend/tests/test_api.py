@@ -1,5 +1,8 @@
 # backend/tests/test_api.py
 import os
+import asyncio
+from pathlib import Path
+from core import config
 from fastapi.testclient import TestClient
 from main import app
 
@@ -25,3 +28,150 @@ def test_handle_message_in_mock_mode(client):
     )
     assert message_response.status_code == 200
     assert message_response.json()["response"] == "This is a mock response from Kagami."
+
+def test_end_session_compacts_log(client):
+    start_response = client.post(
+        "/api/session/start",
+        json={"participantId": "demo_user-001", "conditionName": "none_static"},
+    )
+    session_id = start_response.json()["sessionId"]
+    client.post("/api/session/message", json={"sessionId": session_id, "message": "Hello there."})
+
+    end_response = client.post("/api/session/end", json={"sessionId": session_id})
+
+    assert end_response.status_code == 200
+    log_dir = Path(config.LOG_DIR)
+    assert (log_dir / f"participant_demo_user-001_{session_id}.jsonl.gz").exists()
+    assert not (log_dir / f"participant_demo_user-001_{session_id}.jsonl").exists()
+
+def test_frontend_event_batches_skip_replays(client):
+    start_response = client.post(
+        "/api/session/start",
+        json={"participantId": "demo_user-006", "conditionName": "none_static"},
+    )
+    session_id = start_response.json()["sessionId"]
+    batch = {"sessionId": session_id, "participantId": "demo_user-006", "clientId": "page-1",
+             "events": [{"seq": i, "eventType": "ui_click", "eventData": {"i": i}} for i in range(3)]}
+
+    first = client.post("/api/log/frontend_events", json=batch)
+    batch["events"].append({"seq": 3, "eventType": "ui_click", "eventData": {"i": 3}})
+    replay = client.post("/api/log/frontend_events", json=batch)
+
+    assert first.json()["written"] == 3
+    assert replay.json()["written"] == 1 and replay.json()["duplicates"] == 3
+    log_path = Path(config.LOG_DIR) / f"participant_demo_user-006_{session_id}.jsonl"
+    assert log_path.read_text(encoding="utf-8").count('"ui_click"') == 4
+
+    # A replay that arrives after the session ended is still recognised.
+    client.post("/api/session/end", json={"sessionId": session_id})
+    late_replay = client.post("/api/log/frontend_events", json=batch)
+    assert late_replay.json()["written"] == 0 and late_replay.json()["duplicates"] == 4
+
+def test_message_replay_with_idempotency_key_is_not_rerun(client):
+    start_response = client.post(
+        "/api/session/start",
+        json={"participantId": "test-user-004", "conditionName": "none_static"},
+    )
+    session_id = start_response.json()["sessionId"]
+    request = {"json": {"sessionId": session_id, "message": "Hello again."}, "headers": {"Idempotency-Key": "turn-1"}}
+
+    first = client.post("/api/session/message", **request)
+    replay = client.post("/api/session/message", **request)
+
+    assert replay.status_code == 200 and replay.json() == first.json()
+    log_path = Path(config.LOG_DIR) / f"participant_test-user-004_{session_id}.jsonl"
+    assert log_path.read_text(encoding="utf-8").count('"user_message"') == 1
+    reused = client.post("/api/session/message", json={"sessionId": session_id, "message": "Something else."}, headers={"Idempotency-Key": "turn-1"})
+    assert reused.status_code == 422
+
+def test_static_turn_overlaps_llm_with_style_analysis(client, monkeypatch):
+    import main
+    import time as _time
+
+    async def slow_llm(**kwargs):
+        await asyncio.sleep(0.2)
+        return ("Slow mock reply.", "mock_system_prompt", None, None)
+
+    def slow_analysis(turns):
+        _time.sleep(0.2)
+        return main.nlp_service.analyze_window_sync([main.nlp_service.analyze_turn_sync(t) for t in turns])
+
+    monkeypatch.setattr(main, "get_openai_response", slow_llm)
+    monkeypatch.setattr(main, "analyze_user_style", slow_analysis)
+    session_id = client.post("/api/session/start", json={"participantId": "test-user-005", "conditionName": "premade_static"}).json()["sessionId"]
+
+    response = client.post("/api/session/message", json={"sessionId": session_id, "message": "Overlap please."})
+
+    assert response.status_code == 200
+    metrics = client.get("/api/metrics/pipeline").json()["premade_static"]
+    assert metrics["turns"] == 1 and metrics["overlap_ratio"] > 0.5
+
+def test_condition_metrics_follow_turns_and_session_end(client):
+    before = client.get("/api/metrics/conditions").json()["premade_static"]
+    session_id = client.post("/api/session/start", json={"participantId": "demo_user-002", "conditionName": "premade_static"}).json()["sessionId"]
+    client.post("/api/session/message", json={"sessionId": session_id, "message": "Hello there, how are you today?"})
+    client.post("/api/session/end", json={"sessionId": session_id})
+
+    after = client.get("/api/metrics/conditions").json()["premade_static"]
+    assert after["turns"] == before["turns"] + 1
+    assert after["sessions_ended"] == before["sessions_ended"] + 1
+    assert after["response_latency_sec"]["count"] == before["response_latency_sec"]["count"] + 1
+
+def test_memory_pressure_evicts_idle_sessions_without_ending_them(client):
+    import main
+    session_id = client.post("/api/session/start", json={"participantId": "demo_user-005", "conditionName": "none_static"}).json()["sessionId"]
+    main._sessions[session_id]["last_activity"] -= config.MEMORY_PRESSURE_EVICT_IDLE_SEC + 1
+
+    assert client.portal.call(main.evict_idle_sessions_under_pressure) >= 1
+    assert session_id not in main._sessions and session_id in main._evicted_sessions
+
+    response = client.post("/api/session/message", json={"sessionId": session_id, "message": "Still here."})
+    assert response.status_code == 200
+    assert session_id in main._sessions and session_id not in main._evicted_sessions
+    assert main._sessions[session_id]["turn_number"] == 1
+
+    # An evicted session still ends on the normal idle timeout.
+    main._sessions[session_id]["last_activity"] -= config.SESSION_IDLE_TIMEOUT_SEC + 1
+    assert client.portal.call(main.evict_idle_sessions_under_pressure) >= 1
+    assert client.portal.call(main.reap_sessions_idle_for, config.SESSION_IDLE_TIMEOUT_SEC, "idle_timeout") >= 1
+    assert session_id not in main._sessions and session_id not in main._evicted_sessions
+
+def test_memory_metrics_and_profiling_opt_in(client):
+    session_id = client.post("/api/session/start", json={"participantId": "demo_user-003", "conditionName": "none_static"}).json()["sessionId"]
+    report = client.get("/api/metrics/memory").json()
+    assert report["rss_bytes"] > 0 and report["components"]["sessions"] > 0
+    assert "nlp_doc_cache" in report["components"] and "formality_model_weights" in report["components"]
+    assert client.post("/api/debug/memory/snapshot").status_code == 404
+    client.post("/api/session/end", json={"sessionId": session_id})
+
+def test_idle_style_embeddings_spill_to_disk_and_are_exported(client, tmp_path):
+    import main
+    import numpy as np
+    from core.embedding_store import StyleEmbeddingStore
+    session = {"log_file_path": tmp_path / "participant_x_spill.jsonl", "last_activity": 0, "participantId": "x", "sessionId": "spill"}
+    store = StyleEmbeddingStore()
+    store.add("user", 1, np.ones(4))
+    main._sessions["spill"], main._style_embeddings["spill"] = session, store
+    try:
+        assert client.portal.call(main.spill_style_embeddings_under_pressure) == 1
+        assert "spill" not in main._style_embeddings
+        assert main.export_style_embeddings("spill", session) == tmp_path / "participant_x_spill_style_embeddings.npz"
+    finally:
+        main._sessions.pop("spill", None)
+
+def test_resumed_session_backlog_skips_the_greeting(tmp_path, monkeypatch):
+    import main
+    import numpy as np
+    encoded = []
+    monkeypatch.setattr(main.nlp_service, "encode_style", lambda texts: encoded.extend(texts) or np.ones((len(texts), 4), dtype=np.float32))
+    session = {"log_file_path": tmp_path / "participant_x_resumed.jsonl", "turn_number": 2, "history": [
+        {"role": "assistant", "content": "Hello! How are you?", "turn_number": 0},
+        {"role": "user", "content": "fine", "turn_number": 1},
+        {"role": "assistant", "content": "Great.", "turn_number": 1},
+    ]}
+    try:
+        assert main.record_style_embeddings("resumed", session, "and you?", "Doing well.") == 1.0
+        assert encoded == ["fine", "Great.", "and you?", "Doing well."]
+        assert main._style_embeddings["resumed"].turn_numbers == [1, 1, 2, 2]
+    finally:
+        main._style_embeddings.pop("resumed", None)
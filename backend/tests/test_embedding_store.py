@@ -0,0 +1,30 @@
+# backend/tests/test_embedding_store.py
+import numpy as np
+from core.embedding_store import StyleEmbeddingStore
+
+def test_user_window_mean_uses_only_earlier_user_turns():
+    store = StyleEmbeddingStore()
+    for turn in range(1, 6):
+        store.add("user", turn, np.full(4, turn))
+        store.add("assistant", turn, np.zeros(4))
+
+    assert store.vectors.dtype == np.float32
+    assert store.vectors.shape == (10, 4)
+    assert np.allclose(store.user_window_mean(before_turn=5), np.full(4, 3.0))
+    assert store.user_window_mean(before_turn=1) is None
+
+def test_save_round_trips_vectors(tmp_path):
+    store = StyleEmbeddingStore()
+    store.add("user", 1, [1.0, 0.0])
+    store.add("assistant", 1, [0.0, 1.0])
+
+    path = store.save(tmp_path / "session_style_embeddings.npz")
+    saved = np.load(path)
+
+    assert np.array_equal(saved["vectors"], store.vectors)
+    assert list(saved["roles"]) == ["user", "assistant"]
+    assert store.cosine(store.vectors[0], store.vectors[1]) == 0.0
+
+    loaded = StyleEmbeddingStore.load(path)
+    assert np.array_equal(loaded.vectors, store.vectors)
+    assert (loaded.roles, loaded.turn_numbers) == (store.roles, store.turn_numbers)
@@ -0,0 +1,48 @@
+# backend/tests/test_export_logs.py
+import json
+import os
+import pytest
+pytest.importorskip("pyarrow")
+from core.log_archive import compact_session_log
+from export_logs import export_logs, load_events
+
+def write_log(path, events):
+    path.write_text("\n".join(json.dumps(e) for e in events) + "\n", encoding="utf-8")
+
+def test_export_flattens_traits_and_updates_incrementally(tmp_path):
+    log_dir, out_dir = tmp_path / "logs", tmp_path / "out"
+    log_dir.mkdir()
+    base = {"timestamp_utc": "2025-01-01T00:00:00+00:00", "participant_id": "01", "session_id": "s1", "avatar": True, "lsm": True, "avatarType": "premade"}
+    write_log(log_dir / "participant_01_s1.jsonl", [
+        {**base, "turn_number": 1, "event_type": "user_message", "content": "hi", "user_linguistic_traits": {"word_count": 1, "pronouns": {"i": False, "you": False, "we": False}}},
+        {**base, "turn_number": 1, "event_type": "bot_response", "content": "hello", "lsm_score_raw": 0.5, "unknown_field": 3},
+    ])
+    write_log(log_dir / "participant_02_s2.jsonl", [{**base, "participant_id": "02", "session_id": "s2", "lsm": False, "event_type": "session_end"}])
+
+    assert export_logs(log_dir, out_dir)["exported"] == 2
+
+    user_rows = load_events(out_dir, condition="premade_adaptive", event_type="user_message").to_pylist()
+    assert len(user_rows) == 1
+    assert user_rows[0]["user_linguistic_traits.word_count"] == 1
+    assert user_rows[0]["user_linguistic_traits.pronouns.i"] is False
+    bot_rows = load_events(out_dir, columns=["lsm_score_raw", "extra_json"], event_type="bot_response").to_pylist()
+    assert bot_rows == [{"lsm_score_raw": 0.5, "extra_json": json.dumps({"unknown_field": 3})}]
+
+    os.remove(log_dir / "participant_02_s2.jsonl")
+    summary = export_logs(log_dir, out_dir)
+    assert (summary["exported"], summary["unchanged"], summary["removed"]) == (0, 1, 1)
+    assert load_events(out_dir, condition="premade_static").num_rows == 0
+
+
+def test_compacted_log_replaces_its_raw_export(tmp_path):
+    log_dir, out_dir = tmp_path / "logs", tmp_path / "out"
+    log_dir.mkdir()
+    base = {"timestamp_utc": "2025-01-01T00:00:00+00:00", "participant_id": "01", "session_id": "s1", "avatar": True, "lsm": True, "avatarType": "premade"}
+    write_log(log_dir / "participant_01_s1.jsonl", [{**base, "event_type": "session_end", "end_reason": "client_request"}])
+    export_logs(log_dir, out_dir)
+
+    compact_session_log(log_dir / "participant_01_s1.jsonl")
+    summary = export_logs(log_dir, out_dir)
+    assert (summary["exported"], summary["removed"]) == (1, 0)
+    assert (out_dir / "events" / "participant_01_s1.parquet").exists()
+    assert load_events(out_dir, event_type="session_end").num_rows == 1
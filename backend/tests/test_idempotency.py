@@ -0,0 +1,60 @@
+# backend/tests/test_idempotency.py
+import asyncio
+import pytest
+from core.idempotency import IdempotencyCache, IdempotencyKeyReusedError
+
+def test_in_flight_duplicate_waits_for_first_result():
+    cache = IdempotencyCache(max_per_session=2)
+    calls = []
+
+    async def work():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        return len(calls)
+
+    async def run():
+        first, duplicate = await asyncio.gather(cache.run("s", "k", work), cache.run("s", "k", work))
+        replay = await cache.run("s", "k", work)
+        return first, duplicate, replay
+    assert asyncio.run(run()) == (1, 1, 1)
+    assert len(calls) == 1
+    assert cache.stats == {"executed": 1, "replayed": 1, "joined": 1}
+
+def test_failures_are_not_stored_and_results_are_bounded():
+    cache = IdempotencyCache(max_per_session=2)
+
+    async def fail():
+        raise ValueError("upstream error")
+
+    async def ok():
+        return "ok"
+
+    async def run():
+        with pytest.raises(ValueError):
+            await cache.run("s", "k", fail)
+        assert await cache.run("s", "k", ok) == "ok"
+        for key in ("k2", "k3"):
+            await cache.run("s", key, ok)
+    asyncio.run(run())
+    assert len(cache) == 2
+    cache.forget_session("s")
+    assert len(cache) == 0
+
+def test_reused_key_with_a_different_body_is_rejected():
+    cache = IdempotencyCache()
+    hello, bye = IdempotencyCache.hash_request({"message": "hello"}), IdempotencyCache.hash_request({"message": "bye"})
+
+    async def slow():
+        await asyncio.sleep(0.01)
+        return "reply to hello"
+
+    async def run():
+        first = asyncio.create_task(cache.run("s", "k", slow, hello))
+        await asyncio.sleep(0)
+        with pytest.raises(IdempotencyKeyReusedError):
+            await cache.run("s", "k", slow, bye)
+        assert await first == "reply to hello"
+        with pytest.raises(IdempotencyKeyReusedError):
+            await cache.run("s", "k", slow, bye)
+        assert await cache.run("s", "k", slow, hello) == "reply to hello"
+    asyncio.run(run())
@@ -0,0 +1,39 @@
+# backend/tests/test_log_archive.py
+import gzip
+from core.logging_service import log_event
+from core.log_archive import compact_session_log, restore_session_log, read_session_archive, list_session_logs
+
+def test_compacted_log_restores_original_bytes(tmp_path):
+    log_path = tmp_path / "participant_01_abc.jsonl"
+    session = {"participantId": "01", "sessionId": "abc", "turn_number": 0, "log_file_path": log_path,
+               "condition": {"avatar": True, "lsm": False, "avatarType": "premade"}}
+    log_event({"event_type": "session_start_backend", "initial_greeting": "Hey there"}, session_info=session)
+    for turn in range(1, 4):
+        session["turn_number"] = turn
+        log_event({"event_type": "user_message", "content": f"message {turn} ☺"}, session_info=session)
+        log_event({"event_type": "bot_response", "content": "ok", "system_instruction_used": "You are Kagami. " * 50}, session_info=session)
+    log_event({"event_type": "error", "error_source": "x"}, session_info={"log_file_path": log_path, "participantId": "02"})
+    with open(log_path, "a", encoding="utf-8") as f:
+        f.write("{truncated\n")
+    original = log_path.read_text(encoding="utf-8")
+
+    archive_path = compact_session_log(log_path)
+
+    assert not log_path.exists()
+    with gzip.open(archive_path, "rt", encoding="utf-8") as f:
+        assert f.read().count("You are Kagami.") == 50
+    assert sum(1 for _ in read_session_archive(archive_path)) == original.count("\n")
+    assert restore_session_log(archive_path, tmp_path / "restored.jsonl").read_text(encoding="utf-8") == original
+
+def test_fragment_written_after_compaction_is_merged_not_hiding_the_archive(tmp_path):
+    log_path = tmp_path / "participant_01_abc.jsonl"
+    session = {"participantId": "01", "sessionId": "abc", "turn_number": 1, "log_file_path": log_path,
+               "condition": {"avatar": True, "lsm": False, "avatarType": "premade"}}
+    log_event({"event_type": "session_end", "end_reason": "client_request"}, session_info=session)
+    archive_path = compact_session_log(log_path)
+    log_event({"event_type": "frontend_event"}, session_info=session)
+
+    assert list_session_logs(tmp_path) == [archive_path]
+    assert compact_session_log(log_path) == archive_path and not log_path.exists()
+    assert [e["event_type"] for e in read_session_archive(archive_path)] == ["session_end", "frontend_event"]
+
@@ -0,0 +1,42 @@
+# backend/tests/test_memory_budget.py
+import asyncio
+import numpy as np
+from core import memory_budget as mb
+from core.memory_budget import AllocationProfiler, MemoryBudget, estimate_bytes
+
+def test_estimate_counts_nested_containers_and_arrays():
+    small = estimate_bytes({"history": [{"content": "hi"}]})
+    large = estimate_bytes({"history": [{"content": "hi" * 10_000}], "vectors": np.zeros((100, 768), dtype=np.float32)})
+    assert large - small > 100 * 768 * 4 + 20_000
+
+def test_reliefs_run_in_order_until_rss_is_under_the_limit(monkeypatch):
+    rss = [3000]
+    monkeypatch.setattr(mb, "rss_bytes", lambda: rss[0])
+    calls = []
+    async def shrink():
+        calls.append("shrink")
+        rss[0] = 1500
+        return 10
+    async def evict():
+        calls.append("evict")
+        return 1
+
+    budget = MemoryBudget(soft_limit_bytes=2000)
+    budget.relief("shrink", shrink)
+    budget.relief("evict", evict)
+    actions = asyncio.run(budget.enforce())
+    assert calls == ["shrink"]
+    assert actions[0]["dropped"] == 10 and actions[0]["rss_after_bytes"] == 1500
+    assert asyncio.run(budget.enforce()) == []
+
+def test_profiler_diff_reports_growth_since_snapshot():
+    profiler = AllocationProfiler(frames=1)
+    assert profiler.diff() is None
+    try:
+        profiler.snapshot()
+        held = [bytearray(1024) for _ in range(1000)]
+        diff = profiler.diff()
+        assert diff["size_diff_bytes"] > 1000 * 1024 * 0.9
+        assert any("test_memory_budget.py" in entry["location"] for entry in diff["top"])
+    finally:
+        profiler.stop()
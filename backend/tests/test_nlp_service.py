@@ -1,4 +1,5 @@
 # backend/tests/test_nlp_service.py
+import pytest
 from core.nlp_service import NLPService
 
 def test_compute_lsm_returns_valid_score():
@@ -17,4 +18,123 @@ def test_compute_lsm_returns_valid_score():
     score = service.compute_lsm(text1, text2)
 
     assert isinstance(score, float)
-    assert 0.0 <= score <= 1.0
\ No newline at end of file
+    assert 0.0 <= score <= 1.0
+
+def test_windowed_profile_matches_concatenated_analysis():
+    """
+    Merging per-turn stats must give the same StyleProfile as analyzing the
+    space-joined window in one pass (the formality model is not loaded here).
+    """
+    import asyncio
+    import spacy
+    turns = ["Honestly I think we should go.", "maybe later tho", "What do you want to do?? 😊"]
+
+    merged_service = NLPService()
+    merged_service.spacy_nlp = spacy.load("en_core_web_sm", disable=["parser", "ner"])
+    merged_service.spacy_nlp.add_pipe("sentencizer")
+    merged_service.is_warmed_up = True
+    joined_service = NLPService()
+    joined_service.spacy_nlp = merged_service.spacy_nlp
+    joined_service.is_warmed_up = True
+
+    async def run():
+        merged = await merged_service.analyze_window([await merged_service.analyze_turn(t) for t in turns])
+        joined = await joined_service.analyze_text(" ".join(turns))
+        return merged, joined
+
+    merged, joined = asyncio.run(run())
+
+    assert merged.model_dump() == joined.model_dump()
+    assert merged.word_count == sum(merged_service._turn_cache[t].word_count for t in turns)
+
+
+# StyleProfiles produced by the single-pass analyze_text before the per-turn
+# rewrite (formality model not loaded; readability is checked against textstat).
+BASELINE_PROFILES = [
+    (["Honestly I think we should go.", "maybe later tho", "What do you want to do?? 😊"],
+     {"word_count": 19, "informal_score_regex": 0.47368421052631576, "hedging_score": 0.47368421052631576, "emoji": True,
+      "questioning": False, "exclamatory": False, "short": False, "question_count": 2, "exclamation_count": 0, "meta_request": None,
+      "sentiment_neg": 0.0, "sentiment_neu": 0.72, "sentiment_pos": 0.28, "sentiment_compound": 0.5661,
+      "avg_sentence_length": 6.333333333333333, "avg_word_length": 3.0526315789473686, "function_word_ratio": 0.3684210526315789,
+      "pronouns": {"i": True, "you": True, "we": True}}),
+    (["I guess it's kinda fine, sort of.", "We LOVE this!!! Can you make it shorter?"],
+     {"word_count": 22, "informal_score_regex": 0.36363636363636365, "hedging_score": 0.3181818181818182, "emoji": False,
+      "questioning": True, "exclamatory": True, "short": False, "question_count": 1, "exclamation_count": 3, "meta_request": "shorter",
+      "sentiment_neg": 0.0, "sentiment_neu": 0.631, "sentiment_pos": 0.369, "sentiment_compound": 0.7919,
+      "avg_sentence_length": 7.333333333333333, "avg_word_length": 2.727272727272727, "function_word_ratio": 0.18181818181818182,
+      "pronouns": {"i": True, "you": True, "we": True}}),
+    (["The report was submitted on time.", "", "Perhaps you could review it tomorrow."],
+     {"word_count": 14, "informal_score_regex": 0.42857142857142855, "hedging_score": 0.42857142857142855, "emoji": False,
+      "questioning": True, "exclamatory": False, "short": False, "question_count": 0, "exclamation_count": 0, "meta_request": None,
+      "sentiment_neg": 0.0, "sentiment_neu": 1.0, "sentiment_pos": 0.0, "sentiment_compound": 0.0,
+      "avg_sentence_length": 7.0, "avg_word_length": 4.285714285714286, "function_word_ratio": 0.35714285714285715,
+      "pronouns": {"i": False, "you": True, "we": False}}),
+    (["Hi.", "...", "wait\n\nwhat"],
+     {"word_count": 5, "informal_score_regex": 0.0, "hedging_score": 0.0, "emoji": False,
+      "questioning": False, "exclamatory": False, "short": True, "question_count": 0, "exclamation_count": 0, "meta_request": None,
+      "sentiment_neg": 0.0, "sentiment_neu": 1.0, "sentiment_pos": 0.0, "sentiment_compound": 0.0,
+      "avg_sentence_length": 2.5, "avg_word_length": 2.8, "function_word_ratio": 0.0,
+      "pronouns": {"i": False, "you": False, "we": False}}),
+    (["What?", "", ""],
+     {"word_count": 2, "informal_score_regex": 0.0, "hedging_score": 0.0, "emoji": False,
+      "questioning": True, "exclamatory": False, "short": True, "question_count": 1, "exclamation_count": 0, "meta_request": None,
+      "sentiment_neg": 0.0, "sentiment_neu": 1.0, "sentiment_pos": 0.0, "sentiment_compound": 0.0,
+      "avg_sentence_length": 1.0, "avg_word_length": 2.5, "function_word_ratio": 0.0,
+      "pronouns": {"i": False, "you": False, "we": False}}),
+]
+
+@pytest.mark.parametrize("turns, expected", BASELINE_PROFILES)
+def test_windowed_profile_matches_baseline_values(turns, expected):
+    import spacy
+    import textstat
+    service = NLPService()
+    service.spacy_nlp = spacy.load("en_core_web_sm", disable=["parser", "ner"])
+    service.spacy_nlp.add_pipe("sentencizer")
+    service.is_warmed_up = True
+
+    profile = service.analyze_window_sync([service.analyze_turn_sync(t) for t in turns]).model_dump()
+
+    assert {k: profile[k] for k in expected} == expected
+    assert (profile["empath_social"], profile["empath_cognitive"], profile["empath_affect"], profile["informality_score_model"]) == (0.0, 0.0, 0.0, None)
+    joined = " ".join(turns)
+    assert (profile["flesch_reading_ease"], profile["fk_grade"]) == (textstat.flesch_reading_ease(joined), textstat.flesch_kincaid_grade(joined))
+
+def test_window_sentence_count_matches_the_sentencizer_on_the_joined_text():
+    """Punctuation-only, empty and whitespace-edged messages must split sentences as they would once joined."""
+    import random
+    import spacy
+    service = NLPService()
+    service.spacy_nlp = spacy.load("en_core_web_sm", disable=["parser", "ner"])
+    service.spacy_nlp.add_pipe("sentencizer")
+    service.is_warmed_up = True
+    fragments = ["Hi.", "...", "wait\n\nwhat", "What?", "", " ", "  ", "\n", "ok", "ok.", "!!", ",", "- fine", " lead", "trail ",
+                 "a. b", "Yes!! no", "?", "x  y", "end.\n", "(yes.)", "😊", "no.  ", "\tTab."]
+    rng = random.Random(0)
+
+    for _ in range(2000):
+        turns = [rng.choice(fragments) for _ in range(rng.randint(1, 5))]
+        expected = len(list(service.spacy_nlp(" ".join(turns) or " ").sents)) or 1
+        assert service._joined_sentence_count([service.analyze_turn_sync(t) for t in turns]) == expected, turns
+
+def test_empty_text_is_cached_under_the_key_it_is_looked_up_by():
+    import spacy
+    service = NLPService()
+    service.spacy_nlp = spacy.blank("en")
+    service.spacy_nlp.add_pipe("sentencizer")
+    service.is_warmed_up = True
+
+    assert service.analyze_turn_sync("") is service.analyze_turn_sync("")
+    assert list(service._turn_cache) == [""]
+    assert service.analyze_text_sync("") is service.analyze_text_sync("")
+    assert service.analyze_text_sync("").word_count == 0
+
+
+def test_empath_matcher_matches_empath_analyze():
+    """The compiled matcher must score exactly like Empath, including categories Empath doesn't have."""
+    from core.nlp_service import EmpathMatcher, get_empath
+    categories = ["positive_emotion", "friends", "social_media", "affect"]
+    matcher = EmpathMatcher(get_empath(), categories)
+    texts = ["I love my friends so much, they make me happy", "Posted it on twitter and facebook lol", "", "Happy happy JOY joy!"]
+
+    for text in texts:
+        assert matcher.analyze(text, normalize=True) == get_empath().analyze(text, categories=categories, normalize=True)
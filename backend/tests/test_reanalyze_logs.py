@@ -0,0 +1,19 @@
+# backend/tests/test_reanalyze_logs.py
+import json
+from reanalyze_logs import read_turns, find_log_files, output_path_for
+
+def test_read_turns_pairs_messages_and_skips_outputs(tmp_path):
+    log_path = tmp_path / "participant_01_abc.jsonl"
+    events = [
+        {"event_type": "session_start_backend", "turn_number": 0},
+        {"event_type": "user_message", "turn_number": 1, "content": "hi", "user_linguistic_traits": {"lsm_score_prev": 0.5}},
+        {"event_type": "bot_response", "turn_number": 1, "content": "hello!"},
+        {"event_type": "user_message", "turn_number": 2, "content": "unanswered"},
+    ]
+    log_path.write_text("\n".join(json.dumps(e) for e in events) + "\n{not json\n", encoding="utf-8")
+    output_path_for(log_path, "abc123").write_text("", encoding="utf-8")
+
+    turns = read_turns(log_path)
+
+    assert turns == [{"turn_number": 1, "user": "hi", "lsm_score_prev": 0.5, "bot": "hello!"}]
+    assert find_log_files(tmp_path) == [log_path]
@@ -0,0 +1,21 @@
+# backend/tests/test_session_locks.py
+import asyncio
+from core.session_locks import KeyedLockRegistry
+
+def test_same_session_serializes_and_other_sessions_overlap():
+    registry = KeyedLockRegistry()
+    events = []
+
+    async def turn(sid, name):
+        async with registry.hold(sid):
+            events.append(f"{name}:start")
+            await asyncio.sleep(0.01)
+            events.append(f"{name}:end")
+
+    async def run():
+        await asyncio.gather(turn("a", "a1"), turn("a", "a2"), turn("b", "b1"))
+    asyncio.run(run())
+
+    assert events.index("a1:end") < events.index("a2:start")
+    assert events.index("b1:start") < events.index("a1:end")
+    assert len(registry) == 0 and not registry.is_busy("a")
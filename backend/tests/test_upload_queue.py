@@ -0,0 +1,57 @@
+# backend/tests/test_upload_queue.py
+import asyncio
+from drive_upload import UploadQueue, LocalDirectoryBackend
+
+class FlakyBackend(LocalDirectoryBackend):
+    def __init__(self, target_dir, failures):
+        super().__init__(target_dir)
+        self.failures = failures
+        self.calls = 0
+
+    def upload(self, filepath, mimetype):
+        self.calls += 1
+        if self.calls <= self.failures:
+            raise ConnectionError("drive unavailable")
+        return super().upload(filepath, mimetype)
+
+def test_pending_uploads_survive_restart_and_retry(tmp_path):
+    log_path = tmp_path / "participant_01_abc.jsonl.gz"
+    log_path.write_bytes(b"log")
+    queue_dir, remote_dir = tmp_path / "queue", tmp_path / "remote"
+
+    # Queued but never started, as if the server stopped before uploading.
+    UploadQueue(LocalDirectoryBackend(remote_dir), queue_dir).enqueue(log_path, "abc", "application/gzip")
+    assert len(list(queue_dir.glob("*.json"))) == 1
+    # The log directory does not survive a redeploy; the queue keeps its own copy.
+    log_path.unlink()
+
+    backend = FlakyBackend(remote_dir, failures=2)
+    queue = UploadQueue(backend, queue_dir, backoff_base_sec=0.01, backoff_max_sec=0.05)
+
+    async def run():
+        await queue.start()
+        await asyncio.wait_for(queue.join(), timeout=5)
+        await queue.stop()
+    asyncio.run(run())
+
+    assert (remote_dir / log_path.name).read_bytes() == b"log"
+    assert backend.calls == 3
+    assert queue.stats == {"uploaded": 1, "retried": 2, "failed": 0}
+    assert not list(queue_dir.glob("*.json"))
+    assert not list((queue_dir / "files").iterdir())
+
+def test_upload_gives_up_after_max_attempts(tmp_path):
+    log_path = tmp_path / "participant_01_abc.jsonl.gz"
+    log_path.write_bytes(b"log")
+    queue = UploadQueue(FlakyBackend(tmp_path / "remote", failures=10), tmp_path / "queue",
+                        max_attempts=3, backoff_base_sec=0.01, backoff_max_sec=0.05)
+
+    async def run():
+        await queue.start()
+        queue.enqueue(log_path, "abc", "application/gzip")
+        await asyncio.wait_for(queue.join(), timeout=5)
+        await queue.stop()
+    asyncio.run(run())
+
+    assert queue.stats["failed"] == 1
+    assert len(list((tmp_path / "queue" / "failed").glob("*.json"))) == 1
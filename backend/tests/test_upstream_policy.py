@@ -0,0 +1,68 @@
+# backend/tests/test_upstream_policy.py
+import asyncio
+import pytest
+from core.upstream_policy import UpstreamPolicy, CircuitBreaker, RetryBudget, UpstreamUnavailableError
+
+def make_request(delays):
+    """Each call takes the next delay; a delay of None fails with ConnectionError."""
+    calls = iter(delays)
+    async def request():
+        delay = next(calls)
+        if delay is None:
+            raise ConnectionError("upstream error")
+        await asyncio.sleep(delay)
+        return delay
+    return request
+
+def test_slow_primary_is_hedged():
+    policy = UpstreamPolicy("test", deadline_sec=1.0, hedge_default_delay_sec=0.05, hedge_min_delay_sec=0.0)
+    result, info = asyncio.run(policy.call(make_request([0.5, 0.01])))
+    assert result == 0.01
+    assert (info["winner"], info["winning_attempt"], info["attempts"]) == ("hedge", 2, 2)
+    assert info["total_latency_sec"] < 0.3
+
+def test_failures_are_retried_then_open_the_circuit():
+    policy = UpstreamPolicy("test", deadline_sec=1.0, hedge=False, retry_base_delay_sec=0.001,
+                            breaker=CircuitBreaker(failure_threshold=1, reset_timeout_sec=60))
+    result, info = asyncio.run(policy.call(make_request([None, 0.0])))
+    assert (result, info["winner"], info["attempts"]) == (0.0, "retry", 2)
+
+    with pytest.raises(UpstreamUnavailableError) as exhausted:
+        asyncio.run(policy.call(make_request([None, None, None])))
+    assert exhausted.value.reason == "attempts_exhausted"
+    with pytest.raises(UpstreamUnavailableError) as rejected:
+        asyncio.run(policy.call(make_request([0.0])))
+    assert rejected.value.reason == "circuit_open"
+
+def test_deadline_and_retry_budget_bound_the_call():
+    policy = UpstreamPolicy("test", deadline_sec=0.05, hedge=False, budget=RetryBudget(ratio=0.0, max_tokens=0))
+    with pytest.raises(UpstreamUnavailableError) as timed_out:
+        asyncio.run(policy.call(make_request([1.0])))
+    assert timed_out.value.reason == "deadline_exceeded"
+    with pytest.raises(UpstreamUnavailableError) as no_budget:
+        asyncio.run(policy.call(make_request([None, 0.0])))
+    assert no_budget.value.reason == "attempts_exhausted"
+
+def test_half_open_trial_always_records_an_outcome():
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout_sec=0.0)
+    policy = UpstreamPolicy("test", deadline_sec=1.0, hedge=False, is_retryable=lambda e: False, breaker=breaker)
+    breaker.record_failure()
+
+    # A non-retryable error shows the upstream is reachable: the trial closes the breaker.
+    with pytest.raises(UpstreamUnavailableError):
+        asyncio.run(policy.call(make_request([None])))
+    assert breaker.state == "closed"
+
+    # A cancelled trial re-opens the breaker, so the next reset window lets another trial through.
+    breaker.record_failure()
+    async def cancel_trial():
+        task = asyncio.create_task(policy.call(make_request([1.0])))
+        await asyncio.sleep(0.01)
+        assert breaker.state == "half_open"
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+    asyncio.run(cancel_trial())
+    assert breaker.state == "open"
+    result, _ = asyncio.run(policy.call(make_request([0.0])))
+    assert (result, breaker.state) == (0.0, "closed")
@@ -11,7 +11,12 @@ const apiClient = axios.create({
 
 axiosRetry(apiClient, {
   retries: 3,
-  retryDelay: axiosRetry.exponentialDelay,
+  retryDelay: (retryCount, error) => {
+    // 503s come from server-side admission control; wait as long as it asks.
+    const retryAfterSec = Number(error.response?.headers?.['retry-after']);
+    if (error.response?.status === 503 && retryAfterSec > 0) return retryAfterSec * 1000;
+    return axiosRetry.exponentialDelay(retryCount);
+  },
   retryCondition: (error) => {
     return axios.isAxiosError(error) && error.response?.status >= 500;
   },
@@ -24,8 +29,14 @@ export const startSession = async (participantId, conditionName) => {
   return response.data;
 };
 
+// One key per logical request: axios-retry re-sends the same config, so the
+// backend recognises retries and returns the first result instead of re-running it.
+const randomId = () => (window.crypto?.randomUUID?.() ?? `${Date.now()}-${Math.random().toString(36).slice(2)}`);
+
 export const sendMessage = async (sessionId, message) => {
-  const response = await apiClient.post('/api/session/message', { sessionId, message });
+  const response = await apiClient.post('/api/session/message', { sessionId, message }, {
+    headers: { 'Idempotency-Key': randomId() },
+  });
   return response.data; 
 };
 
@@ -36,11 +47,81 @@ export const setAvatarDetails = async (sessionId, avatarUrl, avatarPrompt = null
 };
 
 export const generateAvatar = async (sessionId, prompt) => {
-    const response = await apiClient.post('/api/avatar/generate', { sessionId, prompt });
+    const response = await apiClient.post('/api/avatar/generate', { sessionId, prompt }, {
+      headers: { 'Idempotency-Key': randomId() },
+    });
     return response.data;
 };
 
+// --- Frontend Event Buffer ---
+// Events are buffered and sent to /api/log/frontend_events in batches, every
+// EVENT_FLUSH_INTERVAL_MS or with sendBeacon when the page is hidden or unloaded.
+// Each event carries a per-page sequence number, so the backend can drop replays
+// when a batch is sent twice (e.g. a beacon racing an in-flight flush).
+const EVENT_FLUSH_INTERVAL_MS = 5000;
+const EVENT_BATCH_SIZE = 50;
+const MAX_BUFFERED_EVENTS = 1000;
+const EVENTS_URL = `${API_BASE_URL}/api/log/frontend_events`;
+
+const eventClientId = randomId();
+let eventSeq = 0;
+let eventBuffer = [];
+let flushInFlight = null;
+
+const groupEventBatches = (events) => {
+  const groups = new Map();
+  events.forEach(({ sessionId, participantId, ...event }) => {
+    const key = `${sessionId ?? ''}|${participantId ?? ''}`;
+    if (!groups.has(key)) groups.set(key, { sessionId, participantId, clientId: eventClientId, events: [] });
+    groups.get(key).events.push(event);
+  });
+  return [...groups.values()];
+};
+
+const dropSentEvents = (sent) => {
+  const sentSeqs = new Set(sent.map((event) => event.seq));
+  eventBuffer = eventBuffer.filter((event) => !sentSeqs.has(event.seq));
+};
+
+export const flushFrontendEvents = () => {
+  if (flushInFlight || eventBuffer.length === 0) return flushInFlight ?? Promise.resolve();
+  const batch = eventBuffer.slice(0, EVENT_BATCH_SIZE);
+  flushInFlight = (async () => {
+    try {
+      for (const group of groupEventBatches(batch)) {
+        await apiClient.post('/api/log/frontend_events', group);
+      }
+      dropSentEvents(batch);
+    } catch (error) {
+      console.error('Failed to flush frontend events; will retry.', error);
+    } finally {
+      flushInFlight = null;
+    }
+  })();
+  return flushInFlight;
+};
+
+const beaconFrontendEvents = () => {
+  if (eventBuffer.length === 0) return;
+  if (!navigator.sendBeacon) {
+    flushFrontendEvents();
+    return;
+  }
+  const batch = [...eventBuffer];
+  const queued = groupEventBatches(batch).every((group) =>
+    navigator.sendBeacon(EVENTS_URL, new Blob([JSON.stringify(group)], { type: 'application/json' }))
+  );
+  if (queued) dropSentEvents(batch);
+};
+
+setInterval(flushFrontendEvents, EVENT_FLUSH_INTERVAL_MS);
+window.addEventListener('pagehide', beaconFrontendEvents);
+document.addEventListener('visibilitychange', () => {
+  if (document.visibilityState === 'hidden') beaconFrontendEvents();
+});
+
 export const endSession = (sessionId) => {
+  beaconFrontendEvents();
   const url = `${API_BASE_URL}/api/session/end`;
   const data = JSON.stringify({ sessionId });
   if (navigator.sendBeacon) {
@@ -51,6 +132,8 @@ export const endSession = (sessionId) => {
   }
 };
 
-export const logFrontendEvent = async (payload) => {
-  await apiClient.post('/api/log/frontend_event', payload);
-};
\ No newline at end of file
+export const logFrontendEvent = async ({ sessionId, participantId, eventType, eventData = {} }) => {
+  eventBuffer.push({ sessionId, participantId, seq: eventSeq++, eventType, eventData, clientTimestamp: new Date().toISOString() });
+  if (eventBuffer.length > MAX_BUFFERED_EVENTS) eventBuffer.splice(0, eventBuffer.length - MAX_BUFFERED_EVENTS);
+  if (eventBuffer.length >= EVENT_BATCH_SIZE) flushFrontendEvents();
+};